@@ -8,7 +8,7 @@ from flask_compress import Compress
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 
-from archivy import helpers
+from archivy import helpers, builtin_search
 from archivy.api import api_bp
 from archivy.models import User
 from archivy.config import Config
@@ -33,7 +33,7 @@ with app.app_context():
     app.config["SCRAPING_PATTERNS"] = helpers.load_scraper()
 if app.config["SEARCH_CONF"]["enabled"]:
     with app.app_context():
-        search_engines = ["elasticsearch", "ripgrep"]
+        search_engines = ["elasticsearch", "ripgrep", "builtin"]
         es = None
         if (
             "engine" not in app.config["SEARCH_CONF"]
@@ -49,13 +49,15 @@ if app.config["SEARCH_CONF"]["enabled"]:
             es = get_elastic_client(error_if_invalid=False)
             if es:
                 app.config["SEARCH_CONF"]["engine"] = "elasticsearch"
-            else:
-                if which("rg"):
-                    app.config["SEARCH_CONF"]["engine"] = "ripgrep"
+            elif which("rg"):
+                app.config["SEARCH_CONF"]["engine"] = "ripgrep"
             engine = app.config["SEARCH_CONF"]["engine"]
             if engine == "none":
-                app.logger.warning("No working search engine found. Disabling search.")
-                app.config["SEARCH_CONF"]["enabled"] = 0
+                app.logger.warning(
+                    "No Elasticsearch or ripgrep installation found. Falling back to"
+                    " the builtin search engine."
+                )
+                app.config["SEARCH_CONF"]["engine"] = "builtin"
             else:
                 app.logger.info(f"Running {engine} installation found.")
 
@@ -68,6 +70,16 @@ if app.config["SEARCH_CONF"]["enabled"]:
                 )
             except RequestError:
                 app.logger.info("Elasticsearch index already created")
+        if (
+            app.config["SEARCH_CONF"]["engine"] == "builtin"
+            and not builtin_search.index_exists()
+        ):
+            # building it can take a while, so it is left to `archivy run` or
+            # `archivy index` instead of slowing down every import
+            app.logger.warning(
+                "The builtin search index hasn't been built yet. `archivy run` will"
+                " build it in the background, or run `archivy index`."
+            )
         if app.config["SEARCH_CONF"]["engine"] == "ripgrep" and not which("rg"):
             app.logger.info("Ripgrep not found on system. Disabling search.")
             app.config["SEARCH_CONF"]["enabled"] = 0
@@ -87,9 +99,8 @@ Compress(app)
 
 @login_manager.user_loader
 def load_user(user_id):
-    db = helpers.get_db()
-    res = db.get(doc_id=int(user_id))
-    if res and res["type"] == "user":
+    res = helpers.get_store().get_user(int(user_id))
+    if res:
         return User.from_db(res)
     return None
 
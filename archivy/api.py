@@ -1,13 +1,29 @@
-from flask import Response, jsonify, request, Blueprint, current_app
+import base64
+import json
+from pathlib import Path
+
+from flask import (
+    Response,
+    jsonify,
+    request,
+    Blueprint,
+    current_app,
+    url_for,
+    stream_with_context,
+)
 from werkzeug.security import check_password_hash
 from flask_login import login_user
-from tinydb import Query
 
-from archivy import data, tags
+from archivy import data, jobs, links, tags
 from archivy.search import search
 from archivy.models import DataObj, User
-from archivy.helpers import get_db
-
+from archivy.helpers import (
+    get_store,
+    file_validators,
+    is_not_modified,
+    is_precondition_failed,
+    set_validators,
+)
 
 api_bp = Blueprint("api", __name__)
 
@@ -19,13 +35,12 @@ def login():
     [HTTP Basic Auth](https://en.wikipedia.org/wiki/Basic_access_authentication).
     Pass in the username and password of your account.
     """
-    db = get_db()
-    user = db.search(Query().username == request.authorization["username"])
+    user = get_store().find_user(request.authorization["username"])
     if user and check_password_hash(
-        user[0]["hashed_password"], request.authorization["password"]
+        user["hashed_password"], request.authorization["password"]
     ):
         # user is verified so we can log him in from the db
-        user = User.from_db(user[0])
+        user = User.from_db(user)
         login_user(user, remember=True)
         return Response(status=200)
     return Response(status=401)
@@ -42,16 +57,29 @@ def create_bookmark():
     - **url** (required)
     - **tags**
     - **path**
+
+    If the url has already been bookmarked, the id of the existing bookmark
+    is returned, unless `SCRAPING_CONF["duplicates"]` says otherwise.
+
+    If background jobs are enabled in `JOBS_CONF`, the bookmark is saved in
+    the background and a `202` response with the `job_id` is returned. Use
+    [`/api/jobs/<job_id>`](#archivy.api.get_job) to follow its progress.
     """
     json_data = request.get_json()
+    if current_app.config["JOBS_CONF"]["enabled"]:
+        job_id = _enqueue_bookmark(json_data)
+        return (
+            jsonify(job_id=job_id),
+            202,
+            {"Location": url_for("api.get_job", job_id=job_id)},
+        )
     bookmark = DataObj(
         url=json_data["url"],
         tags=json_data.get("tags", []),
         path=json_data.get("path", current_app.config["DEFAULT_BOOKMARKS_DIR"]),
         type="bookmark",
     )
-    bookmark.process_bookmark_url()
-    bookmark_id = bookmark.insert()
+    bookmark_id = bookmark.insert_bookmark()
     if bookmark_id:
         return jsonify(
             bookmark_id=bookmark_id,
@@ -59,6 +87,30 @@ def create_bookmark():
     return Response(status=400)
 
 
+def _enqueue_bookmark(json_data):
+    return jobs.enqueue(
+        "bookmark",
+        {
+            "url": json_data["url"],
+            "tags": json_data.get("tags", []),
+            "path": json_data.get("path", current_app.config["DEFAULT_BOOKMARKS_DIR"]),
+        },
+    )
+
+
+@api_bp.route("/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Returns the `status` (`queued`, `running`, `done` or `failed`) of a
+    background job, its number of `attempts`, its `result` once done
+    (eg. the `dataobj_id` of a bookmark) and its last `error`.
+    """
+    job = jobs.get_job(job_id)
+    if not job:
+        return Response(status=404)
+    return jsonify(job)
+
+
 @api_bp.route("/notes", methods=["POST"])
 def create_note():
     """
@@ -87,20 +139,120 @@ def create_note():
     return Response(status=400)
 
 
+# number of dataobjs written and indexed together by the bulk endpoint
+BULK_BATCH_SIZE = 500
+
+
+def _dataobj_from_item(item):
+    if item.get("type", "note") == "note":
+        return DataObj(
+            title=item["title"],
+            content=item["content"],
+            path=item.get("path", ""),
+            tags=item.get("tags", []),
+            type="note",
+        )
+    if item["type"] == "bookmark":
+        return DataObj(
+            url=item["url"],
+            title=item.get("title", ""),
+            content=item.get("content", ""),
+            tags=item.get("tags", []),
+            path=item.get("path", current_app.config["DEFAULT_BOOKMARKS_DIR"]),
+            type="bookmark",
+        )
+    raise ValueError(f"Unsupported type {item['type']}")
+
+
+@api_bp.route("/dataobjs/bulk", methods=["POST"])
+def create_dataobjs_bulk():
+    """
+    Creates many notes and bookmarks at once.
+
+    The body is either a JSON array of dataobjs, or one JSON dataobj per line
+    with the `application/x-ndjson` content type. Each dataobj has the
+    parameters of the [note](#archivy.api.create_note) or
+    [bookmark](#archivy.api.create_bookmark) endpoints, and a **type**
+    (`note` by default, or `bookmark`).
+
+    Bookmarks sent with their `content` are saved as is. The others are
+    downloaded like single bookmarks: urls that have already been saved follow
+    `SCRAPING_CONF["duplicates"]`, and if background jobs are enabled in
+    `JOBS_CONF`, they're queued and their `job_id` is returned instead.
+
+    Returns a list with, for each dataobj, either its `dataobj_id`, a `job_id`
+    or an `error`.
+    """
+    if request.mimetype == "application/x-ndjson":
+        items = (line for line in request.stream if line.strip())
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return Response("Must provide a list of dataobjs", status=400)
+
+    results = []
+    batch = []
+
+    def flush():
+        ids = DataObj.insert_many([dataobj for _, dataobj in batch])
+        for (index, _), dataobj_id in zip(batch, ids):
+            results[index] = (
+                {"dataobj_id": dataobj_id} if dataobj_id else {"error": "Invalid data"}
+            )
+        batch.clear()
+
+    for item in items:
+        results.append(None)
+        try:
+            if isinstance(item, bytes):
+                item = json.loads(item)
+            dataobj = _dataobj_from_item(item)
+            if dataobj.type == "bookmark" and "content" not in item:
+                if current_app.config["JOBS_CONF"]["enabled"]:
+                    results[-1] = {"job_id": _enqueue_bookmark(item)}
+                else:
+                    dataobj_id = dataobj.insert_bookmark()
+                    results[-1] = (
+                        {"dataobj_id": dataobj_id}
+                        if dataobj_id
+                        else {"error": "Invalid data"}
+                    )
+            else:
+                batch.append((len(results) - 1, dataobj))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            results[-1] = {"error": f"Invalid data: {e}"}
+        if len(batch) == BULK_BATCH_SIZE:
+            flush()
+    flush()
+    return jsonify(results)
+
+
 @api_bp.route("/dataobjs/<int:dataobj_id>")
 def get_dataobj(dataobj_id):
-    """Returns dataobj of given id"""
-    dataobj = data.get_item(dataobj_id)
+    """
+    Returns dataobj of given id.
 
-    return (
+    The response has an `ETag` and a `Last-Modified` header. Send them back
+    in `If-None-Match` or `If-Modified-Since` to get an empty `304` response
+    if the dataobj hasn't changed.
+    """
+    filepath = data.get_by_id(dataobj_id)
+    validators = filepath and file_validators(filepath)
+    if not validators:
+        return Response(status=404)
+    if is_not_modified(validators):
+        return set_validators(Response(status=304), validators)
+    dataobj = data.get_item(dataobj_id)
+    if not dataobj:
+        return Response(status=404)
+    return set_validators(
         jsonify(
             dataobj_id=dataobj_id,
             title=dataobj["title"],
             content=dataobj.content,
             md_path=dataobj["fullpath"],
-        )
-        if dataobj
-        else Response(status=404)
+        ),
+        validators,
     )
 
 
@@ -121,11 +273,17 @@ def update_dataobj(dataobj_id):
     Paramter in JSON body:
 
     - **content**: markdown text of new dataobj.
+
+    Pass the `ETag` of the dataobj in the `If-Match` header to only update it
+    if it hasn't been modified since. Otherwise, a `412` response is returned.
     """
     if request.json.get("content"):
+        filepath = data.get_by_id(dataobj_id)
+        if is_precondition_failed(filepath and file_validators(filepath)):
+            return Response(status=412)
         try:
             data.update_item_md(dataobj_id, request.json.get("content"))
-            return Response(status=200)
+            return set_validators(Response(status=200), file_validators(filepath))
         except BaseException:
             return Response(status=404)
     return Response("Must provide content parameter", status=401)
@@ -139,24 +297,147 @@ def update_dataobj_frontmatter(dataobj_id):
     Paramter in JSON body:
 
     - **title**: the new title of the dataobj.
+
+    Supports the `If-Match` header, like [updates of the
+    content](#archivy.api.update_dataobj).
     """
 
     new_frontmatter = {
         "title": request.json.get("title"),
     }
+    filepath = data.get_by_id(dataobj_id)
+    if is_precondition_failed(filepath and file_validators(filepath)):
+        return Response(status=412)
 
     try:
         data.update_item_frontmatter(dataobj_id, new_frontmatter)
-        return Response(status=200)
+        return set_validators(Response(status=200), file_validators(filepath))
     except BaseException:
         return Response(status=404)
 
 
+@api_bp.route("/dataobjs/<int:dataobj_id>/links", methods=["GET"])
+def get_dataobj_links(dataobj_id):
+    """
+    Returns the ids of the dataobjs linking to (`backlinks`) and linked to
+    (`outlinks`) by the dataobj of given id.
+    """
+    if not data.get_by_id(dataobj_id):
+        return Response(status=404)
+    return jsonify(
+        backlinks=links.get_backlinks(dataobj_id),
+        outlinks=links.get_outlinks(dataobj_id),
+    )
+
+
+@api_bp.route("/dataobjs/<int:dataobj_id>/neighbourhood", methods=["GET"])
+def get_dataobj_neighbourhood(dataobj_id):
+    """
+    Returns the part of the link graph around the dataobj of given id, as
+    `nodes` ids and `[source, target]` `edges`.
+
+    Request URL Parameter:
+    - **hops** - how many links away from the dataobj to go. Defaults to 1.
+    """
+    if not data.get_by_id(dataobj_id):
+        return Response(status=404)
+    hops = request.args.get("hops", 1, type=int)
+    return jsonify(links.get_neighbourhood(dataobj_id, hops=hops))
+
+
+def _encode_cursor(relpath):
+    return base64.urlsafe_b64encode(relpath.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    return base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+
+
+def _dataobj_json(relpath, metadata, depth, fields=None):
+    fullpath = str(Path(*relpath.split("/")[depth:-1]))
+    if fields is None:
+        return {"content": "", "metadata": {**metadata, "fullpath": fullpath}}
+    dataobj = {}
+    for field in fields:
+        if field == "fullpath":
+            dataobj[field] = fullpath
+        elif field == "content":
+            dataobj[field] = data.load_frontmatter(
+                data.get_data_dir() / relpath, load_content=True
+            ).content
+        else:
+            dataobj[field] = metadata.get(field)
+    return dataobj
+
+
 @api_bp.route("/dataobjs", methods=["GET"])
 def get_dataobjs():
-    """Gets all dataobjs"""
-    cur_dir = data.get_items(structured=False, json_format=True)
-    return jsonify(cur_dir)
+    """
+    Gets all dataobjs.
+
+    Request URL Parameters:
+    - **path** - only return the dataobjs inside this directory.
+    - **type** - only return dataobjs of this type, eg. bookmark / note
+    - **tag** - only return dataobjs with this tag.
+    - **fields** - comma separated list of the fields to return, eg.
+      `id,title`. Dataobjs are then returned as flat objects. Their `content`
+      is only read if it is one of the fields.
+    - **limit** - maximum number of dataobjs to return. If there are more,
+      the `X-Next-Cursor` response header is set.
+    - **cursor** - pass the `X-Next-Cursor` of the previous response to get
+      the next page.
+    - **format** - `ndjson` to stream the dataobjs one JSON object per line,
+      instead of returning a JSON array. Also used when the request accepts
+      `application/x-ndjson`.
+
+    Paginated dataobjs are sorted by path.
+    """
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        return Response("limit must be a positive integer", status=400)
+    after = None
+    if request.args.get("cursor"):
+        try:
+            after = _decode_cursor(request.args["cursor"])
+        except ValueError:
+            return Response("Invalid cursor", status=400)
+    fields = request.args.get("fields")
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+
+    path = request.args.get("path", "")
+    try:
+        results = data.query_items(
+            path,
+            type=request.args.get("type"),
+            tag=request.args.get("tag"),
+            after=after,
+            limit=limit + 1 if limit is not None else None,
+        )
+    except FileNotFoundError:
+        return Response("Directory not found", status=404)
+    headers = {}
+    if limit is not None:
+        results = list(results)
+        if len(results) > limit:
+            results = results[:limit]
+            headers["X-Next-Cursor"] = _encode_cursor(results[-1][0])
+
+    depth = len(Path(path).parts)
+    dataobjs = (
+        _dataobj_json(relpath, metadata, depth, fields) for relpath, metadata in results
+    )
+    if (
+        request.args.get("format") == "ndjson"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    ):
+        lines = (current_app.json.dumps(dataobj) + "\n" for dataobj in dataobjs)
+        return Response(
+            stream_with_context(lines),
+            mimetype="application/x-ndjson",
+            headers=headers,
+        )
+    return jsonify(list(dataobjs)), 200, headers
 
 
 @api_bp.route("/tags/add_to_index", methods=["PUT"])
@@ -181,6 +462,26 @@ def local_edit(dataobj_id):
     return Response(status=404)
 
 
+@api_bp.route("/folders", methods=["GET"])
+def get_folder():
+    """
+    Returns the contents of a single directory, used to lazily
+    load the directory tree.
+
+    Request URL Parameter:
+    - **path** - path of the directory. Defaults to the root directory.
+
+    Returns its child directories (`name`, `path` and their own number of
+    child directories `n_dirs` and files `n_files`) and the `id` and `title`
+    of its files.
+    """
+    try:
+        listing = data.get_dir_listing(request.args.get("path", ""))
+    except FileNotFoundError:
+        return Response("Directory not found", status=404)
+    return jsonify(listing)
+
+
 @api_bp.route("/folders/new", methods=["POST"])
 def create_folder():
     """
@@ -220,13 +521,30 @@ def search_endpoint():
     """
     Searches the instance.
 
-    Request URL Parameter:
+    Request URL Parameters:
     - **query**
+    - **limit** - maximum number of results to return. Defaults to
+      `SEARCH_CONF["default_limit"]`.
+    - **offset** - number of results to skip
+    - **max_count** - with ripgrep, maximum number of matching lines to return per note
     """
-    if not current_app.config["SEARCH_CONF"]["enabled"]:
+    search_conf = current_app.config["SEARCH_CONF"]
+    if not search_conf["enabled"]:
         return Response("Search is disabled", status=401)
     query = request.args.get("query")
-    search_results = search(query)
+    params = {}
+    for name, default in (("limit", None), ("offset", 0), ("max_count", None)):
+        value = request.args.get(name, default)
+        if value is None:
+            params[name] = None
+            continue
+        try:
+            params[name] = int(value)
+            if params[name] < 0:
+                raise ValueError
+        except ValueError:
+            return Response(f"{name} must be a non-negative integer", status=400)
+    search_results = search(query, **params)
     return jsonify(search_results)
 
 
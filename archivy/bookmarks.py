@@ -0,0 +1,112 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from archivy import helpers, data
+
+# query parameters that only track where visitors come from
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "mc_cid",
+    "mc_eid",
+    "igshid",
+    "_ga",
+    "yclid",
+}
+TRACKING_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    """
+    Returns a normalized version of `url`, identical for urls pointing to the
+    same page:
+
+    - `http` and `https` are considered the same
+    - the host is lowercased and default ports are removed
+    - trailing slashes, fragments and tracking parameters like `utm_source` are removed
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme in DEFAULT_PORTS:
+        scheme = "https"
+    host = (parts.hostname or "").rstrip(".")
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+    query = urlencode(
+        [
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if key.lower() not in TRACKING_PARAMS
+            and not key.lower().startswith(TRACKING_PREFIXES)
+        ]
+    )
+    return urlunsplit((scheme, host, parts.path.rstrip("/"), query, ""))
+
+
+def build_url_index():
+    """Builds the normalized url -> bookmark ids index by reading every dataobj."""
+    url_index = {}
+    for dataobj in data.get_items(structured=False):
+        if "id" in dataobj and dataobj.get("url"):
+            url_index.setdefault(normalize_url(dataobj["url"]), []).append(
+                dataobj["id"]
+            )
+    return url_index
+
+
+URL_INDEX = "urls"
+
+
+def get_url_index(force=False):
+    """
+    Returns the persisted index mapping the normalized url of each bookmark
+    to the ids of the bookmarks saved for it, oldest first.
+
+    The index is kept in the internal store and kept up to date as bookmarks
+    are created and deleted. Use `force=True` to rebuild it from the files.
+    """
+    store = helpers.get_store()
+    if store.index_exists(URL_INDEX) and not force:
+        return store.get_index(URL_INDEX)
+
+    url_index = build_url_index()
+    store.replace_index(URL_INDEX, url_index)
+    store.delete("bookmark_urls")  # stored as a single value by older versions
+    return url_index
+
+
+def _get_store():
+    """Returns the internal store, after building the url index if needed."""
+    store = helpers.get_store()
+    if not store.index_exists(URL_INDEX):
+        get_url_index()
+    return store
+
+
+def find_bookmark(url):
+    """Returns the id of the oldest bookmark saved for `url`, or None."""
+    for dataobj_id in _get_store().get_index_ids(URL_INDEX, normalize_url(url)):
+        # skip bookmarks deleted outside of archivy
+        if data.get_by_id(dataobj_id):
+            return dataobj_id
+    return None
+
+
+def index_bookmark_urls(*dataobjs):
+    """Adds the urls of the given dataobjs to the index."""
+    urls = {
+        dataobj.id: {normalize_url(dataobj.url)} for dataobj in dataobjs if dataobj.url
+    }
+    if urls:
+        _get_store().update_index(URL_INDEX, urls)
+
+
+def remove_from_url_index(*dataobj_ids):
+    """Removes the bookmarks of the given ids from the url index."""
+    _get_store().update_index(URL_INDEX, {dataobj_id: () for dataobj_id in dataobj_ids})
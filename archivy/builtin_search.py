@@ -0,0 +1,250 @@
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from contextlib import closing
+from pathlib import Path
+
+import frontmatter
+from flask import current_app
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+INDEX_FILENAME = "search_index.sqlite3"
+TOKEN_PATTERN = re.compile(r"\w+")
+
+SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# paths of the indexes whose schema has been created by this process
+_initialized = set()
+# paths of the indexes being built in the background
+_building = set()
+_building_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Splits text into the lowercase terms stored in the index."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def get_index_path():
+    """Returns the path of the inverted index, stored in the `INTERNAL_DIR`."""
+    return Path(current_app.config["INTERNAL_DIR"]) / INDEX_FILENAME
+
+
+def index_exists():
+    """
+    Returns whether the index has been built from the whole data dir, and
+    not only from the dataobjs created since it was first opened.
+    """
+    if not get_index_path().exists():
+        return False
+    with closing(connect()) as conn:
+        return bool(conn.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone())
+
+
+def mark_built():
+    """Records that every dataobj of the data dir has been indexed."""
+    with closing(connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '1')")
+
+
+def connect():
+    """Opens a connection to the inverted index, creating it if needed."""
+    index_path = str(get_index_path())
+    conn = sqlite3.connect(index_path, timeout=30)
+    if index_path not in _initialized:
+        conn.executescript(SCHEMA)
+        _initialized.add(index_path)
+    return conn
+
+
+def _index_dataobj(conn, model):
+    terms = tokenize(" ".join([model.title, model.content, " ".join(model.tags)]))
+    conn.execute("DELETE FROM postings WHERE doc_id = ?", (model.id,))
+    conn.execute(
+        "INSERT OR REPLACE INTO docs (id, title, length) VALUES (?, ?, ?)",
+        (model.id, model.title, len(terms)),
+    )
+    conn.executemany(
+        "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+        [(term, model.id, tf) for term, tf in Counter(terms).items()],
+    )
+
+
+def _remove_dataobj(conn, dataobj_id):
+    conn.execute("DELETE FROM postings WHERE doc_id = ?", (dataobj_id,))
+    conn.execute("DELETE FROM docs WHERE id = ?", (dataobj_id,))
+
+
+def add_to_index(model):
+    """Adds dataobj to the index, replacing its previous version if it exists."""
+    with closing(connect()) as conn, conn:
+        _index_dataobj(conn, model)
+    return True
+
+
+def bulk_add_to_index(models, batch_size=500):
+    """
+    Adds many dataobjs to the index, committing them in batches of `batch_size`.
+
+    Yields `(success, dataobj id)` pairs as documents get indexed.
+    """
+    with closing(connect()) as conn:
+        batch = []
+        for model in models:
+            _index_dataobj(conn, model)
+            batch.append(model.id)
+            if len(batch) == batch_size:
+                conn.commit()
+                yield from ((True, dataobj_id) for dataobj_id in batch)
+                batch = []
+        conn.commit()
+        yield from ((True, dataobj_id) for dataobj_id in batch)
+
+
+def build_index():
+    """
+    Indexes every dataobj of the data dir. Files that can't be read are
+    logged and skipped.
+
+    Returns the number of indexed dataobjs.
+    """
+    from archivy.data import walk
+    from archivy.models import DataObj
+
+    def read_dataobjs():
+        for entry in walk(pattern="*.md"):
+            try:
+                dataobj = DataObj.from_md(Path(entry.path).read_text(encoding="utf-8"))
+            except Exception as e:
+                current_app.logger.warning(f"Could not index {entry.relpath}: {e}")
+                continue
+            if dataobj.id is not None:
+                yield dataobj
+
+    count = sum(1 for _ in bulk_add_to_index(read_dataobjs()))
+    mark_built()
+    return count
+
+
+def start_index_build():
+    """
+    Builds the index in a background thread, unless it is already being built.
+    """
+    app = current_app._get_current_object()
+    index_path = get_index_path()
+    with _building_lock:
+        if index_path in _building:
+            return
+        _building.add(index_path)
+
+    def build():
+        with app.app_context():
+            try:
+                count = build_index()
+                app.logger.info(f"Built the builtin search index of {count} notes")
+            except Exception as e:
+                app.logger.error(f"Could not build the builtin search index: {e}")
+            finally:
+                with _building_lock:
+                    _building.discard(index_path)
+
+    threading.Thread(target=build, daemon=True).start()
+
+
+def remove_from_index(dataobj_id):
+    """Removes object of given id"""
+    with closing(connect()) as conn, conn:
+        _remove_dataobj(conn, dataobj_id)
+
+
+def _rank(terms):
+    """Returns `(id, title)` pairs of the dataobjs matching `terms`, best first."""
+    scores = defaultdict(float)
+    titles = {}
+    with closing(connect()) as conn:
+        n_docs, avg_length = conn.execute(
+            "SELECT COUNT(*), AVG(length) FROM docs"
+        ).fetchone()
+        avg_length = avg_length or 1
+        for term in terms:
+            postings = conn.execute(
+                "SELECT p.doc_id, p.tf, d.length, d.title FROM postings p "
+                "JOIN docs d ON d.id = p.doc_id WHERE p.term = ?",
+                (term,),
+            ).fetchall()
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf, length, title in postings:
+                norm = K1 * (1 - B + B * length / avg_length)
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+                titles[doc_id] = title
+    ranked = sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
+    return [(doc_id, titles[doc_id]) for doc_id in ranked]
+
+
+def query_index(query, strict=False, limit=None, offset=0):
+    """
+    Returns search results for your given query, ranked with BM25, in the
+    same format as `archivy.search.query_ripgrep`.
+
+    Specify strict=True if you only want results whose content contains the exact query.
+
+    `limit` and `offset` select a window of the ranked results. Only the
+    notes in that window are read from disk, except with strict=True, where
+    the skipped notes must be read to know whether they match.
+    """
+    from archivy.data import get_by_id
+
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    hits = []
+    skipped = 0
+    for dataobj_id, title in _rank(terms):
+        if limit is not None and len(hits) == limit:
+            break
+        filename = get_by_id(dataobj_id)
+        if not filename:
+            # the dataobj was deleted without going through archivy
+            remove_from_index(dataobj_id)
+            continue
+        if not strict and skipped < offset:
+            skipped += 1
+            continue
+        content = frontmatter.load(filename).content
+        matches = []
+        for line in content.splitlines():
+            if strict:
+                if query in line:
+                    matches.append(line.strip())
+            elif terms.intersection(tokenize(line)):
+                matches.append(line.strip())
+        if strict and not matches:
+            continue
+        if skipped < offset:
+            skipped += 1
+            continue
+        hits.append({"id": dataobj_id, "title": title, "matches": matches})
+    return hits
@@ -1,3 +1,4 @@
+import hashlib
 from pathlib import Path
 from os import environ
 from pkg_resources import iter_entry_points
@@ -9,9 +10,22 @@ from flask.cli import FlaskGroup, load_dotenv, shell_command
 from archivy import app
 from archivy.config import Config
 from archivy.click_web import create_click_web_app
-from archivy.data import open_file, format_file, unformat_file
+from archivy.data import (
+    open_file,
+    format_file,
+    unformat_file,
+    get_catalog,
+    walk,
+)
 from archivy.helpers import load_config, write_config, create_plugin_dir
+from archivy import builtin_search, jobs, link_checker, watcher
 from archivy.models import User, DataObj
+from archivy.search import (
+    bulk_add_to_index,
+    load_index_manifest,
+    remove_from_index,
+    save_index_manifest,
+)
 
 
 def create_app():
@@ -53,7 +67,7 @@ def init(ctx):
     if desires_search:
         search_engine = click.prompt(
             "Then go to https://archivy.github.io/setup-search/ to see the different backends you can use for search and how you can configure them.",
-            type=click.Choice(["elasticsearch", "ripgrep", "cancel"]),
+            type=click.Choice(["elasticsearch", "ripgrep", "builtin", "cancel"]),
             show_choices=True,
         )
         if search_engine != "cancel":
@@ -112,6 +126,22 @@ def run():
     click.echo("Running archivy...")
     load_dotenv()
     environ["FLASK_RUN_FROM_CLI"] = "false"
+    with app.app_context():
+        # load the catalog snapshot before the first request comes in
+        get_catalog(refresh=False)
+        if app.config["WATCHER_CONF"]["enabled"]:
+            watcher.start_watcher()
+        if app.config["LINK_CHECK_CONF"]["enabled"]:
+            link_checker.start_scheduler()
+        if app.config["JOBS_CONF"]["enabled"]:
+            jobs.resume_jobs()
+        search_conf = app.config["SEARCH_CONF"]
+        if (
+            search_conf["enabled"]
+            and search_conf["engine"] == "builtin"
+            and not builtin_search.index_exists()
+        ):
+            builtin_search.start_index_build()
     app_with_cli = create_click_web_app(click, cli, app)
     app_with_cli.run(host=app.config["HOST"], port=app.config["PORT"])
 
@@ -148,23 +178,116 @@ def unformat(filenames, output_dir):
         unformat_file(path, output_dir)
 
 
-@cli.command(short_help="Sync content to Elasticsearch")
-def index():
+@cli.command(short_help="Sync content to the search index")
+@click.option(
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Number of notes sent in each bulk request.",
+)
+@click.option(
+    "--threads",
+    default=4,
+    show_default=True,
+    help="Number of threads sending bulk requests.",
+)
+@click.option(
+    "--changed-only",
+    is_flag=True,
+    help="Only index notes that changed since the last run.",
+)
+def index(batch_size, threads, changed_only):
     data_dir = Path(app.config["USER_DIR"]) / "data"
 
     if not app.config["SEARCH_CONF"]["enabled"]:
         click.echo("Search must be enabled for this command.")
         return
+    if app.config["SEARCH_CONF"]["engine"] not in ("elasticsearch", "builtin"):
+        click.echo("Only the Elasticsearch and builtin engines need to be synced.")
+        return
 
-    for filename in data_dir.rglob("*.md"):
-        cur_file = open(filename)
-        dataobj = DataObj.from_md(cur_file.read())
-        cur_file.close()
-
-        if dataobj.index():
-            click.echo(f"Indexed {dataobj.title}...")
-        else:
-            click.echo(f"Failed to index {dataobj.title}")
+    rebuild_builtin = (
+        app.config["SEARCH_CONF"]["engine"] == "builtin"
+        and not builtin_search.index_exists()
+    )
+    # a missing builtin index must be built from every note
+    manifest = {} if rebuild_builtin else load_index_manifest()
+    filenames = {entry.relpath: Path(entry.path) for entry in walk(data_dir, "*.md")}
+
+    # remove notes that were deleted since the last run
+    for relpath in set(manifest) - set(filenames):
+        dataobj_id = Path(relpath).name.split("-", 1)[0]
+        if dataobj_id.isdigit():
+            remove_from_index(int(dataobj_id))
+        del manifest[relpath]
+
+    hash_file = lambda filename: hashlib.sha1(filename.read_bytes()).hexdigest()
+    # find the changed notes first, so that the progress bar only counts them
+    if changed_only:
+        filenames = {
+            relpath: filename
+            for relpath, filename in filenames.items()
+            if manifest.get(relpath) != hash_file(filename)
+        }
+
+    # dataobj id -> (path, hash) of the files being indexed
+    pending = {}
+    skipped = []
+
+    def read_dataobjs():
+        for relpath, filename in filenames.items():
+            contents = filename.read_bytes()
+            dataobj = DataObj.from_md(contents.decode("utf-8"))
+            if dataobj.id is None:
+                skipped.append(relpath)
+                bar.update(1)
+                continue
+            pending[dataobj.id] = (relpath, hashlib.sha1(contents).hexdigest())
+            yield dataobj
+
+    failed = 0
+    with click.progressbar(length=len(filenames), label="Indexing") as bar:
+        results = bulk_add_to_index(read_dataobjs(), batch_size, threads)
+        for success, dataobj_id in results:
+            relpath, digest = pending.pop(dataobj_id, (None, None))
+            # notes that failed keep their old hash, so the next run retries them
+            if success and relpath:
+                manifest[relpath] = digest
+            else:
+                failed += 1
+            bar.update(1)
+    save_index_manifest(manifest)
+    if rebuild_builtin and not failed:
+        builtin_search.mark_built()
+
+    click.echo(f"Indexed {len(filenames) - failed - len(skipped)} notes.")
+    if failed:
+        click.echo(f"Failed to index {failed} notes.")
+    for relpath in skipped:
+        click.echo(f"Skipped {relpath}, which has no id.")
+
+
+@cli.command("check-links", short_help="Check that the urls of bookmarks still work")
+@click.option(
+    "--max-age",
+    default=0.0,
+    show_default=True,
+    help="Skip bookmarks checked less than this many hours ago.",
+)
+def check_links(max_age):
+    max_age = max_age * 60 * 60
+    with click.progressbar(
+        length=len(link_checker.get_bookmarks(max_age)), label="Checking links"
+    ) as bar:
+        checked = link_checker.check_links(
+            max_age=max_age, progress=lambda result: bar.update(1)
+        )
+    click.echo(f"Checked {checked} bookmarks.")
+    for check in link_checker.get_broken_links():
+        problem = check["error"] or f"status {check['status']}"
+        click.echo(
+            f"Broken link in bookmark {check['dataobj_id']}: {check['url']} ({problem})"
+        )
 
 
 @cli.command(
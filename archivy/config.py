@@ -16,10 +16,45 @@ class Config(object):
         self.USER_DIR = self.INTERNAL_DIR
         self.DEFAULT_BOOKMARKS_DIR = ""
         self.SITE_TITLE = "Archivy"
+        self.INTERNAL_STORE = "sqlite"
+        self.CATALOG_MAX_AGE = 30
         os.makedirs(self.INTERNAL_DIR, exist_ok=True)
 
         self.PANDOC_HIGHLIGHT_THEME = "pygments"
-        self.SCRAPING_CONF = {"save_images": False}
+        self.SCRAPING_CONF = {
+            "save_images": False,
+            "image_workers": 8,
+            "max_host_connections": 4,
+            "max_image_size": 10 * 1024 * 1024,
+            "images_timeout": 30,
+            "connect_timeout": 5,
+            "read_timeout": 30,
+            "max_page_size": 20 * 1024 * 1024,
+            "http_cache": True,
+            "http_cache_max_size": 100 * 1024 * 1024,
+            "http_cache_max_age": 30 * 24 * 60 * 60,
+            "parser": "html.parser",
+            "parser_workers": 2,
+            "parse_cpu_limit": 20,
+            "duplicates": "existing",
+        }
+        self.JOBS_CONF = {
+            "enabled": False,
+            "workers": 2,
+            "max_attempts": 3,
+            "retry_delay": 10,
+        }
+        self.WATCHER_CONF = {
+            "enabled": False,
+            "debounce": 1,
+        }
+        self.LINK_CHECK_CONF = {
+            "enabled": False,
+            "interval": 24 * 60 * 60,
+            "workers": 32,
+            "host_delay": 1,
+            "timeout": 10,
+        }
 
         self.THEME_CONF = {
             "use_theme_dark": False,
@@ -63,6 +98,11 @@ class Config(object):
             "engine": "",
             "es_user": "",
             "es_password": "",
+            "es_timeout": 10,
+            "es_max_retries": 3,
+            "es_pool_size": 10,
+            "es_health_ttl": 60,
+            "default_limit": 100,
             "es_processing_conf": {
                 "settings": {
                     "highlight": {"max_analyzed_offset": 100000000},
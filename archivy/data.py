@@ -1,9 +1,16 @@
+import atexit
+import heapq
+import json
 import platform
 import subprocess
 import os
 import shutil
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from fnmatch import fnmatchcase
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 
 import frontmatter
 from flask import current_app
@@ -11,6 +18,7 @@ from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
 from archivy.search import remove_from_index
+from archivy_parser import valid_image_filename  # noqa: F401
 
 
 # FIXME: ugly hack to make sure the app path is evaluated at the right time
@@ -40,29 +48,553 @@ class Directory:
 
 FILE_GLOB = "[0-9]*-*.md"
 
+WalkEntry = namedtuple("WalkEntry", ["relpath", "path", "is_dir", "mtime_ns", "size"])
 
-def get_by_id(dataobj_id):
-    """Returns filename of dataobj of given id"""
-    results = list(get_data_dir().rglob(f"{dataobj_id}-*.md"))
-    return results[0] if results else None
+
+def walk(root=None, pattern=None, files=True, dirs=False, stat=False):
+    """
+    Iterates over the tree under `root` (the data dir by default), yielding a
+    `WalkEntry` for each file and/or dir. The entries of a dir are yielded in
+    alphabetical order, before walking its subdirs depth-first.
+
+    - **pattern** - optional glob the entry names must match, eg. `"*.md"`.
+    - **files** / **dirs** - which kinds of entries to yield.
+    - **stat** - whether to fill in `mtime_ns` and `size`, which are None otherwise.
+
+    `relpath` is relative to `root`, with `/` separators. Built on `os.scandir`,
+    so file types come from the directory listing and each entry is stat'ed
+    at most once, only if `stat` is set. Symlinks to dirs aren't followed.
+    """
+    root = str(get_data_dir() if root is None else root)
+    stack = [""]
+    while stack:
+        reldir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, reldir)) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            continue  # removed while walking
+        subdirs = []
+        for entry in entries:
+            relpath = f"{reldir}/{entry.name}" if reldir else entry.name
+            try:
+                # like `Path.rglob`, don't follow symlinks to dirs, which could loop
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                subdirs.append(relpath)
+            if not (dirs if is_dir else files):
+                continue
+            if pattern and not fnmatchcase(entry.name, pattern):
+                continue
+            mtime_ns = size = None
+            if stat:
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                mtime_ns, size = entry_stat.st_mtime_ns, entry_stat.st_size
+            yield WalkEntry(relpath, entry.path, is_dir, mtime_ns, size)
+        stack.extend(reversed(subdirs))
+
+
+# maps each data dir to a dict of dataobj id -> path of its file, relative to the data dir
+_id_indexes = {}
+
+
+def _get_id_index():
+    return _id_indexes.setdefault(str(get_data_dir()), {})
+
+
+def _relative_to_data_dir(filepath):
+    return Path(filepath).resolve().relative_to(get_data_dir().resolve())
+
+
+def rebuild_id_index():
+    """Walks the data dir and rebuilds the index of dataobj ids to their files."""
+    data_dir = get_data_dir()
+    id_index = {}
+    for entry in walk(data_dir, FILE_GLOB):
+        dataobj_id = entry.relpath.rsplit("/", 1)[-1].split("-", 1)[0]
+        if dataobj_id.isdigit():
+            id_index[dataobj_id] = Path(entry.relpath)
+    _id_indexes[str(data_dir)] = id_index
+    return id_index
+
+
+def index_dataobj_path(dataobj_id, filepath):
+    """Records that the dataobj of given id is stored at `filepath`."""
+    _get_id_index()[str(dataobj_id)] = _relative_to_data_dir(filepath)
+
+
+def get_by_id(dataobj_id, rebuild=True):
+    """
+    Returns filename of dataobj of given id
+
+    Lookups go through an in-memory index of ids to paths that is
+    rebuilt when an id is missing or points to a file that has disappeared,
+    unless `rebuild` is False.
+    """
+    data_dir = get_data_dir()
+    dataobj_id = str(dataobj_id)
+    relpath = _get_id_index().get(dataobj_id)
+    if relpath is None or not (data_dir / relpath).is_file():
+        if not rebuild:
+            return None
+        relpath = rebuild_id_index().get(dataobj_id)
+    return data_dir / relpath if relpath else None
+
+
+# (mtime_ns, size) of the last files written by archivy, so that the watcher
+# can tell them apart from external edits
+_own_writes = OrderedDict()
+_own_writes_lock = threading.Lock()
+MAX_OWN_WRITES = 10000
+
+
+def _record_write(filepath):
+    stat = os.stat(filepath)
+    filepath = os.path.realpath(filepath)
+    with _own_writes_lock:
+        _own_writes[filepath] = (stat.st_mtime_ns, stat.st_size)
+        _own_writes.move_to_end(filepath)
+        while len(_own_writes) > MAX_OWN_WRITES:
+            _own_writes.popitem(last=False)
+
+
+def is_own_write(filepath):
+    """Returns whether the file at `filepath` was last written by archivy itself."""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return False
+    with _own_writes_lock:
+        return _own_writes.get(os.path.realpath(filepath)) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+
+
+def forget_dataobjs(*dataobj_ids):
+    """Removes dataobjs whose files have been deleted from archivy's indexes."""
+    from archivy.bookmarks import remove_from_url_index
+    from archivy.links import remove_from_link_graph
+    from archivy.tags import remove_from_tag_index
+
+    for dataobj_id in dataobj_ids:
+        remove_from_index(dataobj_id)
+        _get_id_index().pop(str(dataobj_id), None)
+    remove_from_tag_index(*dataobj_ids)
+    remove_from_link_graph(*dataobj_ids)
+    remove_from_url_index(*dataobj_ids)
 
 
 def load_frontmatter(filepath, load_content=False):
     if load_content:
-        return frontmatter.load(filepath.open("r"))
+        with open(filepath, "r") as file:
+            return frontmatter.load(file)
     count = 0
-    file = open(filepath, "r")
     data = ""
     line = "_"
-    while count != 2 and line:
-        line = file.readline()
-        if line in ["---\n", "---"]:
-            count += 1
-        data += line
+    with open(filepath, "r") as file:
+        while count != 2 and line:
+            line = file.readline()
+            if line in ["---\n", "---"]:
+                count += 1
+            data += line
     data = frontmatter.loads(data)
     return data
 
 
+def _encode_snapshot_value(value):
+    # yaml parses dates in the frontmatter, which json can't store as is
+    # (datetime.fromisoformat is only available from python 3.7)
+    if isinstance(value, datetime):
+        offset = value.utcoffset()
+        return {
+            "__datetime__": list(value.timetuple()[:6])
+            + [value.microsecond, None if offset is None else offset.total_seconds()]
+        }
+    if isinstance(value, date):
+        return {"__date__": [value.year, value.month, value.day]}
+    raise TypeError(f"{type(value).__name__} can't be saved in the catalog snapshot")
+
+
+def _decode_snapshot_value(obj):
+    if len(obj) != 1:
+        return obj
+    try:
+        if "__datetime__" in obj:
+            *fields, offset = obj["__datetime__"]
+            tzinfo = None if offset is None else timezone(timedelta(seconds=offset))
+            return datetime(*fields, tzinfo=tzinfo)
+        if "__date__" in obj:
+            return date(*obj["__date__"])
+    except TypeError as e:
+        raise ValueError(f"Invalid date in the catalog snapshot: {e}") from e
+    return obj
+
+
+def _is_encodable(value):
+    try:
+        json.dumps(value, default=_encode_snapshot_value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class Catalog:
+    """
+    In-process catalog of the frontmatter of every markdown file in a data dir.
+
+    Parsed frontmatter is keyed by the path, mtime and size of its file, so
+    refreshing a warm catalog costs a single `stat` walk of the data dir and
+    only new or modified files are parsed again.
+    """
+
+    def __init__(self, data_dir, snapshot_path=None):
+        self.data_dir = str(data_dir)
+        # file the catalog is saved to, to be reloaded after a restart
+        self.snapshot_path = snapshot_path
+        self.last_snapshot = None
+        self.dirty = False
+        self._snapshot_lock = threading.Lock()
+        # relative path -> ((mtime_ns, size), frontmatter metadata)
+        self.files = {}
+        # relative paths of all subdirectories
+        self.dirs = []
+        self.lock = threading.Lock()
+        self.last_scan = None
+        self.stale = True
+        # directory tree built lazily from the catalog for listings
+        self._tree = None
+        # relative path -> ((mtime_ns, size), parsed modified_at)
+        self._modified_at = {}
+
+    def scan(self):
+        """Walks the data dir to pick up new, modified and deleted files."""
+        with self.lock:
+            scan_start = time.monotonic()
+            self.stale = False
+            files, dirs, id_index = {}, [], {}
+            changed = False
+            for entry in walk(self.data_dir, dirs=True, stat=True):
+                relpath = entry.relpath
+                if entry.is_dir:
+                    dirs.append(relpath)
+                    continue
+                if not relpath.endswith(".md"):
+                    continue
+                key = (entry.mtime_ns, entry.size)
+                cached = self.files.get(relpath)
+                if cached is None or cached[0] != key:
+                    metadata = load_frontmatter(entry.path).metadata
+                    cached = (key, metadata)
+                    changed = True
+                files[relpath] = cached
+                dataobj_id = relpath.rsplit("/", 1)[-1].split("-", 1)[0]
+                if dataobj_id.isdigit():
+                    id_index[dataobj_id] = Path(relpath)
+            if changed or files.keys() != self.files.keys() or dirs != self.dirs:
+                self.dirty = True
+            self.files, self.dirs = files, dirs
+            self.last_scan = scan_start
+            self._tree = None
+            self._modified_at = {
+                relpath: cached
+                for relpath, cached in self._modified_at.items()
+                if relpath in files
+            }
+            _id_indexes[self.data_dir] = id_index
+        if (
+            self.dirty
+            and self.snapshot_path
+            and (
+                self.last_snapshot is None
+                or time.monotonic() - self.last_snapshot >= SNAPSHOT_INTERVAL
+            )
+        ):
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """
+        Saves the catalog to its snapshot file, so that it doesn't need to
+        parse every file again after a restart.
+        """
+        if not self._snapshot_lock.acquire(blocking=False):
+            return  # already being saved
+        try:
+            self.last_snapshot = time.monotonic()
+            self.dirty = False
+            snapshot = {
+                "version": SNAPSHOT_VERSION,
+                "data_dir": self.data_dir,
+                "files": self.files,
+                "dirs": self.dirs,
+            }
+            try:
+                content = json.dumps(snapshot, default=_encode_snapshot_value)
+            except (TypeError, ValueError):
+                # leave out the files with frontmatter json can't store, they
+                # are parsed again by the first scan after a restart
+                snapshot["files"] = {
+                    relpath: cached
+                    for relpath, cached in self.files.items()
+                    if _is_encodable(cached)
+                }
+                content = json.dumps(snapshot, default=_encode_snapshot_value)
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError:
+            self.dirty = True
+        finally:
+            self._snapshot_lock.release()
+
+    def load_snapshot(self):
+        """
+        Loads the catalog from its snapshot file. The snapshot still needs to
+        be reconciled with the files by a `scan`, but only files that changed
+        since it was saved are parsed again.
+
+        Returns whether a valid snapshot was loaded.
+        """
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f, object_hook=_decode_snapshot_value)
+        except (OSError, ValueError):  # missing or corrupt
+            return False
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != SNAPSHOT_VERSION
+            or snapshot.get("data_dir") != self.data_dir
+        ):
+            return False
+        try:
+            files = {
+                relpath: ((int(key[0]), int(key[1])), dict(metadata))
+                for relpath, (key, metadata) in snapshot["files"].items()
+            }
+            dirs = [str(reldir) for reldir in snapshot["dirs"]]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        with self.lock:
+            self.files, self.dirs = files, dirs
+            self._tree = None
+            id_index = {}
+            for relpath in self.files:
+                dataobj_id = relpath.rpartition("/")[2].split("-", 1)[0]
+                if dataobj_id.isdigit():
+                    id_index[dataobj_id] = Path(relpath)
+            _id_indexes[self.data_dir] = id_index
+        return True
+
+    def refresh(self, max_age=0):
+        """
+        Rescans the data dir if the catalog has been invalidated
+        or was last scanned more than `max_age` seconds ago.
+        """
+        if (
+            self.stale
+            or self.last_scan is None
+            or time.monotonic() - self.last_scan >= max_age
+        ):
+            self.scan()
+
+    def invalidate(self):
+        """Marks the catalog as needing a rescan before it is next used."""
+        self.stale = True
+
+    def query(self, path="", type=None, tag=None):
+        """
+        Returns `(relative path, metadata)` pairs of the catalogued files.
+
+        - **path**: only return files inside this directory (relative to the data dir)
+        - **type**: only return dataobjs of this type, eg. bookmark / note
+        - **tag**: only return dataobjs with this tag in their frontmatter
+        """
+        return list(self.iter_query(path, type, tag))
+
+    def iter_query(self, path="", type=None, tag=None):
+        """Same as `query`, but returns a generator."""
+        prefix = "/".join(Path(path).parts)
+        prefix = prefix + "/" if prefix else ""
+        # scans replace the dict instead of modifying it, so it's safe to iterate
+        for relpath, (_, metadata) in self.files.items():
+            if not relpath.startswith(prefix):
+                continue
+            if type is not None and metadata.get("type") != type:
+                continue
+            if tag is not None and tag not in (metadata.get("tags") or []):
+                continue
+            yield relpath, metadata
+
+    def query_dirs(self, path=""):
+        """Returns the relative paths of all directories inside `path`."""
+        prefix = "/".join(Path(path).parts)
+        prefix = prefix + "/" if prefix else ""
+        return [reldir for reldir in self.dirs if reldir.startswith(prefix)]
+
+    def listing(self, path=""):
+        """
+        Returns a tuple of the relative paths of the directories and the metadata
+        of the files directly inside `path`, or None if it isn't a directory.
+        """
+        tree = self._tree
+        if tree is None:
+            tree = {"": ([], [])}
+            for reldir in self.dirs:
+                tree[reldir] = ([], [])
+            for reldir in self.dirs:
+                tree[reldir.rpartition("/")[0]][0].append(reldir)
+            for relpath, (_, metadata) in self.files.items():
+                tree[relpath.rpartition("/")[0]][1].append(metadata)
+            self._tree = tree
+        return tree.get("/".join(Path(path).parts))
+
+    def modified_at(self, relpath):
+        """
+        Returns the parsed `modified_at` datetime of a catalogued file, or None
+        if it doesn't have one. Parsed values are cached until the file changes.
+        """
+        key, metadata = self.files[relpath]
+        cached = self._modified_at.get(relpath)
+        if cached is None or cached[0] != key:
+            try:
+                modified_at = datetime.strptime(metadata["modified_at"], "%x %H:%M")
+            except (KeyError, TypeError, ValueError):
+                modified_at = None
+            cached = self._modified_at[relpath] = (key, modified_at)
+        return cached[1]
+
+
+# maps each data dir to its Catalog
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+# catalogs are saved in this file of the internal dir
+SNAPSHOT_FILENAME = "catalog.json"
+SNAPSHOT_VERSION = 2
+# minimum number of seconds between two snapshots of a catalog
+SNAPSHOT_INTERVAL = 300
+
+
+def get_catalog(max_age=None, refresh=True):
+    """
+    Returns the metadata catalog of the data dir.
+
+    - **max_age**: rescan the data dir first if the catalog is older than this
+      many seconds, `CATALOG_MAX_AGE` by default. Changes made through archivy
+      always trigger a rescan.
+    - **refresh**: pass False to use the catalog as is.
+    """
+    data_dir = str(get_data_dir())
+    catalog = _catalogs.get(data_dir)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.get(data_dir)
+            if catalog is None:
+                catalog = Catalog(
+                    data_dir,
+                    Path(current_app.config["INTERNAL_DIR"]) / SNAPSHOT_FILENAME,
+                )
+                if catalog.load_snapshot():
+                    # serve the snapshot right away, and reconcile it with the
+                    # data dir in the background
+                    catalog.last_scan = time.monotonic()
+                    catalog.stale = False
+                    threading.Thread(target=catalog.scan, daemon=True).start()
+                _catalogs[data_dir] = catalog
+    if refresh:
+        if max_age is None:
+            max_age = current_app.config["CATALOG_MAX_AGE"]
+        catalog.refresh(max_age)
+    return catalog
+
+
+@atexit.register
+def save_catalog_snapshots():
+    """Saves the catalogs that changed since their last snapshot."""
+    for catalog in list(_catalogs.values()):
+        if catalog.dirty and catalog.snapshot_path:
+            catalog.save_snapshot()
+
+
+def invalidate_catalog():
+    """Signals that the contents of the data dir have been modified."""
+    get_catalog(refresh=False).invalidate()
+
+
+def get_dir_listing(path=""):
+    """
+    Returns the contents of a single directory of the data dir, without walking
+    the rest of the tree: its child directories along with the number of
+    directories and files they contain, and its files' ids and titles.
+    """
+    data_dir = get_data_dir()
+    query_dir = data_dir / path
+    if not is_relative_to(query_dir, data_dir):
+        raise FileNotFoundError
+    query_path = _relative_to_data_dir(query_dir)
+    catalog = get_catalog()
+    listing = catalog.listing(query_path)
+    if listing is None:
+        raise FileNotFoundError
+    child_dirs, child_files = listing
+    dirs = []
+    for reldir in child_dirs:
+        grandchild_dirs, grandchild_files = catalog.listing(reldir)
+        dirs.append(
+            {
+                "name": reldir.rpartition("/")[2],
+                "path": reldir,
+                "n_dirs": len(grandchild_dirs),
+                "n_files": len(grandchild_files),
+            }
+        )
+    files = [
+        {"id": metadata.get("id"), "title": metadata.get("title", "")}
+        for metadata in child_files
+    ]
+    return {
+        "path": "/".join(query_path.parts),
+        "dirs": dirs,
+        "files": sorted(files, key=lambda f: str(f["title"])),
+    }
+
+
+def _catalog_post(relpath, metadata, load_content=False):
+    """Converts a catalog entry into a `frontmatter.Post`"""
+    if load_content:
+        return load_frontmatter(get_data_dir() / relpath, load_content=True)
+    post = frontmatter.Post("")
+    post.metadata.update(metadata)
+    return post
+
+
+def get_recent_items(path="", limit=5, refresh=True):
+    """
+    Returns the `limit` most recently modified dataobjs inside `path`.
+
+    - **refresh**: see `get_catalog`. Pass False to reuse the catalog if
+      it has just been refreshed, for example by `get_items`.
+    """
+    data_dir = get_data_dir()
+    query_dir = data_dir / path
+    if not is_relative_to(query_dir, data_dir) or not query_dir.exists():
+        raise FileNotFoundError
+    catalog = get_catalog(refresh=refresh)
+    dated = []
+    for relpath, metadata in catalog.query(_relative_to_data_dir(query_dir)):
+        modified_at = catalog.modified_at(relpath)
+        if modified_at is not None:
+            dated.append((modified_at, relpath, metadata))
+    most_recent = heapq.nlargest(limit, dated, key=lambda item: item[0])
+    return [_catalog_post(relpath, metadata) for _, relpath, metadata in most_recent]
+
+
 def build_dir_tree(path, query_dir, load_content=False):
     """
     Builds a structured tree of directories and data objects.
@@ -71,29 +603,54 @@ def build_dir_tree(path, query_dir, load_content=False):
     - **query_dir**: absolute path of the directory we're building the tree of.
     """
     datacont = Directory(path or "root")
-    for filepath in query_dir.rglob("*"):
-        current_path = filepath.relative_to(query_dir)
-        current_dir = datacont
+    query_path = _relative_to_data_dir(query_dir)
+    depth = len(query_path.parts)
+    catalog = get_catalog()
 
-        # iterate through parent directories
-        for segment in current_path.parts[:-1]:
+    def get_directory(parts):
+        current_dir = datacont
+        for segment in parts:
             # directory has not been saved in tree yet
             if segment not in current_dir.child_dirs:
                 current_dir.child_dirs[segment] = Directory(segment)
             current_dir = current_dir.child_dirs[segment]
-
-        # handle last part of current_path
-        last_seg = current_path.parts[-1]
-        if filepath.is_dir():
-            if last_seg not in current_dir.child_dirs:
-                current_dir.child_dirs[last_seg] = Directory(last_seg)
-            current_dir = current_dir.child_dirs[last_seg]
-        elif last_seg.endswith(".md"):
-            data = load_frontmatter(filepath, load_content=load_content)
-            current_dir.child_files.append(data)
+        return current_dir
+
+    for reldir in catalog.query_dirs(query_path):
+        get_directory(reldir.split("/")[depth:])
+    for relpath, metadata in catalog.query(query_path):
+        parts = relpath.split("/")[depth:]
+        data = _catalog_post(relpath, metadata, load_content=load_content)
+        get_directory(parts[:-1]).child_files.append(data)
     return datacont
 
 
+def query_items(path="", type=None, tag=None, after=None, limit=None):
+    """
+    Returns an iterator over the `(relative path, metadata)` of the dataobjs
+    inside `path`, without loading their content.
+
+    - **type** / **tag**: see `Catalog.query`.
+    - **after**: only return the dataobjs whose relative path sorts after this one.
+    - **limit**: only return the first `limit` dataobjs.
+
+    Dataobjs are sorted by relative path when `after` or `limit` is set, and
+    are in catalog order otherwise. At most `limit` entries are held in memory.
+    """
+    data_dir = get_data_dir()
+    query_dir = data_dir / path
+    if not is_relative_to(query_dir, data_dir) or not query_dir.exists():
+        raise FileNotFoundError
+    results = get_catalog().iter_query(_relative_to_data_dir(query_dir), type, tag)
+    if after is not None:
+        results = (result for result in results if result[0] > after)
+    if limit is not None:
+        return iter(heapq.nsmallest(limit, results, key=lambda result: result[0]))
+    if after is not None:
+        return iter(sorted(results, key=lambda result: result[0]))
+    return results
+
+
 def get_items(
     collections=[], path="", structured=True, json_format=False, load_content=False
 ):
@@ -118,11 +675,13 @@ def get_items(
         return build_dir_tree(path, query_dir, load_content=load_content)
     else:
         datacont = []
-        for filepath in query_dir.rglob("*.md"):
-            data = load_frontmatter(filepath, load_content=load_content)
-            data["fullpath"] = str(filepath.parent.relative_to(query_dir))
+        query_path = _relative_to_data_dir(query_dir)
+        depth = len(query_path.parts)
+        for relpath, metadata in get_catalog().query(query_path):
+            data = _catalog_post(relpath, metadata, load_content=load_content)
+            data["fullpath"] = str(Path(*relpath.split("/")[depth:-1]))
             if len(collections) == 0 or any(
-                [collection == data["type"] for collection in collections]
+                [collection == data.get("type") for collection in collections]
             ):
                 if json_format:
                     dict_dataobj = data.__dict__
@@ -154,6 +713,8 @@ def create(contents, title, path=""):
     path_to_md_file = data_dir / path / f"{filename}.md"
     with open(path_to_md_file, "w", encoding="utf-8") as file:
         file.write(contents)
+    _record_write(path_to_md_file)
+    invalidate_catalog()
 
     return path_to_md_file
 
@@ -182,7 +743,11 @@ def move_item(dataobj_id, new_path):
     if (out_dir / file.parts[-1]).exists():
         raise FileExistsError
     elif is_relative_to(out_dir, data_dir) and out_dir.exists():  # check file isn't
-        return shutil.move(str(file), f"{get_data_dir()}/{new_path}/")
+        moved_to = shutil.move(str(file), f"{get_data_dir()}/{new_path}/")
+        _record_write(moved_to)
+        index_dataobj_path(dataobj_id, moved_to)
+        invalidate_catalog()
+        return moved_to
     return False
 
 
@@ -203,15 +768,42 @@ def rename_folder(old_path, new_name):
     if suggested_renaming.exists():
         raise FileExistsError
     curr_dir.rename(suggested_renaming)
+    for entry in walk(suggested_renaming, "*.md"):
+        _record_write(entry.path)
+    _reindex_dir(curr_dir, suggested_renaming)
+    invalidate_catalog()
     return str(suggested_renaming.relative_to(data_dir))
 
 
+def _reindex_dir(old_dir, new_dir=None):
+    """
+    Updates the id index after the directory `old_dir` has been moved to `new_dir`,
+    or deleted if `new_dir` is None.
+
+    Returns the ids of the dataobjs that were in `old_dir`.
+    """
+    old_prefix = _relative_to_data_dir(old_dir).parts
+    new_prefix = _relative_to_data_dir(new_dir).parts if new_dir else None
+    id_index = _get_id_index()
+    moved_ids = []
+    for dataobj_id, relpath in list(id_index.items()):
+        if relpath.parts[: len(old_prefix)] != old_prefix:
+            continue
+        moved_ids.append(dataobj_id)
+        if new_prefix is None:
+            del id_index[dataobj_id]
+        else:
+            id_index[dataobj_id] = Path(*new_prefix, *relpath.parts[len(old_prefix) :])
+    return moved_ids
+
+
 def delete_item(dataobj_id):
     """Delete dataobj of given id"""
     file = get_by_id(dataobj_id)
-    remove_from_index(dataobj_id)
     if file:
         Path(file).unlink()
+    forget_dataobjs(dataobj_id)
+    invalidate_catalog()
 
 
 def update_item_md(dataobj_id, new_content):
@@ -257,6 +849,8 @@ def update_item_md(dataobj_id, new_content):
     md = frontmatter.dumps(dataobj)
     with open(filename, "w", encoding="utf-8") as f:
         f.write(md)
+    _record_write(filename)
+    invalidate_catalog()
 
     converted_dataobj = DataObj.from_md(md)
     converted_dataobj.fullpath = str(
@@ -291,6 +885,8 @@ def update_item_frontmatter(dataobj_id, new_frontmatter):
     md = frontmatter.dumps(dataobj)
     with open(filename, "w", encoding="utf-8") as f:
         f.write(md)
+    _record_write(filename)
+    invalidate_catalog()
 
     converted_dataobj = DataObj.from_md(md)
     converted_dataobj.fullpath = str(
@@ -302,14 +898,7 @@ def update_item_frontmatter(dataobj_id, new_frontmatter):
 
 def get_dirs():
     """Gets all dir names where dataobjs are stored"""
-    # join glob matchers
-    dirnames = [
-        str(dir_path.relative_to(get_data_dir()))
-        for dir_path in get_data_dir().rglob("*")
-        if dir_path.is_dir()
-    ]
-
-    return dirnames
+    return [str(Path(entry.relpath)) for entry in walk(files=False, dirs=True)]
 
 
 def create_dir(name):
@@ -318,6 +907,7 @@ def create_dir(name):
     new_path = root_dir / name.strip("/")
     if is_relative_to(new_path, root_dir):
         new_path.mkdir(parents=True, exist_ok=True)
+        invalidate_catalog()
         return str(new_path.relative_to(root_dir))
     return False
 
@@ -330,6 +920,8 @@ def delete_dir(name):
         return False
     try:
         shutil.rmtree(target_dir)
+        forget_dataobjs(*_reindex_dir(target_dir))
+        invalidate_catalog()
         return True
     except FileNotFoundError:
         return False
@@ -349,8 +941,9 @@ def format_file(path: str):
         return
 
     if path.is_dir():
-        for filename in path.iterdir():
-            format_file(filename)
+        # list the files first, as formatting them adds new ones
+        for entry in list(walk(path)):
+            format_file(entry.path)
 
     else:
         new_file = path.open("r", encoding="utf-8")
@@ -392,8 +985,8 @@ def unformat_file(path: str, out_dir: str):
 
     if path.is_dir():
         path.mkdir(exist_ok=True)
-        for filename in path.iterdir():
-            unformat_file(filename, str(out_dir))
+        for entry in walk(path):
+            unformat_file(entry.path, str(out_dir))
 
     else:
         dataobj = frontmatter.load(str(path))
@@ -426,11 +1019,6 @@ def open_file(path):
         subprocess.Popen(["xdg-open", path])
 
 
-def valid_image_filename(filename):
-    ALLOWED_EXTENSIONS = ["jpg", "png", "gif", "jpeg"]
-    return "." in filename and filename.rsplit(".", 1)[1] in ALLOWED_EXTENSIONS
-
-
 def save_image(image: FileStorage):
     """
     Saves image to USER_DATA_DIR
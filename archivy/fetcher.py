@@ -0,0 +1,214 @@
+"""
+Shared layer for the requests archivy makes to other sites, when saving
+bookmarks and their images.
+
+All requests go through one pooled session, with timeouts and a cap on the
+size of the bodies that are downloaded. Pages that send an `ETag` or a
+`Last-Modified` header are cached in the `INTERNAL_DIR`, so downloading them
+again only costs a `304 Not Modified` response if they haven't changed. The
+cache is kept under `SCRAPING_CONF["http_cache_max_size"]` bytes by evicting
+the least recently used pages, and pages that haven't been used for
+`SCRAPING_CONF["http_cache_max_age"]` seconds are dropped.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+import requests
+from attr import attrs, attrib
+from flask import current_app
+from pkg_resources import require
+from requests.adapters import HTTPAdapter
+
+CACHE_DIRNAME = "http_cache"
+CHUNK_SIZE = 64 * 1024
+
+# max connections per host -> shared requests session
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    """Raised when a url can't be downloaded."""
+
+
+@attrs
+class FetchResult:
+    content: bytes = attrib()
+    encoding: str = attrib(default="utf-8")
+    from_cache: bool = attrib(default=False)
+
+    @property
+    def text(self):
+        try:
+            return self.content.decode(self.encoding, errors="replace")
+        except LookupError:  # unknown encoding
+            return self.content.decode("utf-8", errors="replace")
+
+
+def get_session():
+    """
+    Returns the `requests.Session` shared by the whole process, so connections
+    to a site are kept alive and reused. At most
+    `SCRAPING_CONF["max_host_connections"]` connections are opened to each
+    host, other requests wait for one of them to be free.
+    """
+    max_connections = current_app.config["SCRAPING_CONF"]["max_host_connections"]
+    with _sessions_lock:
+        session = _sessions.get(max_connections)
+        if not session:
+            session = requests.Session()
+            session.headers["User-agent"] = f"Archivy/v{require('archivy')[0].version}"
+            adapter = HTTPAdapter(pool_maxsize=max_connections, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[max_connections] = session
+    return session
+
+
+def _cache_paths(url):
+    cache_dir = Path(current_app.config["INTERNAL_DIR"]) / CACHE_DIRNAME
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return cache_dir / f"{key}.json", cache_dir / f"{key}.body"
+
+
+def _write_atomically(path, content):
+    with NamedTemporaryFile(dir=path.parent, delete=False) as f:
+        f.write(content)
+    os.replace(f.name, path)
+
+
+def _load_cached(url):
+    meta_path, body_path = _cache_paths(url)
+    max_age = current_app.config["SCRAPING_CONF"]["http_cache_max_age"]
+    try:
+        if time.time() - meta_path.stat().st_mtime > max_age:
+            return None, None
+        meta = json.loads(meta_path.read_text())
+        if meta["url"] != url:
+            return None, None
+        body = body_path.read_bytes()
+        # the mtime of the metadata records when the page was last used
+        os.utime(meta_path)
+        return meta, body
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+def prune_cache():
+    """
+    Removes the cached pages that haven't been used for
+    `SCRAPING_CONF["http_cache_max_age"]` seconds, and then the least
+    recently used ones until the cache is smaller than
+    `SCRAPING_CONF["http_cache_max_size"]` bytes.
+    """
+    conf = current_app.config["SCRAPING_CONF"]
+    cache_dir = Path(current_app.config["INTERNAL_DIR"]) / CACHE_DIRNAME
+    # key -> [last use, size, paths]
+    entries = {}
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                key, ext = os.path.splitext(entry.name)
+                if ext not in (".json", ".body"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                cached = entries.setdefault(key, [0, 0, []])
+                if ext == ".json":
+                    cached[0] = stat.st_mtime
+                cached[1] += stat.st_size
+                cached[2].append(entry.path)
+    except FileNotFoundError:
+        return
+
+    total = sum(size for _, size, _ in entries.values())
+    oldest = time.time() - conf["http_cache_max_age"]
+    for last_use, size, paths in sorted(entries.values()):
+        if last_use >= oldest and total <= conf["http_cache_max_size"]:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def _save_cached(url, resp, content):
+    meta = {
+        "url": url,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "encoding": resp.encoding,
+    }
+    meta_path, body_path = _cache_paths(url)
+    meta_path.parent.mkdir(exist_ok=True)
+    _write_atomically(body_path, content)
+    _write_atomically(meta_path, json.dumps(meta).encode("utf-8"))
+    prune_cache()
+
+
+def fetch(url, max_size=None, use_cache=True, deadline=None):
+    """
+    Downloads `url` and returns a `FetchResult`.
+
+    - **max_size** - maximum size of the body in bytes, `SCRAPING_CONF["max_page_size"]` by default.
+    - **use_cache** - whether to revalidate and store the response in the HTTP cache.
+    - **deadline** - `time.monotonic()` value after which the download is abandoned.
+
+    Raises `FetchError` if the url can't be downloaded, is too big or isn't
+    downloaded before the deadline.
+    """
+    conf = current_app.config["SCRAPING_CONF"]
+    max_size = max_size or conf["max_page_size"]
+    use_cache = use_cache and conf["http_cache"]
+    timeout = (conf["connect_timeout"], conf["read_timeout"])
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise FetchError(f"Ran out of time to retrieve {url}")
+        timeout = tuple(min(value, remaining) for value in timeout)
+
+    headers = {}
+    meta, cached = _load_cached(url) if use_cache else (None, None)
+    if meta:
+        if meta["etag"]:
+            headers["If-None-Match"] = meta["etag"]
+        if meta["last_modified"]:
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        with get_session().get(
+            url,
+            headers=headers,
+            stream=True,
+            timeout=timeout,
+        ) as resp:
+            if resp.status_code == 304 and meta:
+                return FetchResult(cached, meta["encoding"] or "utf-8", True)
+            resp.raise_for_status()
+            if int(resp.headers.get("Content-Length") or 0) > max_size:
+                raise FetchError(f"{url} is bigger than {max_size} bytes")
+            content = bytearray()
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                content += chunk
+                if len(content) > max_size:
+                    raise FetchError(f"{url} is bigger than {max_size} bytes")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise FetchError(f"Ran out of time to retrieve {url}")
+            content = bytes(content)
+            if use_cache and (
+                resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+            ):
+                _save_cached(url, resp, content)
+            return FetchResult(content, resp.encoding or "utf-8")
+    except (requests.RequestException, ValueError) as e:
+        raise FetchError(f"Could not retrieve {url}: {e}") from e
@@ -1,15 +1,33 @@
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
+import atexit
+import fnmatch
+import re
 import sys
 import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # not Windows
+    msvcrt = None
 
 import elasticsearch
 import yaml
 from elasticsearch import Elasticsearch
 from flask import current_app, g, request
-from tinydb import TinyDB, Query, operations
-from urllib.parse import urlparse, urljoin
+from tinydb import TinyDB
+from urllib.parse import urlparse, urljoin, urlsplit
 
 from archivy.config import BaseHooks, Config
+from archivy.store import STORES
 
 
 def load_config(path=""):
@@ -67,15 +85,104 @@ def load_hooks():
     return user_locals.get("Hooks", BaseHooks)()
 
 
+# patterns of the form scheme://host/..., where the host has no wildcards
+LITERAL_HOST_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://([^/*?\[\]#]+)(?:/.*)?$")
+
+
+def _required_literal(pattern):
+    """Returns the longest part of a glob pattern that any matching url contains."""
+    literals = []
+    for piece in re.split(r"[*?]", pattern):
+        if "[" in piece:
+            # keep the text around character sets like [ab]
+            literals.append(piece[: piece.index("[")])
+            if "]" in piece[piece.index("[") :]:
+                literals.append(piece[piece.rindex("]") + 1 :])
+        else:
+            literals.append(piece)
+    return max(literals, key=len)
+
+
+class ScrapingPatterns(Mapping):
+    """
+    Read-only mapping of the url patterns of `scraping.py` to their handlers,
+    compiled once to quickly find the handler of a url.
+
+    Patterns whose host has no wildcards are grouped by host, and the patterns
+    of each host are compiled into a single regex. Other patterns are only
+    tried on urls containing their longest literal part.
+    """
+
+    def __init__(self, patterns=None):
+        self._patterns = dict(patterns or {})
+        self._handlers = list(self._patterns.values())
+        by_host = {}
+        self._other = []
+        for index, pattern in enumerate(self._patterns):
+            match = LITERAL_HOST_PATTERN.match(pattern)
+            if match:
+                by_host.setdefault(match.group(1), []).append((index, pattern))
+            else:
+                self._other.append(
+                    (
+                        index,
+                        _required_literal(pattern),
+                        re.compile(fnmatch.translate(pattern)),
+                    )
+                )
+        self._by_host = {}
+        for host, host_patterns in by_host.items():
+            # each pattern is wrapped in a group named after its index. The
+            # patterns may contain groups of their own, but the outer group
+            # always closes last, so it's the one `lastgroup` names.
+            self._by_host[host] = re.compile(
+                "|".join(
+                    f"(?P<p{index}>{fnmatch.translate(pattern)})"
+                    for index, pattern in host_patterns
+                )
+            )
+
+    def match(self, url):
+        """
+        Returns the handler of the first pattern matching `url`, in the order
+        they were declared, or None.
+        """
+        first = len(self._handlers)
+        try:
+            host_patterns = self._by_host.get(urlsplit(url).netloc)
+        except ValueError:  # invalid url
+            host_patterns = None
+        if host_patterns:
+            match = host_patterns.match(url)
+            if match:
+                first = int(match.lastgroup[1:])
+        for index, literal, regex in self._other:
+            if index > first:
+                break
+            if literal in url and regex.match(url):
+                first = index
+                break
+        return self._handlers[first] if first < len(self._handlers) else None
+
+    def __getitem__(self, pattern):
+        return self._patterns[pattern]
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __len__(self):
+        return len(self._patterns)
+
+
 def load_scraper():
     try:
         user_scraping = (Path(current_app.config["USER_DIR"]) / "scraping.py").open()
     except FileNotFoundError:
-        return {}
+        return ScrapingPatterns()
     user_locals = {}
     exec(user_scraping.read(), globals(), user_locals)
     user_scraping.close()
-    return user_locals.get("PATTERNS", {})
+    return ScrapingPatterns(user_locals.get("PATTERNS", {}))
 
 
 def get_db(force_reconnect=False):
@@ -89,20 +196,144 @@ def get_db(force_reconnect=False):
     return g.db
 
 
+# each thread keeps its own store, so its connection is opened once and not
+# shared with other threads
+_thread_stores = threading.local()
+
+
+def get_store():
+    """
+    Returns the internal store archivy keeps its users and indexes in.
+
+    See `archivy.store` for the methods it provides.
+    """
+    internal_dir = current_app.config["INTERNAL_DIR"]
+    store_cls = STORES[current_app.config["INTERNAL_STORE"]]
+    store = getattr(_thread_stores, "store", None)
+    if (
+        store is None
+        or store.internal_dir != internal_dir
+        or not isinstance(store, store_cls)
+    ):
+        if store is not None:
+            store.close()
+        store = _thread_stores.store = store_cls(internal_dir)
+    return store
+
+
+# dataobj ids are leased from the internal store in blocks of this size
+ID_BLOCK_SIZE = 100
+
+# internal dir -> this process's current lease of dataobj ids
+_id_leases = {}
+_id_leases_lock = threading.Lock()
+
+
+@contextmanager
+def _id_file_lock(internal_dir):
+    """Locks the dataobj ids of `internal_dir` against other processes."""
+    if not fcntl and not msvcrt:
+        raise RuntimeError(
+            "Can't lock the dataobj ids: neither fcntl nor msvcrt is available."
+        )
+    with (Path(internal_dir) / "ids.lock").open("a+") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            # msvcrt locks bytes from the current position
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # still locked after 10 attempts
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _get_id_lease(internal_dir):
+    lease = _id_leases.get(internal_dir)
+    # a forked process must not reuse its parent's ids
+    if lease and lease["pid"] == os.getpid():
+        return lease
+    return None
+
+
+def allocate_ids(n=1):
+    """
+    Returns a list of `n` new, unique dataobj ids.
+
+    Ids are leased from the internal store in blocks of at least
+    `ID_BLOCK_SIZE` ids, under a file lock so that several archivy processes
+    never get the same ids. They are then handed out from memory, so the
+    store is only written to once per block.
+    """
+    internal_dir = current_app.config["INTERNAL_DIR"]
+    ids = []
+    with _id_leases_lock:
+        lease = _get_id_lease(internal_dir)
+        while len(ids) < n:
+            if not lease or lease["next"] > lease["last"]:
+                size = max(n - len(ids), ID_BLOCK_SIZE)
+                with _id_file_lock(internal_dir):
+                    store = get_store()
+                    start = store.get("max_id", 0) + 1
+                    store.set("max_id", start + size - 1)
+                lease = {
+                    "next": start,
+                    "last": start + size - 1,
+                    "pid": os.getpid(),
+                    "store_cls": type(store),
+                }
+                _id_leases[internal_dir] = lease
+            taken = min(n - len(ids), lease["last"] - lease["next"] + 1)
+            ids.extend(range(lease["next"], lease["next"] + taken))
+            lease["next"] += taken
+    return ids
+
+
+@atexit.register
+def release_unused_ids():
+    """
+    Hands the unused ids of this process's leases back to the store, if no
+    other process has leased ids since, to avoid leaving gaps between ids.
+    """
+    with _id_leases_lock:
+        for internal_dir in list(_id_leases):
+            lease = _get_id_lease(internal_dir)
+            del _id_leases[internal_dir]
+            if not lease or not Path(internal_dir).exists():
+                continue
+            with _id_file_lock(internal_dir):
+                store = lease["store_cls"](internal_dir)
+                if store.get("max_id") == lease["last"]:
+                    store.set("max_id", lease["next"] - 1)
+
+
 def get_max_id():
-    """Returns the current maximum id of dataobjs in the database."""
-    db = get_db()
-    max_id = db.search(Query().name == "max_id")
-    if not max_id:
-        db.insert({"name": "max_id", "val": 0})
-        return 0
-    return max_id[0]["val"]
+    """Returns the id of the last dataobj created."""
+    with _id_leases_lock:
+        lease = _get_id_lease(current_app.config["INTERNAL_DIR"])
+    if lease:
+        return lease["next"] - 1
+    return get_store().get("max_id", 0)
 
 
 def set_max_id(val):
-    """Sets a new max_id"""
-    db = get_db()
-    db.update(operations.set("val", val), Query().name == "max_id")
+    """
+    Sets a new max_id. The next dataobj created will have id `val + 1`.
+    """
+    internal_dir = current_app.config["INTERNAL_DIR"]
+    with _id_leases_lock, _id_file_lock(internal_dir):
+        _id_leases.pop(internal_dir, None)
+        get_store().set("max_id", val)
 
 
 def test_es_connection(es):
@@ -129,28 +360,56 @@ def test_es_connection(es):
         )
 
 
+# long-lived elasticsearch clients, keyed by their connection settings
+_es_clients = {}
+# time of the last successful health check of each client
+_es_health_checks = {}
+
+
 def get_elastic_client(error_if_invalid=True):
-    """Returns the elasticsearch client you can use to search and insert / delete data"""
+    """
+    Returns the elasticsearch client you can use to search and insert / delete data
+
+    The client is created once per process and reused, keeping its pool of
+    connections alive. Its health is only checked again once
+    `SEARCH_CONF["es_health_ttl"]` seconds have passed since the last check.
+    """
+    search_conf = current_app.config["SEARCH_CONF"]
     if (
-        not current_app.config["SEARCH_CONF"]["enabled"]
-        or current_app.config["SEARCH_CONF"]["engine"] != "elasticsearch"
+        not search_conf["enabled"] or search_conf["engine"] != "elasticsearch"
     ) and error_if_invalid:
         return None
 
-    auth_setup = (
-        current_app.config["SEARCH_CONF"]["es_user"]
-        and current_app.config["SEARCH_CONF"]["es_password"]
+    auth = None
+    if search_conf["es_user"] and search_conf["es_password"]:
+        auth = (search_conf["es_user"], search_conf["es_password"])
+    client_key = (
+        search_conf["url"],
+        auth,
+        search_conf["es_timeout"],
+        search_conf["es_max_retries"],
+        search_conf["es_pool_size"],
     )
-    if auth_setup:
-        es = Elasticsearch(
-            current_app.config["SEARCH_CONF"]["url"],
-            http_auth=(
-                current_app.config["SEARCH_CONF"]["es_user"],
-                current_app.config["SEARCH_CONF"]["es_password"],
-            ),
+    es = _es_clients.get(client_key)
+    if es is None:
+        options = {
+            "timeout": search_conf["es_timeout"],
+            "max_retries": search_conf["es_max_retries"],
+            "retry_on_timeout": True,
+            "maxsize": search_conf["es_pool_size"],
+        }
+        if auth:
+            options["http_auth"] = auth
+        es = _es_clients.setdefault(
+            client_key, Elasticsearch(search_conf["url"], **options)
         )
-    else:
-        es = Elasticsearch(current_app.config["SEARCH_CONF"]["url"])
+
+    last_check = _es_health_checks.get(client_key)
+    if (
+        last_check is not None
+        and time.monotonic() - last_check < search_conf["es_health_ttl"]
+    ):
+        return es
     if error_if_invalid:
         test_es_connection(es)
     else:
@@ -158,6 +417,7 @@ def get_elastic_client(error_if_invalid=True):
             es.cluster.health()
         except elasticsearch.exceptions.ConnectionError:
             return False
+    _es_health_checks[client_key] = time.monotonic()
     return es
 
 
@@ -240,3 +500,51 @@ def is_safe_redirect_url(target):
         redirect_url.scheme in ("http", "https")
         and host_url.netloc == redirect_url.netloc
     )
+
+
+def file_validators(filepath):
+    """
+    Returns a strong ETag derived from the inode, modification time and size
+    of the file at `filepath`, and its modification time for the
+    `Last-Modified` header, or None if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    etag = f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    return etag, datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+
+def _etag_matches(etags, etag, weak=False):
+    if etags.star_tag:
+        return True
+    # Flask-Compress appends the compression to the ETags it sends, eg. `:gzip`
+    return etag in {tag.split(":", 1)[0] for tag in etags.as_set(include_weak=weak)}
+
+
+def is_not_modified(validators):
+    """
+    Checks the `If-None-Match` or, if it's absent, `If-Modified-Since` header
+    of the request against the `validators` returned by `file_validators`.
+    """
+    etag, last_modified = validators
+    if request.if_none_match:
+        return _etag_matches(request.if_none_match, etag, weak=True)
+    since = request.if_modified_since
+    return since is not None and last_modified <= since
+
+
+def is_precondition_failed(validators):
+    """Checks if the request has an `If-Match` header that doesn't match `validators`."""
+    if not request.if_match:
+        return False
+    return validators is None or not _etag_matches(request.if_match, validators[0])
+
+
+def set_validators(response, validators):
+    """Sets the `ETag` and `Last-Modified` headers of `response`."""
+    if validators:
+        response.set_etag(validators[0])
+        response.last_modified = validators[1]
+    return response
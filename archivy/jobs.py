@@ -0,0 +1,221 @@
+"""
+A small persistent job queue, used to process bookmarks in the background
+instead of inside the request that creates them.
+
+Jobs are stored in a SQLite database in the `INTERNAL_DIR`, so they survive
+restarts, and are run by a pool of worker threads configured in `JOBS_CONF`.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+from flask import current_app
+
+DB_FILENAME = "jobs.sqlite3"
+SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_at ON jobs (status, run_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# jobs left running for longer than this, eg. by a process that was killed,
+# are picked up again
+RUNNING_TIMEOUT = 600
+
+# kind of job -> function called with the job payload, returning its result
+JOB_HANDLERS = {}
+
+# internal dir -> (worker threads, event set when new jobs are queued,
+# event set to stop the workers)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """Decorator registering the function that runs jobs of the given kind."""
+
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def connect():
+    conn = sqlite3.connect(
+        str(Path(current_app.config["INTERNAL_DIR"]) / DB_FILENAME),
+        timeout=30,
+        isolation_level=None,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _format_job(row):
+    if not row:
+        return None
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+    }
+
+
+def enqueue(kind, payload):
+    """
+    Adds a job to the queue, starting the workers if needed.
+
+    Returns the job id.
+    """
+    now = time.time()
+    with closing(connect()) as conn:
+        job_id = conn.execute(
+            "INSERT INTO jobs (kind, payload, status, run_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), QUEUED, now, now),
+        ).lastrowid
+    start_workers()
+    return job_id
+
+
+def get_job(job_id):
+    """Returns the status, number of attempts, result and error of a job."""
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _format_job(row)
+
+
+def _claim_job(conn):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE (status = ? AND run_at <= ?) "
+            "OR (status = ? AND updated_at < ?) ORDER BY run_at LIMIT 1",
+            (QUEUED, now, RUNNING, now - RUNNING_TIMEOUT),
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ?",
+                (RUNNING, now, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def run_job(conn, row):
+    """Runs a claimed job, and requeues it with a growing delay if it fails."""
+    jobs_conf = current_app.config["JOBS_CONF"]
+    attempts = row["attempts"] + 1
+    try:
+        result = JOB_HANDLERS[row["kind"]](json.loads(row["payload"]))
+    except Exception as e:
+        current_app.logger.warning(f"Job {row['id']} failed: {e}")
+        if attempts >= jobs_conf["max_attempts"]:
+            status, run_at = FAILED, time.time()
+        else:
+            status = QUEUED
+            run_at = time.time() + jobs_conf["retry_delay"] * 2 ** (attempts - 1)
+        conn.execute(
+            "UPDATE jobs SET status = ?, run_at = ?, updated_at = ?, error = ? "
+            "WHERE id = ?",
+            (status, run_at, time.time(), str(e), row["id"]),
+        )
+        return
+    conn.execute(
+        "UPDATE jobs SET status = ?, updated_at = ?, result = ?, error = NULL "
+        "WHERE id = ?",
+        (DONE, time.time(), json.dumps(result), row["id"]),
+    )
+
+
+def run_pending():
+    """Runs the jobs that are due in the current thread, until there are none left."""
+    with closing(connect()) as conn:
+        while True:
+            row = _claim_job(conn)
+            if not row:
+                return
+            run_job(conn, row)
+
+
+def _work(app, wakeup, stop):
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                run_pending()
+            except Exception as e:
+                app.logger.error(f"Job worker error: {e}")
+            wakeup.wait(timeout=1)
+            wakeup.clear()
+
+
+def start_workers():
+    """
+    Starts the worker threads of this process, if they aren't running yet,
+    or wakes them up.
+    """
+    app = current_app._get_current_object()
+    internal_dir = app.config["INTERNAL_DIR"]
+    with _pools_lock:
+        if internal_dir in _pools:
+            _pools[internal_dir][1].set()
+            return
+        wakeup, stop = threading.Event(), threading.Event()
+        workers = [
+            threading.Thread(target=_work, args=(app, wakeup, stop), daemon=True)
+            for _ in range(app.config["JOBS_CONF"]["workers"])
+        ]
+        for worker in workers:
+            worker.start()
+        _pools[internal_dir] = (workers, wakeup, stop)
+
+
+def stop_workers(timeout=None):
+    """Stops the worker threads of this process once they finish their current job."""
+    with _pools_lock:
+        pool = _pools.pop(current_app.config["INTERNAL_DIR"], None)
+    if pool:
+        workers, wakeup, stop = pool
+        stop.set()
+        wakeup.set()
+        for worker in workers:
+            worker.join(timeout)
+
+
+def resume_jobs():
+    """
+    Starts the workers at startup, so that the jobs queued before a restart
+    are run without waiting for new ones. Jobs that were left running by the
+    previous process are queued again.
+    """
+    with closing(connect()) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, run_at = ?, updated_at = ? WHERE status = ?",
+            (QUEUED, time.time(), time.time(), RUNNING),
+        )
+    start_workers()
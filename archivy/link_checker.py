@@ -0,0 +1,241 @@
+"""
+Checks that the urls of your bookmarks still work.
+
+Results are stored in a SQLite database in the `INTERNAL_DIR` instead of the
+bookmarks themselves, so checking links never modifies your notes. Links can
+be checked with the `archivy check-links` command, or periodically in the
+background as configured in `LINK_CHECK_CONF`.
+
+Urls are checked concurrently, but requests to the same host are spaced out
+by `LINK_CHECK_CONF["host_delay"]` seconds so no site gets hammered.
+"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from itertools import chain, zip_longest
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from flask import current_app
+
+from archivy import data
+from archivy.fetcher import get_session
+
+DB_FILENAME = "link_checks.sqlite3"
+SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS link_checks (
+    dataobj_id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER,
+    redirect TEXT,
+    error TEXT,
+    checked_at REAL NOT NULL
+);
+"""
+
+# results are saved in batches of this size
+SAVE_BATCH_SIZE = 100
+
+# internal dir -> scheduler thread
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def connect():
+    conn = sqlite3.connect(
+        str(Path(current_app.config["INTERNAL_DIR"]) / DB_FILENAME),
+        timeout=30,
+        isolation_level=None,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class HostThrottle:
+    """Spaces out the requests made to each host by at least `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._next_request = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request.get(host, now))
+            self._next_request[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+def check_url(session, url, timeout):
+    """
+    Checks if `url` still works, with a `HEAD` request, or a `GET` request
+    for servers that don't handle `HEAD` properly.
+
+    Returns a `(status, redirect, error)` tuple, where `redirect` is the url
+    the request was redirected to, if any.
+    """
+    try:
+        resp = session.head(url, allow_redirects=True, timeout=timeout)
+        if resp.status_code >= 400:
+            with session.get(
+                url, allow_redirects=True, timeout=timeout, stream=True
+            ) as get_resp:
+                resp = get_resp
+    except requests.RequestException as e:
+        return None, None, str(e)
+    redirect = resp.url if resp.history and resp.url != url else None
+    return resp.status_code, redirect, None
+
+
+def _interleave_hosts(bookmarks):
+    """Orders bookmarks so that consecutive ones are on different hosts when possible."""
+    by_host = {}
+    for bookmark in bookmarks:
+        by_host.setdefault(urlsplit(bookmark[1]).netloc.lower(), []).append(bookmark)
+    # hosts with the most bookmarks first, as they take the longest to check
+    hosts = sorted(by_host.values(), key=len, reverse=True)
+    return [
+        bookmark for bookmark in chain(*zip_longest(*hosts)) if bookmark is not None
+    ]
+
+
+def get_bookmarks(max_age=None):
+    """
+    Returns the `(id, url)` of every bookmark, or only of the ones that haven't
+    been checked in the last `max_age` seconds.
+    """
+    bookmarks = [
+        (dataobj["id"], dataobj["url"])
+        for dataobj in data.get_items(structured=False)
+        if "id" in dataobj and dataobj.get("url")
+    ]
+    if not max_age:
+        return bookmarks
+    with closing(connect()) as conn:
+        recent = {
+            row["dataobj_id"]
+            for row in conn.execute(
+                "SELECT dataobj_id FROM link_checks WHERE checked_at >= ?",
+                (time.time() - max_age,),
+            )
+        }
+    return [bookmark for bookmark in bookmarks if bookmark[0] not in recent]
+
+
+def check_links(max_age=None, progress=None):
+    """
+    Checks the urls of all bookmarks and stores the results.
+
+    - **max_age** - if set, bookmarks checked less than `max_age` seconds ago are skipped.
+    - **progress** - optional function called with each new result.
+
+    Returns the number of bookmarks that were checked.
+    """
+    conf = current_app.config["LINK_CHECK_CONF"]
+    session = get_session()
+    throttle = HostThrottle(conf["host_delay"])
+
+    with closing(connect()) as conn:
+        # forget the bookmarks that were deleted
+        conn.execute("CREATE TEMP TABLE bookmarks (id INTEGER PRIMARY KEY)")
+        conn.executemany(
+            "INSERT OR IGNORE INTO bookmarks VALUES (?)",
+            [(dataobj_id,) for dataobj_id, _ in get_bookmarks()],
+        )
+        conn.execute(
+            "DELETE FROM link_checks WHERE dataobj_id NOT IN (SELECT id FROM bookmarks)"
+        )
+        bookmarks = get_bookmarks(max_age)
+
+        def check(dataobj_id, url):
+            throttle.wait(urlsplit(url).netloc.lower())
+            return (dataobj_id, url, *check_url(session, url, conf["timeout"]))
+
+        results = []
+
+        def save():
+            conn.executemany(
+                "INSERT OR REPLACE INTO link_checks "
+                "(dataobj_id, url, status, redirect, error, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                results,
+            )
+            results.clear()
+
+        with ThreadPoolExecutor(max_workers=conf["workers"]) as executor:
+            futures = [
+                executor.submit(check, *bookmark)
+                for bookmark in _interleave_hosts(bookmarks)
+            ]
+            for future in as_completed(futures):
+                results.append((*future.result(), time.time()))
+                if progress:
+                    progress(results[-1])
+                if len(results) >= SAVE_BATCH_SIZE:
+                    save()
+        save()
+    return len(bookmarks)
+
+
+def _format_check(row):
+    return {
+        "dataobj_id": row["dataobj_id"],
+        "url": row["url"],
+        "status": row["status"],
+        "redirect": row["redirect"],
+        "error": row["error"],
+        "checked_at": row["checked_at"],
+    }
+
+
+def get_link_check(dataobj_id):
+    """Returns the result of the last check of a bookmark, or None."""
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT * FROM link_checks WHERE dataobj_id = ?", (dataobj_id,)
+        ).fetchone()
+    return _format_check(row) if row else None
+
+
+def get_broken_links():
+    """Returns the last check of the bookmarks that failed or returned an error status."""
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT * FROM link_checks WHERE status IS NULL OR status >= 400 "
+            "ORDER BY dataobj_id"
+        ).fetchall()
+    return [_format_check(row) for row in rows]
+
+
+def _schedule(app):
+    with app.app_context():
+        while True:
+            interval = app.config["LINK_CHECK_CONF"]["interval"]
+            try:
+                checked = check_links(max_age=interval)
+                app.logger.info(f"Checked the links of {checked} bookmarks")
+            except Exception as e:
+                app.logger.error(f"Link checker error: {e}")
+            time.sleep(interval)
+
+
+def start_scheduler():
+    """
+    Starts the thread checking links every `LINK_CHECK_CONF["interval"]`
+    seconds, if it isn't running yet.
+    """
+    app = current_app._get_current_object()
+    with _schedulers_lock:
+        if app.config["INTERNAL_DIR"] in _schedulers:
+            return
+        scheduler = threading.Thread(target=_schedule, args=(app,), daemon=True)
+        scheduler.start()
+        _schedulers[app.config["INTERNAL_DIR"]] = scheduler
@@ -0,0 +1,100 @@
+import re
+from collections import deque
+
+from archivy import helpers, data
+
+# [[title|id]] wikilinks, written as [[title|id)]] by some older versions
+WIKILINK_PATTERN = re.compile(r"\[\[[^\[\]]*?\|(\d+)\)?\]\]")
+
+# the links are indexed by target: the keys are the ids of the linked
+# dataobjs, and the ids are the dataobjs linking to them
+LINK_INDEX = "links"
+
+
+def get_linked_ids(content):
+    """Returns the ids of the dataobjs linked to from `content`."""
+    return {int(dataobj_id) for dataobj_id in WIKILINK_PATTERN.findall(content)}
+
+
+def build_link_index():
+    """Builds the link index by parsing the wikilinks of every dataobj."""
+    link_index = {}
+    for dataobj in data.get_items(structured=False, load_content=True):
+        if "id" not in dataobj:
+            continue  # not formatted by archivy yet
+        for target in get_linked_ids(dataobj.content):
+            link_index.setdefault(str(target), []).append(dataobj["id"])
+    return link_index
+
+
+def _get_store(force=False):
+    """
+    Returns the internal store, after building the link index if needed.
+
+    The index is kept up to date as dataobjs are created, edited and deleted.
+    Use `force=True` to rebuild it from the files.
+    """
+    store = helpers.get_store()
+    if force or not store.index_exists(LINK_INDEX):
+        store.replace_index(LINK_INDEX, build_link_index())
+        store.delete("link_graph")  # stored as a single value by older versions
+    return store
+
+
+def index_dataobj_links(*dataobjs):
+    """Updates the link index with the current outlinks of the given dataobjs."""
+    _get_store().update_index(
+        LINK_INDEX,
+        {
+            dataobj.id: {
+                str(target) for target in get_linked_ids(dataobj.content or "")
+            }
+            for dataobj in dataobjs
+        },
+    )
+
+
+def remove_from_link_graph(*dataobj_ids):
+    """Removes the outlinks and backlinks of the dataobjs of the given ids."""
+    store = _get_store()
+    store.update_index(LINK_INDEX, {dataobj_id: () for dataobj_id in dataobj_ids})
+    store.remove_index_keys(LINK_INDEX, [str(dataobj_id) for dataobj_id in dataobj_ids])
+
+
+def get_outlinks(dataobj_id):
+    """Returns the ids of the dataobjs `dataobj_id` links to."""
+    return sorted(
+        int(key) for key in _get_store().get_index_keys(LINK_INDEX, dataobj_id)
+    )
+
+
+def get_backlinks(dataobj_id):
+    """Returns the ids of the dataobjs linking to `dataobj_id`."""
+    return _get_store().get_index_ids(LINK_INDEX, str(dataobj_id))
+
+
+def get_neighbourhood(dataobj_id, hops=1):
+    """
+    Returns the dataobjs at most `hops` links away from `dataobj_id`,
+    following links in both directions.
+
+    Returns a dict with the `nodes` ids and the `edges` between them, as
+    `[source, target]` pairs.
+    """
+    distances = {dataobj_id: 0}
+    queue = deque([dataobj_id])
+    while queue:
+        current = queue.popleft()
+        if distances[current] == hops:
+            continue
+        for neighbour in get_outlinks(current) + get_backlinks(current):
+            if neighbour not in distances:
+                distances[neighbour] = distances[current] + 1
+                queue.append(neighbour)
+    edges = [
+        [source, target]
+        for source in distances
+        for target in get_outlinks(source)
+        if target in distances
+    ]
+    return {"nodes": sorted(distances), "edges": edges}
@@ -1,29 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from pkg_resources import require
+import time
 from typing import List, Optional
-from urllib.parse import urljoin
 from io import BytesIO
-import fnmatch
 
 import frontmatter
-import requests
 import validators
 from attr import attrs, attrib
 from attr.validators import instance_of, optional
-from bs4 import BeautifulSoup
 from flask import flash, current_app
 from flask_login import UserMixin
-from html2text import html2text
-from readability import Document
-from tinydb import Query
 from werkzeug.security import generate_password_hash
 from werkzeug.datastructures import FileStorage
 
 from archivy import helpers
-from archivy.data import create, save_image, valid_image_filename
-from archivy.search import add_to_index
-from archivy.tags import add_tag_to_index
-
+from archivy.bookmarks import find_bookmark, index_bookmark_urls
+from archivy.data import (
+    create,
+    index_dataobj_path,
+    save_image,
+    update_item_frontmatter,
+    update_item_md,
+)
+from archivy.search import add_to_index, bulk_add_to_index
+from archivy.fetcher import fetch, FetchError
+from archivy.jobs import job_handler
+from archivy.links import index_dataobj_links
+from archivy.parsing import parse_page, fill_image_placeholders
+from archivy.tags import index_dataobj_tags
 
 # TODO: use this as 'type' field
 # class DataobjType(Enum):
@@ -99,93 +103,126 @@ class DataObj:
             self.url
         ):
             return None
+        patterns = current_app.config["SCRAPING_PATTERNS"]
+        if not isinstance(patterns, helpers.ScrapingPatterns):
+            # patterns set as a plain dict are compiled once
+            patterns = helpers.ScrapingPatterns(patterns)
+            current_app.config["SCRAPING_PATTERNS"] = patterns
         selector = None
-        for pattern, handler in current_app.config["SCRAPING_PATTERNS"].items():
-            if fnmatch.fnmatch(self.url, pattern):
-                if type(handler) == str:
-                    # if the handler is a string, it's simply a css selector to process the page with
-                    selector = handler
-                    break
-                # otherwise custom user function that overrides archivy behavior
-                handler(self)
-                return
+        handler = patterns.match(self.url)
+        if type(handler) == str:
+            # if the handler is a string, it's simply a css selector to process the page with
+            selector = handler
+        elif handler:
+            # otherwise custom user function that overrides archivy behavior
+            handler(self)
+            return
 
         try:
-            page_html = (
-                raw_html
-                or requests.get(
-                    self.url,
-                    headers={"User-agent": f"Archivy/v{require('archivy')[0].version}"},
-                ).text
-            )
-        except Exception:
+            page_html = raw_html or fetch(self.url).text
+        except FetchError:
             self.error = f"Could not retrieve {self.url}\n"
             self.wipe()
             return
 
         try:
-            document = Document(page_html)
-            self.title = document.short_title() or self.url
-            parsed_html = BeautifulSoup(document.summary(), features="html.parser")
-        except Exception:
+            parsed = parse_page(page_html, self.url, selector)
+        except Exception as e:
+            current_app.logger.warning(f"Could not parse {self.url}: {e}")
             self.error = f"Could not parse {self.url}\n"
             self.wipe()
             return
 
-        try:
-            self.content = self.extract_content(parsed_html, selector)
-        except Exception:
+        self.title = parsed["title"]
+        if parsed["content"] is None:
             self.error = f"Could not extract content from {self.url}\n"
             return
+        self.content = parsed["content"]
+        if parsed["images"]:
+            saved = self.save_images(parsed["images"])
+            self.content = fill_image_placeholders(
+                self.content, parsed["images"], saved
+            )
+
+    def insert_bookmark(self, raw_html=None):
+        """
+        Processes and inserts a bookmark, unless its url has already been saved.
+
+        What happens to bookmarks of already saved urls depends on
+        `SCRAPING_CONF["duplicates"]`:
+
+        - `existing` - nothing is downloaded and the id of the existing bookmark is returned
+        - `refresh` - the page is downloaded again and replaces the content of the existing bookmark
+        - `create` - a new bookmark is created
+
+        Returns the id of the bookmark, or False.
+        """
+        policy = current_app.config["SCRAPING_CONF"]["duplicates"]
+        existing_id = None
+        if policy != "create" and validators.url(self.url):
+            existing_id = find_bookmark(self.url)
+        if existing_id is None:
+            self.process_bookmark_url(raw_html)
+            return self.insert()
+
+        if policy == "refresh":
+            self.process_bookmark_url(raw_html)
+            if not self.validate():
+                return False
+            update_item_frontmatter(existing_id, {"title": self.title})
+            update_item_md(existing_id, self.content)
+        self.id = existing_id
+        return self.id
 
     def wipe(self):
         """Resets and invalidates dataobj"""
         self.title = ""
         self.content = ""
 
-    def extract_content(self, beautsoup, selector=None):
-        """converts html bookmark url to optimized markdown and saves images"""
-
-        url = self.url.rstrip("/")
-
-        if selector:
-            selected_soup = beautsoup.select(selector)
-            # if the custom selector matched, take the first occurrence
-            if selected_soup:
-                beautsoup = selected_soup[0]
-        resources = beautsoup.find_all(["a", "img"])
-        for tag in resources:
-            if tag.name == "a":
-                if tag.has_attr("href") and (tag["href"].startswith("/")):
-                    tag["href"] = urljoin(url, tag["href"])
-
-                # check it's a normal link and not some sort of image
-                # string returns the text content of the tag
-                if not tag.string:
-                    # delete tag
-                    tag.decompose()
-
-            elif tag.name == "img" and tag.has_attr("src"):
-                filename = tag["src"].split("/")[-1]
-                try:
-                    filename = filename[
-                        : filename.index("?")
-                    ]  # remove query parameters
-                except ValueError:
-                    pass
-                if not tag["src"].startswith("http"):
-                    tag["src"] = urljoin(url, tag["src"])
-                if current_app.config["SCRAPING_CONF"][
-                    "save_images"
-                ] and valid_image_filename(filename):
-                    image = FileStorage(
-                        BytesIO(requests.get(tag["src"]).content), filename, name="file"
-                    )
-                    saved_to = save_image(image)
-                    tag["src"] = "/images/" + saved_to
-
-        res = html2text(str(beautsoup), bodywidth=0)
-        return res
+    def save_images(self, images):
+        """
+        Downloads the images of a bookmark concurrently.
+
+        - **images** - list of `(url, filename)` pairs.
+
+        Returns a dict mapping the url of each saved image to the path of its
+        local copy. Images that are too big, can't be downloaded or are still
+        downloading once `SCRAPING_CONF["images_timeout"]` has passed are left
+        out. Downloaded images are saved in the order they appear in the page,
+        so their local filenames don't depend on which download finished first.
+
+        The timeout also bounds each request, so downloads that are still
+        running when it passes stop on their own instead of lingering.
+        """
+        conf = current_app.config["SCRAPING_CONF"]
+        app = current_app._get_current_object()
+        deadline = time.monotonic() + conf["images_timeout"]
+        executor = ThreadPoolExecutor(max_workers=conf["image_workers"])
+        downloads = {}
+        for url, _ in images:
+            if url not in downloads:
+                downloads[url] = executor.submit(
+                    download_image, app, url, conf["max_image_size"], deadline
+                )
+        wait(downloads.values(), timeout=conf["images_timeout"])
+        # shutdown(cancel_futures=True) is only available from python 3.9
+        for download in downloads.values():
+            download.cancel()
+        executor.shutdown(wait=False)
+
+        saved = {}
+        for url, filename in images:
+            if url in saved:
+                continue
+            download = downloads[url]
+            if not download.done() or download.cancelled():
+                continue
+            content = download.result()
+            if content is None:
+                continue
+            image = FileStorage(BytesIO(content), filename, name="file")
+            saved[url] = "/images/" + save_image(image)
+        return saved
 
     def validate(self):
         """Verifies that the content matches required validation constraints"""
@@ -202,44 +239,80 @@ class DataObj:
     def insert(self):
         """Creates a new file with the object's attributes"""
         if self.validate():
-            for tag in self.tags:
-                add_tag_to_index(tag)
-            helpers.set_max_id(helpers.get_max_id() + 1)
-            self.id = helpers.get_max_id()
-            self.date = datetime.now()
-
-            hooks = current_app.config["HOOKS"]
-
-            hooks.before_dataobj_create(self)
-            data = {
-                "type": self.type,
-                "title": str(self.title),
-                "date": self.date.strftime("%x").replace("/", "-"),
-                "modified_at": self.date.strftime("%x %H:%M"),
-                "tags": self.tags,
-                "id": self.id,
-                "path": self.path,
-            }
-            if self.type == "bookmark" or self.type == "pocket_bookmark":
-                data["url"] = self.url
-
-            # convert to markdown file
-            dataobj = frontmatter.Post(self.content)
-            dataobj.metadata = data
-            self.fullpath = str(
-                create(
-                    frontmatter.dumps(dataobj),
-                    f"{self.id}-{dataobj['title']}",
-                    path=self.path,
-                )
-            )
-
-            hooks.on_dataobj_create(self)
+            self.id = helpers.allocate_ids()[0]
+            self.create_file()
             self.index()
             return self.id
         return False
 
+    @classmethod
+    def insert_many(cls, dataobjs):
+        """
+        Creates the files of many dataobjs at once.
+
+        Ids are allocated in a single step, and the tag index, link graph and
+        search index are each updated once for all the dataobjs.
+
+        Returns a list with the id of each dataobj, or False for the ones that
+        are invalid or could not be written.
+        """
+        valid = [dataobj for dataobj in dataobjs if dataobj.validate()]
+        created = []
+        for dataobj, dataobj_id in zip(valid, helpers.allocate_ids(len(valid))):
+            dataobj.id = dataobj_id
+            try:
+                dataobj.create_file()
+                created.append(dataobj)
+            except OSError:
+                pass
+        if created:
+            index_dataobj_tags(*created)
+            index_dataobj_links(*created)
+            index_bookmark_urls(*created)
+            for _ in bulk_add_to_index(created):
+                pass
+        created_ids = {id(dataobj) for dataobj in created}
+        return [
+            dataobj.id if id(dataobj) in created_ids else False for dataobj in dataobjs
+        ]
+
+    def create_file(self):
+        """Writes the markdown file of a dataobj that has been given an id."""
+        self.date = datetime.now()
+
+        hooks = current_app.config["HOOKS"]
+
+        hooks.before_dataobj_create(self)
+        data = {
+            "type": self.type,
+            "title": str(self.title),
+            "date": self.date.strftime("%x").replace("/", "-"),
+            "modified_at": self.date.strftime("%x %H:%M"),
+            "tags": self.tags,
+            "id": self.id,
+            "path": self.path,
+        }
+        if self.type == "bookmark" or self.type == "pocket_bookmark":
+            data["url"] = self.url
+
+        # convert to markdown file
+        dataobj = frontmatter.Post(self.content)
+        dataobj.metadata = data
+        self.fullpath = str(
+            create(
+                frontmatter.dumps(dataobj),
+                f"{self.id}-{dataobj['title']}",
+                path=self.path,
+            )
+        )
+        index_dataobj_path(self.id, self.fullpath)
+
+        hooks.on_dataobj_create(self)
+
     def index(self):
+        index_dataobj_tags(self)
+        index_dataobj_links(self)
+        index_bookmark_urls(self)
         return add_to_index(self)
 
     @classmethod
@@ -266,16 +339,52 @@ class DataObj:
                 # this handles that scenario as validation will simply fail and the event will
                 # be ignored
                 break
+        if data.get("url"):
+            dataobj["url"] = data["url"]
         dataobj["date"] = datetime.strptime(
             data.get("date", "01/01/70").replace("-", "/"), "%x"
         )
         dataobj["modified_at"] = datetime.strptime(
-            data.get("modified_at", "01/01/1970 00:00"), "%x %H:%M"
+            data.get("modified_at", "01/01/70 00:00"), "%x %H:%M"
         )
         dataobj["type"] = "processed-dataobj"
         return cls(**dataobj)
 
 
+def download_image(app, url, max_size, deadline=None):
+    """
+    Returns the content of the image at `url`, or None if it can't be
+    downloaded, is bigger than `max_size` bytes or isn't downloaded before
+    the `deadline`.
+    """
+    with app.app_context():
+        try:
+            return fetch(
+                url, max_size=max_size, use_cache=False, deadline=deadline
+            ).content
+        except FetchError:
+            return None
+
+
+@job_handler("bookmark")
+def save_bookmark(payload):
+    """
+    Job saving a bookmark in the background.
+
+    The payload has the bookmark's `url`, `tags` and `path`, and optionally
+    the `html` of the page if it shouldn't be downloaded.
+    """
+    bookmark = DataObj(
+        url=payload["url"],
+        tags=payload.get("tags", []),
+        path=payload.get("path", ""),
+        type="bookmark",
+    )
+    if not bookmark.insert_bookmark(payload.get("html")):
+        raise RuntimeError(bookmark.error or "Could not save bookmark")
+    return {"dataobj_id": bookmark.id}
+
+
 @attrs(kw_only=True)
 class User(UserMixin):
     """
@@ -302,24 +411,18 @@ class User(UserMixin):
             return False
 
         hashed_password = generate_password_hash(self.password)
-        db = helpers.get_db()
+        store = helpers.get_store()
 
-        if db.search((Query().type == "user") & (Query().username == self.username)):
+        if store.find_user(self.username):
             return False
-        db_user = {
-            "username": self.username,
-            "hashed_password": hashed_password,
-            "is_admin": self.is_admin,
-            "type": "user",
-        }
 
         current_app.config["HOOKS"].on_user_create(self)
-        return db.insert(db_user)
+        return store.add_user(self.username, hashed_password, self.is_admin) or False
 
     @classmethod
     def from_db(cls, db_object):
-        """Takes a database object and turns it into a user"""
+        """Takes a user from the internal store and turns it into a user"""
         username = db_object["username"]
-        id = db_object.doc_id
+        id = db_object["id"]
 
         return cls(username=username, id=id)
@@ -0,0 +1,92 @@
+"""
+Conversion of the pages archivy bookmarks from HTML to markdown.
+
+`readability`, `BeautifulSoup` and `html2text` are pure python and CPU bound,
+so pages are converted in a pool of worker processes instead of the threads
+serving requests. Each page gets a limited amount of CPU time, set by
+`SCRAPING_CONF["parse_cpu_limit"]`.
+
+The conversion itself lives in `archivy_parser`, which the workers import
+without importing the archivy app.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+from archivy_parser import (  # noqa: F401
+    IMAGE_PLACEHOLDER,
+    IMAGE_PLACEHOLDER_RE,
+    CPULimitExceeded,
+    ParseError,
+    extract_content,
+    fill_image_placeholders,
+    html_to_markdown,
+    init_worker,
+    run_limited,
+)
+
+# number of workers -> process pool
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process pool pages are converted in, with
+    `SCRAPING_CONF["parser_workers"]` processes.
+    """
+    workers = current_app.config["SCRAPING_CONF"]["parser_workers"]
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if not pool:
+            # forking the threaded server could copy locks held by other
+            # threads, so workers are started from a clean process instead
+            methods = multiprocessing.get_all_start_methods()
+            if "forkserver" in methods:
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["archivy_parser"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=context, initializer=init_worker
+            )
+            _pools[workers] = pool
+    return pool
+
+
+def _discard_pool(pool):
+    with _pools_lock:
+        for workers, existing in list(_pools.items()):
+            if existing is pool:
+                del _pools[workers]
+    pool.shutdown(wait=False)
+
+
+def parse_page(html, url, selector=None):
+    """
+    Converts a page with `html_to_markdown`, using the parser set in
+    `SCRAPING_CONF["parser"]`.
+
+    Pages are converted in the process pool, unless
+    `SCRAPING_CONF["parser_workers"]` is 0. Raises `ParseError` if the page
+    takes more than `SCRAPING_CONF["parse_cpu_limit"]` seconds of CPU time or
+    a worker dies.
+    """
+    conf = current_app.config["SCRAPING_CONF"]
+    args = (html, url, selector, conf["parser"], conf["save_images"])
+    if not conf["parser_workers"]:
+        return html_to_markdown(*args)
+
+    pool = get_pool()
+    try:
+        return pool.submit(
+            run_limited, conf["parse_cpu_limit"], html_to_markdown, *args
+        ).result()
+    except BrokenProcessPool as e:
+        # a worker was killed, eg. when reaching the hard CPU limit
+        _discard_pool(pool)
+        raise ParseError(f"Worker died while converting {url}") from e
@@ -1,8 +1,6 @@
 from pathlib import Path
 from os.path import sep
 from pkg_resources import require
-from shutil import which
-from datetime import datetime
 
 import frontmatter
 from flask import (
@@ -13,30 +11,35 @@ from flask import (
     url_for,
     send_file,
     send_from_directory,
+    make_response,
+    Response,
 )
 from flask_login import login_user, current_user, logout_user
-from tinydb import Query
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from archivy.models import DataObj, User
-from archivy import data, app, forms, csrf
-from archivy.helpers import get_db, write_config, is_safe_redirect_url
-from archivy.tags import get_all_tags
-from archivy.search import search, search_frontmatter_tags
+from archivy import data, app, forms, csrf, jobs
+from archivy.helpers import (
+    get_store,
+    write_config,
+    is_safe_redirect_url,
+    file_validators,
+    is_not_modified,
+    set_validators,
+)
+from archivy.tags import get_all_tags, get_embedded_tags, get_tag_counts, get_tagged_ids
+from archivy.links import get_backlinks, get_linked_ids
 from archivy.config import Config
 
-import re
-
 
 @app.context_processor
 def pass_defaults():
-    dataobjs = data.get_items()
     version = require("archivy")[0].version
     SEP = sep
     # check windows parsing for js (https://github.com/Uzay-G/archivy/issues/115)
     if SEP == "\\":
         SEP += "\\"
-    return dict(dataobjs=dataobjs, SEP=SEP, version=version, config=app.config)
+    return dict(SEP=SEP, version=version, config=app.config)
 
 
 @app.before_request
@@ -57,14 +60,8 @@ def index():
     path = request.args.get("path", "").lstrip("/")
     try:
         files = data.get_items(path=path)
-        process_modified = lambda x: datetime.strptime(x.get("modified_at"), "%x %H:%M")
-        recent_notes = list(
-            filter(
-                lambda x: "modified_at" in x,
-                data.get_items(path=path, structured=False),
-            )
-        )
-        most_recent = sorted(recent_notes, key=process_modified, reverse=True)[:5]
+        # reuse the scan get_items just did
+        most_recent = data.get_recent_items(path=path, limit=5, refresh=False)
         tag_cloud = set()
         for f in files.child_files:
             for tag in f.get("tags", []):
@@ -99,9 +96,12 @@ def new_bookmark():
         path = form.path.data
         tags = form.tags.data.split(",") if form.tags.data != "" else []
         tags = [tag.strip() for tag in tags]
+        if app.config["JOBS_CONF"]["enabled"]:
+            jobs.enqueue("bookmark", {"url": form.url.data, "tags": tags, "path": path})
+            flash("Bookmark is being saved.", "success")
+            return redirect("/")
         bookmark = DataObj(url=form.url.data, tags=tags, path=path, type="bookmark")
-        bookmark.process_bookmark_url()
-        bookmark_id = bookmark.insert()
+        bookmark_id = bookmark.insert_bookmark()
         if bookmark_id:
             flash("Bookmark Saved!", "success")
             return redirect(f"/dataobj/{bookmark_id}")
@@ -140,29 +140,28 @@ def new_note():
 
 @app.route("/tags")
 def show_all_tags():
-    if not app.config["SEARCH_CONF"]["engine"] == "ripgrep" and not which("rg"):
-        flash("Ripgrep must be installed to view pages about embedded tags.", "error")
-        return redirect("/")
-    tags = sorted(get_all_tags(force=True))
-    return render_template("tags/all.html", title="All Tags", tags=tags)
+    tag_counts = get_tag_counts()
+    tags = sorted(tag_counts)
+    return render_template(
+        "tags/all.html", title="All Tags", tags=tags, tag_counts=tag_counts
+    )
 
 
 @app.route("/tags/<tag_name>")
 def show_tag(tag_name):
-    if not app.config["SEARCH_CONF"]["enabled"] and not which("rg"):
-        flash(
-            "Search (for example ripgrep) must be installed to view pages about embedded tags.",
-            "error",
+    results = []
+    for dataobj_id in get_tagged_ids(tag_name):
+        dataobj = data.get_item(dataobj_id)
+        if not dataobj:
+            continue
+        matches = [
+            line.strip()
+            for line in dataobj.content.splitlines()
+            if f"#{tag_name}#" in line
+        ]
+        results.append(
+            {"id": dataobj_id, "title": dataobj["title"], "matches": matches}
         )
-        return redirect("/")
-
-    results = search(f"#{tag_name}#", strict=True)
-    res_ids = set(
-        [item["id"] for item in results]
-    )  # avoid duplication of results between context-aware embedded tags and metadata ones
-    for res in search_frontmatter_tags(tag_name):
-        if res["id"] not in res_ids:
-            results.append(res)
 
     return render_template(
         "tags/show.html",
@@ -174,6 +173,15 @@ def show_tag(tag_name):
 
 @app.route("/dataobj/<int:dataobj_id>")
 def show_dataobj(dataobj_id):
+    if request.args.get("raw") == "1":
+        filepath = data.get_by_id(dataobj_id)
+        validators = filepath and file_validators(filepath)
+        if validators and is_not_modified(validators):
+            return set_validators(Response(status=304), validators)
+        dataobj = data.get_item(dataobj_id)
+        if dataobj:
+            return set_validators(make_response(frontmatter.dumps(dataobj)), validators)
+
     dataobj = data.get_item(dataobj_id)
     get_title_id_pairs = lambda x: (x["title"], x["id"])
     titles = list(map(get_title_id_pairs, data.get_items(structured=False)))
@@ -189,16 +197,19 @@ def show_dataobj(dataobj_id):
         flash("Data could not be found!", "error")
         return redirect("/")
 
-    if request.args.get("raw") == "1":
-        return frontmatter.dumps(dataobj)
-
     backlinks = []
-    if app.config["SEARCH_CONF"]["enabled"]:
-        if app.config["SEARCH_CONF"]["engine"] == "ripgrep":
-            query = f"\|{dataobj_id}]]"
-        else:
-            query = f"|{dataobj_id})]]"
-        backlinks = search(query, strict=True)
+    for source_id in get_backlinks(dataobj_id):
+        source = data.get_item(source_id)
+        if not source:
+            continue
+        matches = [
+            line.strip()
+            for line in source.content.splitlines()
+            if dataobj_id in get_linked_ids(line)
+        ]
+        backlinks.append(
+            {"id": source_id, "title": source["title"], "matches": matches}
+        )
 
     # Form for moving data into another folder
     move_form = forms.MoveItemForm()
@@ -212,10 +223,7 @@ def show_dataobj(dataobj_id):
     # Get all tags
     tag_list = get_all_tags()
     # and the ones present in this dataobj
-    embedded_tags = set()
-    PATTERN = r"(?:^|\n| )#(?:[-_a-zA-ZÀ-ÖØ-öø-ÿ0-9]+)#"
-    for match in re.finditer(PATTERN, dataobj.content):
-        embedded_tags.add(match.group(0).replace("#", "").lstrip())
+    embedded_tags = get_embedded_tags(dataobj.content)
 
     return render_template(
         "dataobjs/show.html",
@@ -273,13 +281,10 @@ def delete_data(dataobj_id):
 def login():
     form = forms.UserForm()
     if form.validate_on_submit():
-        db = get_db()
-        user = db.search(
-            (Query().username == form.username.data) & (Query().type == "user")
-        )
+        user = get_store().find_user(form.username.data)
 
-        if user and check_password_hash(user[0]["hashed_password"], form.password.data):
-            user = User.from_db(user[0])
+        if user and check_password_hash(user["hashed_password"], form.password.data):
+            user = User.from_db(user)
             login_user(user, remember=True)
             flash("Login successful!", "success")
 
@@ -305,13 +310,10 @@ def logout():
 def edit_user():
     form = forms.UserForm()
     if form.validate_on_submit():
-        db = get_db()
-        db.update(
-            {
-                "username": form.username.data,
-                "hashed_password": generate_password_hash(form.password.data),
-            },
-            doc_ids=[current_user.id],
+        get_store().update_user(
+            current_user.id,
+            username=form.username.data,
+            hashed_password=generate_password_hash(form.password.data),
         )
         flash("Information saved!", "success")
         return redirect("/")
@@ -434,9 +436,12 @@ def save_raw_url():
     html = request.form.get("html")
     if not html:
         return "No HTML provided", 400
+    if app.config["JOBS_CONF"]["enabled"]:
+        jobs.enqueue("bookmark", {"url": request.form.get("url"), "html": html})
+        flash("Bookmark is being saved.", "success")
+        return redirect("/")
     bookmark = DataObj(url=request.form.get("url"), type="bookmark")
-    bookmark.process_bookmark_url(html)
-    if bookmark.insert():
+    if bookmark.insert_bookmark(html):
         return redirect(f"/dataobj/{bookmark.id}")
     else:
         return "Could not save bookmark", 500
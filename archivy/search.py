@@ -1,13 +1,16 @@
 from pathlib import Path
 from shutil import which
-from subprocess import run, PIPE
+from subprocess import run, Popen, PIPE, DEVNULL
 import json
+import os
+import threading
 
+from elasticsearch.helpers import parallel_bulk
 from flask import current_app
 
+from archivy import builtin_search
 from archivy.helpers import get_elastic_client
 
-
 # Example command ["rg", RG_MISC_ARGS, RG_FILETYPE, RG_REGEX_ARG, query, str(get_data_dir())]
 #  rg -il -t md -e query files
 # -i -> case insensitive
@@ -17,6 +20,7 @@ from archivy.helpers import get_elastic_client
 RG_MISC_ARGS = "-it"
 RG_REGEX_ARG = "-e"
 RG_FILETYPE = "md"
+RG_TIMEOUT = 60
 
 
 def add_to_index(model):
@@ -28,55 +32,161 @@ def add_to_index(model):
     - **index** - String of the ES Index. Archivy uses `dataobj` by default.
     - **model** - Instance of `archivy.models.Dataobj`, the object you want to index.
     """
+    if _builtin_enabled():
+        return builtin_search.add_to_index(model)
     es = get_elastic_client()
     if not es:
         return
+    es.index(
+        index=current_app.config["SEARCH_CONF"]["index_name"],
+        id=model.id,
+        body=_es_payload(model),
+    )
+    return True
+
+
+def _builtin_enabled():
+    search_conf = current_app.config["SEARCH_CONF"]
+    return search_conf["enabled"] and search_conf["engine"] == "builtin"
+
+
+def _es_payload(model):
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
-    es.index(
-        index=current_app.config["SEARCH_CONF"]["index_name"], id=model.id, body=payload
+    return payload
+
+
+def bulk_add_to_index(models, batch_size=500, threads=4):
+    """
+    Adds many dataobjs to the index at once, sending them to Elasticsearch
+    through its bulk API in batches of `batch_size`, from several threads.
+
+    Index refreshes are turned off while the documents are being sent.
+
+    With the builtin engine, documents are written to its index in
+    transactions of `batch_size` documents instead.
+
+    Yields `(success, dataobj id)` pairs as documents get indexed.
+    """
+    if _builtin_enabled():
+        yield from builtin_search.bulk_add_to_index(models, batch_size)
+        return
+    es = get_elastic_client()
+    if not es:
+        return
+    index_name = current_app.config["SEARCH_CONF"]["index_name"]
+    actions = (
+        {"_index": index_name, "_id": model.id, "_source": _es_payload(model)}
+        for model in models
     )
-    return True
+    previous_settings = es.indices.get_settings(
+        index=index_name, name="index.refresh_interval"
+    )
+    refresh_interval = (
+        previous_settings.get(index_name, {})
+        .get("settings", {})
+        .get("index", {})
+        .get("refresh_interval")
+    )
+    es.indices.put_settings(
+        index=index_name, body={"index": {"refresh_interval": "-1"}}
+    )
+    try:
+        for success, info in parallel_bulk(
+            es,
+            actions,
+            chunk_size=batch_size,
+            thread_count=threads,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            yield success, int(info["index"]["_id"])
+    finally:
+        es.indices.put_settings(
+            index=index_name, body={"index": {"refresh_interval": refresh_interval}}
+        )
+        es.indices.refresh(index=index_name)
+
+
+def get_index_manifest_path():
+    """
+    Returns the path of the manifest of the configured search engine, so that
+    switching engines doesn't skip notes the other engine hasn't indexed.
+    """
+    engine = current_app.config["SEARCH_CONF"]["engine"]
+    return Path(current_app.config["INTERNAL_DIR"]) / f"index_manifest.{engine}.json"
+
+
+def load_index_manifest():
+    """
+    Returns the manifest of the last `archivy index` run with the current
+    engine: a dict of the hashes of the contents of the indexed files, keyed
+    by their path.
+    """
+    manifest_path = get_index_manifest_path()
+    try:
+        with manifest_path.open("r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_index_manifest(manifest):
+    """Atomically replaces the manifest of indexed files."""
+    manifest_path = get_index_manifest_path()
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
 
 
 def remove_from_index(dataobj_id):
     """Removes object of given id"""
+    if _builtin_enabled():
+        return builtin_search.remove_from_index(dataobj_id)
     es = get_elastic_client()
     if not es:
         return
     es.delete(index=current_app.config["SEARCH_CONF"]["index_name"], id=dataobj_id)
 
 
-def query_es_index(query, strict=False):
+def query_es_index(query, strict=False, limit=None, offset=0):
     """
     Returns search results for your given query
 
     Specify strict=True if you want only exact result (in case you're using ES.
+
+    `limit` and `offset` select a window of the results.
     """
     es = get_elastic_client()
     if not es:
         return []
-    search = es.search(
-        index=current_app.config["SEARCH_CONF"]["index_name"],
-        body={
-            "query": {
-                "multi_match": {
-                    "query": query,
-                    "fields": ["*"],
-                    "analyzer": "rebuilt_standard",
+    body = {
+        "query": {
+            "multi_match": {
+                "query": query,
+                "fields": ["*"],
+                "analyzer": "rebuilt_standard",
+            }
+        },
+        "highlight": {
+            "fragment_size": 0,
+            "fields": {
+                "content": {
+                    "pre_tags": "",
+                    "post_tags": "",
                 }
             },
-            "highlight": {
-                "fragment_size": 0,
-                "fields": {
-                    "content": {
-                        "pre_tags": "",
-                        "post_tags": "",
-                    }
-                },
-            },
         },
+    }
+    if limit is not None:
+        body["size"] = limit
+    if offset:
+        body["from"] = offset
+    search = es.search(
+        index=current_app.config["SEARCH_CONF"]["index_name"],
+        body=body,
     )
 
     hits = []
@@ -92,7 +202,7 @@ def query_es_index(query, strict=False):
 
 
 def parse_ripgrep_line(line):
-    """Parses a line of ripgrep JSON output"""
+    """Parses a line of ripgrep JSON output, as a string or bytes"""
     hit = json.loads(line)
     data = {}
     if hit["type"] == "begin":
@@ -109,10 +219,43 @@ def parse_ripgrep_line(line):
     return (data, hit["type"])
 
 
-def query_ripgrep(query):
+def stream_ripgrep(rg_cmd, timeout=RG_TIMEOUT):
+    """
+    Runs the given ripgrep command and yields its parsed JSON events as they
+    are output.
+
+    ripgrep is stopped as soon as the generator is closed, so callers can
+    stop reading once they have enough results, or after `timeout` seconds,
+    even if it doesn't output anything.
+    """
+    rg = Popen(rg_cmd, stdout=PIPE, stderr=DEVNULL)
+    timer = threading.Timer(timeout, rg.kill)
+    timer.start()
+    try:
+        for line in rg.stdout:
+            parsed = parse_ripgrep_line(line)
+            if parsed:
+                yield parsed
+    finally:
+        timer.cancel()
+        rg.stdout.close()
+        if rg.poll() is None:
+            rg.kill()
+        rg.wait()
+
+
+def query_ripgrep(query, limit=None, offset=0, max_count=None):
     """
     Uses ripgrep to search data with a simpler setup than ES.
     Returns a list of dicts with detailed matches.
+
+    - **limit** - maximum number of notes to return.
+    - **offset** - number of matching notes to skip.
+    - **max_count** - maximum number of matching lines to read per note.
+
+    Notes are ranked by their number of matching lines, then by id, and
+    `limit` and `offset` select a window of that ranking. Every matching note
+    is read to rank them, so use `max_count` to bound the work on large data dirs.
     """
 
     from archivy.data import get_data_dir
@@ -120,22 +263,26 @@ def query_ripgrep(query):
     if not which("rg"):
         return []
 
-    rg_cmd = ["rg", RG_MISC_ARGS, RG_FILETYPE, "--json", query, str(get_data_dir())]
-    rg = run(rg_cmd, stdout=PIPE, stderr=PIPE, timeout=60)
-    output = rg.stdout.decode().splitlines()
+    rg_cmd = ["rg", RG_MISC_ARGS, RG_FILETYPE, "--json"]
+    if max_count:
+        rg_cmd += ["--max-count", str(max_count)]
+    rg_cmd += [RG_REGEX_ARG, query, str(get_data_dir())]
+
     hits = []
-    for line in output:
-        parsed = parse_ripgrep_line(line)
-        if not parsed:
-            continue
-        if parsed[1] == "begin":
-            hits.append(parsed[0])
-        if parsed[1] == "match":
-            if not (parsed[0].startswith("tags: [") or parsed[0].startswith("title:")):
-                hits[-1]["matches"].append(parsed[0])
-    return sorted(
-        hits, key=lambda x: len(x["matches"]), reverse=True
-    )  # sort by number of matches
+    events = stream_ripgrep(rg_cmd)
+    try:
+        for data, event in events:
+            if event == "begin":
+                hits.append(data)
+            elif event == "match":
+                if not (data.startswith("tags: [") or data.startswith("title:")):
+                    hits[-1]["matches"].append(data)
+    finally:
+        events.close()
+    # sort by number of matches, and by id so that windows don't overlap
+    hits.sort(key=lambda hit: (-len(hit["matches"]), hit["id"]))
+    end = None if limit is None else offset + limit
+    return hits[offset:end]
 
 
 def search_frontmatter_tags(tag=None):
@@ -202,13 +349,23 @@ def query_ripgrep_tags():
     return hits
 
 
-def search(query, strict=False):
+def search(query, strict=False, limit=None, offset=0, max_count=None):
     """
     Wrapper to search methods for different engines.
 
-    If using ES, specify strict=True if you only want results that strictly match the query, without parsing / tokenization.
+    If using ES or the builtin engine, specify strict=True if you only want results that strictly match the query, without parsing / tokenization.
+
+    `limit` and `offset` can be used to only fetch a window of the results.
+    `limit` defaults to `SEARCH_CONF["default_limit"]` for every engine.
+    With ripgrep, `max_count` limits the number of matching lines read per note.
     """
+    if limit is None:
+        limit = current_app.config["SEARCH_CONF"]["default_limit"]
     if current_app.config["SEARCH_CONF"]["engine"] == "elasticsearch":
-        return query_es_index(query, strict=strict)
+        return query_es_index(query, strict=strict, limit=limit, offset=offset)
+    elif current_app.config["SEARCH_CONF"]["engine"] == "builtin":
+        return builtin_search.query_index(
+            query, strict=strict, limit=limit, offset=offset
+        )
     elif current_app.config["SEARCH_CONF"]["engine"] == "ripgrep" or which("rg"):
-        return query_ripgrep(query)
+        return query_ripgrep(query, limit=limit, offset=offset, max_count=max_count)
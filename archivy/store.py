@@ -0,0 +1,422 @@
+"""
+The internal store holds the data archivy itself needs to keep around
+besides your dataobjs: users, the max id, the tag index, the link graph...
+
+Stores implement the `Store` interface. Archivy uses the `SQLiteStore` by
+default, and you can pick another one with the `INTERNAL_STORE` config option.
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from tinydb import TinyDB, Query
+
+
+class Store:
+    """
+    Interface of the internal stores.
+
+    Values are JSON-serializable objects stored under string keys.
+    Users are dicts with `id`, `username`, `hashed_password` and `is_admin` keys.
+    """
+
+    # serializes the updates of the default index implementation
+    _index_lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value stored at `key`, or `default`."""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Stores `value` at `key`."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def add_user(self, username, hashed_password, is_admin=None):
+        """Creates a user and returns its id, or None if the username is taken."""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        """Returns the user of given id, or None."""
+        raise NotImplementedError
+
+    def find_user(self, username):
+        """Returns the user of given username, or None."""
+        raise NotImplementedError
+
+    def update_user(self, user_id, **fields):
+        raise NotImplementedError
+
+    def get_users(self):
+        raise NotImplementedError
+
+    # Indexes, like the tag index, map keys to the ids of the dataobjs they
+    # belong to. They are updated one dataobj at a time, so that indexing a
+    # dataobj doesn't cost as much as rewriting the whole index. This default
+    # implementation keeps each index in a single value.
+
+    def index_exists(self, name):
+        """Returns whether the index `name` has been built with `replace_index`."""
+        return self.get(f"index:{name}") is not None
+
+    def get_index(self, name):
+        """Returns the whole index as a dict of key -> ids, sorted."""
+        index = self.get(f"index:{name}") or {"entries": {}, "keys": []}
+        entries = {key: [] for key in index["keys"]}
+        entries.update(index["entries"])
+        return entries
+
+    def get_index_ids(self, name, key):
+        """Returns the sorted ids of the dataobjs `key` belongs to."""
+        return self.get_index(name).get(key, [])
+
+    def get_index_keys(self, name, dataobj_id):
+        """Returns the sorted keys of a dataobj."""
+        return sorted(
+            key for key, ids in self.get_index(name).items() if int(dataobj_id) in ids
+        )
+
+    def replace_index(self, name, index):
+        """
+        Replaces the whole index by `index`, a dict of key -> ids. Keys without
+        ids are kept until the index is replaced again.
+        """
+        with self._index_lock:
+            self.set(
+                f"index:{name}",
+                {
+                    "entries": {
+                        key: sorted(set(ids)) for key, ids in index.items() if ids
+                    },
+                    "keys": sorted(key for key, ids in index.items() if not ids),
+                },
+            )
+
+    def update_index(self, name, keys_by_id):
+        """
+        Replaces the keys of each dataobj id of `keys_by_id`, a dict of
+        id -> keys. Pass empty keys to remove a dataobj from the index.
+        """
+        with self._index_lock:
+            index = self.get(f"index:{name}") or {"entries": {}, "keys": []}
+            entries = index["entries"]
+            for dataobj_id, keys in keys_by_id.items():
+                dataobj_id = int(dataobj_id)
+                for key in list(entries):
+                    if key not in keys and dataobj_id in entries[key]:
+                        entries[key].remove(dataobj_id)
+                        if not entries[key]:
+                            del entries[key]
+                for key in keys:
+                    ids = entries.setdefault(key, [])
+                    if dataobj_id not in ids:
+                        ids.append(dataobj_id)
+                        ids.sort()
+            self.set(f"index:{name}", index)
+
+    def add_index_key(self, name, key):
+        """Adds a key without any dataobj to the index."""
+        with self._index_lock:
+            index = self.get(f"index:{name}") or {"entries": {}, "keys": []}
+            if key not in index["keys"]:
+                index["keys"].append(key)
+                self.set(f"index:{name}", index)
+
+    def remove_index_keys(self, name, keys):
+        """Removes the given keys and their dataobj ids from the index."""
+        with self._index_lock:
+            index = self.get(f"index:{name}") or {"entries": {}, "keys": []}
+            for key in keys:
+                index["entries"].pop(key, None)
+            index["keys"] = [key for key in index["keys"] if key not in keys]
+            self.set(f"index:{name}", index)
+
+    def close(self):
+        pass
+
+
+class SQLiteStore(Store):
+    """
+    Store backed by a SQLite database in WAL mode, so several archivy processes
+    can safely share it.
+    """
+
+    FILENAME = "archivy.sqlite3"
+    SCHEMA = """
+    PRAGMA journal_mode=WAL;
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        hashed_password TEXT NOT NULL,
+        is_admin INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS index_entries (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        dataobj_id INTEGER NOT NULL,
+        PRIMARY KEY (name, key, dataobj_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS index_entries_dataobj_id
+        ON index_entries (name, dataobj_id);
+    CREATE TABLE IF NOT EXISTS index_keys (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, internal_dir):
+        self.internal_dir = str(internal_dir)
+        self.conn = sqlite3.connect(
+            str(Path(internal_dir) / self.FILENAME), timeout=30, isolation_level=None
+        )
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(self.SCHEMA)
+        self.migrate_from_tinydb(Path(internal_dir) / "db.json")
+
+    def migrate_from_tinydb(self, db_path):
+        """
+        One-shot import of the users and values that older versions of archivy
+        stored in `db.json`. The file itself is left untouched for plugins.
+        """
+        if not db_path.exists() or self.get("tinydb_migrated"):
+            return
+        with TinyDB(str(db_path)) as db, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            # another process may have migrated meanwhile
+            if self.get("tinydb_migrated"):
+                return
+            for doc in db.all():
+                if doc.get("type") == "user":
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO users "
+                        "(id, username, hashed_password, is_admin) VALUES (?, ?, ?, ?)",
+                        (
+                            doc.doc_id,
+                            doc["username"],
+                            doc["hashed_password"],
+                            doc.get("is_admin"),
+                        ),
+                    )
+                elif doc.get("name") in ("max_id", "tag_list", "link_graph"):
+                    self.set(doc["name"], doc["val"])
+            self.set("tinydb_migrated", True)
+
+    def get(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)),
+        )
+
+    def delete(self, key):
+        self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    @contextmanager
+    def transaction(self):
+        """Runs the statements of the block in a transaction, locking out other writers."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def get_index(self, name):
+        index = {
+            row["key"]: []
+            for row in self.conn.execute(
+                "SELECT key FROM index_keys WHERE name = ?", (name,)
+            )
+        }
+        for row in self.conn.execute(
+            "SELECT key, dataobj_id FROM index_entries WHERE name = ? "
+            "ORDER BY key, dataobj_id",
+            (name,),
+        ):
+            index.setdefault(row["key"], []).append(row["dataobj_id"])
+        return index
+
+    def get_index_ids(self, name, key):
+        return [
+            row["dataobj_id"]
+            for row in self.conn.execute(
+                "SELECT dataobj_id FROM index_entries WHERE name = ? AND key = ? "
+                "ORDER BY dataobj_id",
+                (name, key),
+            )
+        ]
+
+    def get_index_keys(self, name, dataobj_id):
+        return [
+            row["key"]
+            for row in self.conn.execute(
+                "SELECT key FROM index_entries WHERE name = ? AND dataobj_id = ? "
+                "ORDER BY key",
+                (name, int(dataobj_id)),
+            )
+        ]
+
+    def replace_index(self, name, index):
+        with self.transaction():
+            self.conn.execute("DELETE FROM index_entries WHERE name = ?", (name,))
+            self.conn.execute("DELETE FROM index_keys WHERE name = ?", (name,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO index_entries (name, key, dataobj_id) "
+                "VALUES (?, ?, ?)",
+                [
+                    (name, key, int(dataobj_id))
+                    for key, ids in index.items()
+                    for dataobj_id in ids
+                ],
+            )
+            self.conn.executemany(
+                "INSERT INTO index_keys (name, key) VALUES (?, ?)",
+                [(name, key) for key, ids in index.items() if not ids],
+            )
+            self.set(f"index:{name}", True)
+
+    def update_index(self, name, keys_by_id):
+        with self.transaction():
+            for dataobj_id, keys in keys_by_id.items():
+                dataobj_id = int(dataobj_id)
+                old_keys = set(self.get_index_keys(name, dataobj_id))
+                keys = set(keys)
+                self.conn.executemany(
+                    "DELETE FROM index_entries "
+                    "WHERE name = ? AND key = ? AND dataobj_id = ?",
+                    [(name, key, dataobj_id) for key in old_keys - keys],
+                )
+                self.conn.executemany(
+                    "INSERT INTO index_entries (name, key, dataobj_id) VALUES (?, ?, ?)",
+                    [(name, key, dataobj_id) for key in keys - old_keys],
+                )
+
+    def add_index_key(self, name, key):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO index_keys (name, key) VALUES (?, ?)", (name, key)
+        )
+
+    def remove_index_keys(self, name, keys):
+        with self.transaction():
+            for table in ("index_entries", "index_keys"):
+                self.conn.executemany(
+                    f"DELETE FROM {table} WHERE name = ? AND key = ?",
+                    [(name, key) for key in keys],
+                )
+
+    def close(self):
+        self.conn.close()
+
+    def _user(self, row):
+        if not row:
+            return None
+        user = dict(row)
+        user["is_admin"] = None if user["is_admin"] is None else bool(user["is_admin"])
+        return user
+
+    def add_user(self, username, hashed_password, is_admin=None):
+        try:
+            cursor = self.conn.execute(
+                "INSERT INTO users (username, hashed_password, is_admin) VALUES (?, ?, ?)",
+                (username, hashed_password, is_admin),
+            )
+        except sqlite3.IntegrityError:
+            return None
+        return cursor.lastrowid
+
+    def get_user(self, user_id):
+        return self._user(
+            self.conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        )
+
+    def find_user(self, username):
+        return self._user(
+            self.conn.execute(
+                "SELECT * FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        )
+
+    def update_user(self, user_id, **fields):
+        for field, value in fields.items():
+            if field not in ("username", "hashed_password", "is_admin"):
+                raise ValueError(f"Unknown user field {field}")
+            self.conn.execute(
+                f"UPDATE users SET {field} = ? WHERE id = ?", (value, user_id)
+            )
+
+    def get_users(self):
+        rows = self.conn.execute("SELECT * FROM users ORDER BY id").fetchall()
+        return [self._user(row) for row in rows]
+
+
+class TinyDBStore(Store):
+    """Store keeping everything in the `db.json` TinyDB database, like older versions of archivy."""
+
+    def __init__(self, internal_dir):
+        self.internal_dir = str(internal_dir)
+        self.db = TinyDB(str(Path(internal_dir) / "db.json"))
+
+    def close(self):
+        self.db.close()
+
+    def get(self, key, default=None):
+        res = self.db.search(Query().name == key)
+        return res[0]["val"] if res else default
+
+    def set(self, key, value):
+        self.db.upsert({"name": key, "val": value}, Query().name == key)
+
+    def delete(self, key):
+        self.db.remove(Query().name == key)
+
+    def _user(self, doc):
+        if not doc or doc.get("type") != "user":
+            return None
+        return {
+            "id": doc.doc_id,
+            "username": doc["username"],
+            "hashed_password": doc["hashed_password"],
+            "is_admin": doc.get("is_admin"),
+        }
+
+    def add_user(self, username, hashed_password, is_admin=None):
+        if self.find_user(username):
+            return None
+        return self.db.insert(
+            {
+                "username": username,
+                "hashed_password": hashed_password,
+                "is_admin": is_admin,
+                "type": "user",
+            }
+        )
+
+    def get_user(self, user_id):
+        return self._user(self.db.get(doc_id=user_id))
+
+    def find_user(self, username):
+        res = self.db.search((Query().type == "user") & (Query().username == username))
+        return self._user(res[0]) if res else None
+
+    def update_user(self, user_id, **fields):
+        self.db.update(fields, doc_ids=[user_id])
+
+    def get_users(self):
+        return [self._user(doc) for doc in self.db.search(Query().type == "user")]
+
+
+STORES = {"sqlite": SQLiteStore, "tinydb": TinyDBStore}
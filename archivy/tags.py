@@ -2,37 +2,98 @@ import re
 
 from flask import current_app
 from archivy import helpers, data
-from tinydb import Query, operations
-from archivy.search import query_ripgrep_tags
+
+EMBEDDED_TAG_PATTERN = re.compile(r"(?:^|\n| )#([-_a-zA-ZÀ-ÖØ-öø-ÿ0-9]+)#")
 
 
 def is_tag_format(tag_name):
     return re.match("^[a-zA-Z0-9_-]+$", tag_name)
 
 
+def get_embedded_tags(content):
+    """Returns the set of `#tag#` style tags embedded in `content`."""
+    return set(EMBEDDED_TAG_PATTERN.findall(content))
+
+
+def get_dataobj_tags(dataobj):
+    """Returns both the frontmatter and the embedded tags of a dataobj."""
+    return set(dataobj.tags or []) | get_embedded_tags(dataobj.content or "")
+
+
+def build_tag_index():
+    """Builds the tag -> dataobj ids index by reading every dataobj."""
+    tag_index = {}
+    for dataobj in data.get_items(structured=False, load_content=True):
+        if "id" not in dataobj:
+            continue  # not formatted by archivy yet
+        tags = set(dataobj.get("tags") or []) | get_embedded_tags(dataobj.content)
+        for tag in tags:
+            tag_index.setdefault(tag, []).append(dataobj["id"])
+    return tag_index
+
+
+TAG_INDEX = "tags"
+
+
+def get_tag_index(force=False):
+    """
+    Returns the persisted index mapping each tag to the ids of the dataobjs using it.
+
+    The index is kept in the internal store and kept up to date as dataobjs are
+    created, edited and deleted. Use `force=True` to rebuild it from the files,
+    for example if they were edited outside of archivy.
+    """
+    store = helpers.get_store()
+    if store.index_exists(TAG_INDEX) and not force:
+        return store.get_index(TAG_INDEX)
+
+    tag_index = build_tag_index()
+    # keep tags that were added without being used yet, including the ones
+    # older versions stored as a plain list
+    unused = []
+    if store.index_exists(TAG_INDEX):
+        unused = [tag for tag, ids in store.get_index(TAG_INDEX).items() if not ids]
+    for tag in unused + list(store.get("tag_list") or []):
+        tag_index.setdefault(tag, [])
+    store.replace_index(TAG_INDEX, tag_index)
+    store.delete("tag_list")
+    return tag_index
+
+
+def _get_store():
+    """Returns the internal store, after building the tag index if needed."""
+    store = helpers.get_store()
+    if not store.index_exists(TAG_INDEX):
+        get_tag_index()
+    return store
+
+
 def get_all_tags(force=False):
-    db = helpers.get_db()
-    list_query = db.search(Query().name == "tag_list")
+    return list(get_tag_index(force=force))
+
 
-    # If the "tag_list" doesn't exist in the database: create it.
-    newly_created = list_query == []
-    if newly_created:
-        db.insert({"name": "tag_list", "val": []})
+def get_tag_counts():
+    """Returns a dict of each tag and the number of dataobjs using it."""
+    return {tag: len(ids) for tag, ids in get_tag_index().items()}
 
-    # Then update it if needed
-    tags = []
-    if newly_created or force:
-        tags = list(query_ripgrep_tags())
-        db.update(operations.set("val", tags), Query().name == "tag_list")
-    else:
-        tags = list_query[0]["val"]
-    return tags
+
+def get_tagged_ids(tag_name):
+    """Returns the ids of the dataobjs that use the given tag."""
+    return _get_store().get_index_ids(TAG_INDEX, tag_name)
 
 
 def add_tag_to_index(tag_name):
-    all_tags = get_all_tags()
-    if tag_name not in all_tags:
-        all_tags.append(tag_name)
-        db = helpers.get_db()
-        db.update(operations.set("val", all_tags), Query().name == "tag_list")
+    _get_store().add_index_key(TAG_INDEX, tag_name)
     return True
+
+
+def index_dataobj_tags(*dataobjs):
+    """Updates the tag index with the current tags of the given dataobjs."""
+    _get_store().update_index(
+        TAG_INDEX, {dataobj.id: get_dataobj_tags(dataobj) for dataobj in dataobjs}
+    )
+
+
+def remove_from_tag_index(*dataobj_ids):
+    """Removes the dataobjs of the given ids from the tag index."""
+    _get_store().update_index(TAG_INDEX, {dataobj_id: () for dataobj_id in dataobj_ids})
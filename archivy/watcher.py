@@ -0,0 +1,169 @@
+"""
+Keeps archivy's indexes in sync with the changes other programs make to the
+data dir, like your editor or a sync tool.
+
+The watcher needs the optional [watchdog](https://pypi.org/project/watchdog/)
+package, and is started by `archivy run` if `WATCHER_CONF["enabled"]` is set.
+Bursts of changes, eg. from a `git pull`, are collected until the data dir
+has been quiet for `WATCHER_CONF["debounce"]` seconds, and then only the
+changed files are indexed again.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+from flask import current_app
+
+from archivy import data
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# internal dir -> watchdog observer
+_observers = {}
+_observers_lock = threading.Lock()
+
+
+class ChangeQueue:
+    """Collects changed paths until no new change happens for `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._paths = set()
+        self._last_change = None
+        self._cond = threading.Condition()
+
+    def add(self, *paths):
+        with self._cond:
+            self._paths.update(str(path) for path in paths)
+            self._last_change = time.monotonic()
+            self._cond.notify()
+
+    def wait_for_changes(self):
+        """Blocks until changes have settled, and returns the changed paths."""
+        with self._cond:
+            while True:
+                if not self._paths:
+                    self._cond.wait()
+                    continue
+                quiet = time.monotonic() - self._last_change
+                if quiet >= self.delay:
+                    paths, self._paths = self._paths, set()
+                    return paths
+                self._cond.wait(self.delay - quiet)
+
+
+class DataDirEventHandler(FileSystemEventHandler):
+    """Passes the markdown files of watchdog events on to a `ChangeQueue`."""
+
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+
+    def on_any_event(self, event):
+        paths = [event.src_path, getattr(event, "dest_path", None)]
+        for path in filter(None, paths):
+            path = Path(path)
+            if event.is_directory:
+                # directories moved in from outside the data dir only get one event
+                if event.event_type in ("created", "moved") and path.is_dir():
+                    self.queue.add(*(entry.path for entry in data.walk(path, "*.md")))
+            elif path.suffix == ".md":
+                self.queue.add(path)
+
+
+def sync_files(paths):
+    """
+    Updates the indexes of archivy with the current state of the given
+    markdown files, after they have been modified, created or deleted outside
+    of archivy.
+
+    Returns the number of dataobjs that were updated or removed.
+    """
+    from archivy.models import DataObj
+
+    # event paths are resolved too, as watchdog reports them under the path
+    # the observer was scheduled on, which may go through symlinks
+    data_dir = data.get_data_dir().resolve()
+    user_dir = Path(current_app.config["USER_DIR"]).resolve()
+    hooks = current_app.config["HOOKS"]
+    deleted = []
+    updated = 0
+    for path in sorted(Path(os.path.realpath(path)) for path in paths):
+        if not data.is_relative_to(path, data_dir):
+            continue
+        if not path.is_file():
+            deleted.append(path)
+            continue
+        if data.is_own_write(path):
+            continue
+        try:
+            dataobj = DataObj.from_md(path.read_text(encoding="utf-8"))
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            current_app.logger.warning(f"Could not read {path}: {e}")
+            continue
+        if dataobj.id is None:
+            continue  # not formatted by archivy, or being written
+        dataobj.fullpath = str(path.relative_to(user_dir))
+        data.index_dataobj_path(dataobj.id, path)
+        dataobj.index()
+        hooks.on_edit(dataobj)
+        updated += 1
+
+    deleted_ids = set()
+    for path in deleted:
+        dataobj_id = path.name.split("-", 1)[0]
+        # files that were moved are still indexed at their new path
+        if dataobj_id.isdigit() and not data.get_by_id(dataobj_id, rebuild=False):
+            deleted_ids.add(int(dataobj_id))
+    if deleted_ids:
+        data.forget_dataobjs(*deleted_ids)
+    if updated or deleted_ids:
+        data.invalidate_catalog()
+    return updated + len(deleted_ids)
+
+
+def _sync_changes(app, queue):
+    with app.app_context():
+        while True:
+            paths = queue.wait_for_changes()
+            try:
+                count = sync_files(paths)
+                if count:
+                    app.logger.info(f"Synced {count} dataobjs changed outside archivy")
+            except Exception as e:
+                app.logger.error(f"Watcher error: {e}")
+
+
+def start_watcher():
+    """
+    Starts watching the data dir for changes, if it isn't watched yet.
+
+    Returns False if watchdog isn't installed.
+    """
+    if Observer is None:
+        current_app.logger.warning(
+            "Install watchdog to keep archivy in sync with external edits: "
+            "pip install watchdog"
+        )
+        return False
+    app = current_app._get_current_object()
+    with _observers_lock:
+        if app.config["INTERNAL_DIR"] in _observers:
+            return True
+        queue = ChangeQueue(app.config["WATCHER_CONF"]["debounce"])
+        threading.Thread(target=_sync_changes, args=(app, queue), daemon=True).start()
+        observer = Observer()
+        observer.daemon = True
+        observer.schedule(
+            DataDirEventHandler(queue), str(data.get_data_dir()), recursive=True
+        )
+        observer.start()
+        _observers[app.config["INTERNAL_DIR"]] = observer
+    return True
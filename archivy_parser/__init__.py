@@ -0,0 +1,173 @@
+"""
+Conversion of the pages archivy bookmarks from HTML to markdown.
+
+This code runs in the worker processes of `archivy.parsing`, so it lives
+outside of the `archivy` package: importing it doesn't create the archivy app,
+load the config or connect to the search engine, and workers start quickly.
+It must not import anything from `archivy`.
+"""
+
+import math
+import re
+import signal
+from contextlib import contextmanager
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from html2text import html2text
+from html2text.utils import escape_md
+from readability import Document
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ["jpg", "png", "gif", "jpeg"]
+
+# the `src` of images that are saved locally is replaced by this placeholder
+# until they are downloaded. The `-end` suffix keeps `archivy-image-1` from
+# matching the start of `archivy-image-10`.
+IMAGE_PLACEHOLDER = "archivy-image-{}-end"
+IMAGE_PLACEHOLDER_RE = re.compile(r"archivy-image-\d+-end")
+
+
+class ParseError(Exception):
+    """Raised when a page can't be converted."""
+
+
+class CPULimitExceeded(ParseError):
+    """Raised in a worker when a page takes more CPU time than allowed."""
+
+
+def valid_image_filename(filename):
+    return "." in filename and filename.rsplit(".", 1)[1] in IMAGE_EXTENSIONS
+
+
+def extract_content(soup, url, selector=None, save_images=False):
+    """
+    Converts the html of a bookmark to markdown.
+
+    - **soup** - parsed html of the page.
+    - **url** - url of the page, used to make relative links absolute.
+    - **selector** - optional css selector of the part of the page to keep.
+    - **save_images** - whether to replace the `src` of the images to save by placeholders.
+
+    Returns the markdown and a list of `(url, filename)` pairs for each image
+    to save, in the order they appear in the page.
+    """
+    url = url.rstrip("/")
+    if selector:
+        selected_soup = soup.select(selector)
+        # if the custom selector matched, take the first occurrence
+        if selected_soup:
+            soup = selected_soup[0]
+
+    images = []
+    placeholders = {}
+    for tag in soup.find_all(["a", "img"]):
+        if tag.name == "a":
+            if tag.has_attr("href") and (tag["href"].startswith("/")):
+                tag["href"] = urljoin(url, tag["href"])
+
+            # check it's a normal link and not some sort of image
+            # string returns the text content of the tag
+            if not tag.string:
+                # delete tag
+                tag.decompose()
+
+        elif tag.name == "img" and tag.has_attr("src"):
+            filename = tag["src"].split("/")[-1]
+            try:
+                filename = filename[: filename.index("?")]  # remove query parameters
+            except ValueError:
+                pass
+            if not tag["src"].startswith("http"):
+                tag["src"] = urljoin(url, tag["src"])
+            if save_images and valid_image_filename(filename):
+                images.append((tag["src"], filename))
+                placeholders.setdefault(
+                    tag["src"], IMAGE_PLACEHOLDER.format(len(placeholders))
+                )
+                tag["src"] = placeholders[tag["src"]]
+
+    return html2text(str(soup), bodywidth=0), images
+
+
+def fill_image_placeholders(content, images, saved):
+    """
+    Replaces the placeholders `extract_content` left in `content` by the
+    local path of the saved images, or their original url.
+
+    - **images** - list of `(url, filename)` pairs returned by `extract_content`.
+    - **saved** - dict of image url -> local path.
+    """
+    placeholders = {}
+    for url, _ in images:
+        placeholders.setdefault(url, IMAGE_PLACEHOLDER.format(len(placeholders)))
+    paths = {
+        placeholder: escape_md(saved.get(url, url))
+        for url, placeholder in placeholders.items()
+    }
+    return IMAGE_PLACEHOLDER_RE.sub(
+        lambda match: paths.get(match.group(0), match.group(0)), content
+    )
+
+
+def html_to_markdown(html, url, selector=None, parser="html.parser", save_images=False):
+    """
+    Extracts the title and content of a page.
+
+    - **parser** - name of the `BeautifulSoup` parser to use, eg. `"lxml"`.
+
+    Returns a dict with the `title`, the markdown `content` and the `images`
+    to save, as returned by `extract_content`. `content` is None if the page
+    could be parsed, but its content couldn't be extracted.
+    """
+    document = Document(html)
+    title = document.short_title() or url
+    soup = BeautifulSoup(document.summary(), features=parser)
+    try:
+        content, images = extract_content(soup, url, selector, save_images)
+    except Exception:
+        content, images = None, []
+    return {"title": title, "content": content, "images": images}
+
+
+def _raise_cpu_limit_exceeded(signum, frame):
+    raise CPULimitExceeded("Page took too much CPU time to convert")
+
+
+def init_worker():
+    """Sets up a worker process of the pool."""
+    # leave the requests to the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if resource:
+        signal.signal(signal.SIGXCPU, _raise_cpu_limit_exceeded)
+
+
+@contextmanager
+def cpu_limit(seconds):
+    """
+    Sends `SIGXCPU` to the current process once it has used `seconds` more
+    seconds of CPU time. Only meant to be used in the worker processes.
+    """
+    if not resource or not seconds:
+        yield
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def run_limited(seconds, func, *args):
+    """Runs `func(*args)` with a limit of `seconds` of CPU time."""
+    with cpu_limit(seconds):
+        return func(*args)
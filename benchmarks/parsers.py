@@ -0,0 +1,67 @@
+"""
+Compares the speed of the parsers archivy can use to convert bookmarked pages
+to markdown (`SCRAPING_CONF["parser"]`).
+
+Run it on a directory of saved `.html` pages:
+
+    python benchmarks/parsers.py path/to/pages [--repeat 3]
+
+Parsers that aren't installed are skipped.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+from archivy.parsing import html_to_markdown
+
+PARSERS = ["html.parser", "lxml", "html5lib"]
+
+
+def available(parser):
+    try:
+        BeautifulSoup("", features=parser)
+        return True
+    except FeatureNotFound:
+        return False
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("pages", type=Path, help="directory of saved .html pages")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    pages = [
+        (path.name, path.read_text(errors="replace"))
+        for path in sorted(args.pages.glob("**/*.html"))
+    ]
+    if not pages:
+        arg_parser.error(f"no .html pages found in {args.pages}")
+    print(f"{len(pages)} pages, {sum(len(html) for _, html in pages)} bytes")
+
+    for parser in PARSERS:
+        if not available(parser):
+            print(f"{parser:>12}: not installed")
+            continue
+        timings = []
+        for name, html in pages:
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                html_to_markdown(html, f"https://example.com/{name}", parser=parser)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        timings.sort()
+        print(
+            f"{parser:>12}: total {sum(timings):.3f}s, "
+            f"median {timings[len(timings) // 2] * 1000:.1f}ms, "
+            f"max {timings[-1] * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares looking up the `scraping.py` handler of bookmarked urls by trying
+every pattern with `fnmatch`, like older versions of archivy, with the
+compiled `ScrapingPatterns`.
+
+    python benchmarks/scraping_patterns.py [--patterns 1000] [--urls 10000]
+"""
+
+import argparse
+import fnmatch
+import random
+import time
+
+from archivy.helpers import ScrapingPatterns
+
+
+def make_patterns(count):
+    patterns = {}
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            patterns[f"https://site{i}.com/*"] = f"#content-{i}"
+        elif kind == 1:
+            patterns[f"https://www.site{i}.org/articles/*"] = f"#article-{i}"
+        elif kind == 2:
+            patterns[f"*.site{i}.net/*"] = f"#main-{i}"
+        else:
+            patterns[f"https://*.site{i}.io/posts/*"] = f".post-{i}"
+    return patterns
+
+
+def make_urls(count, patterns_count):
+    urls = []
+    for _ in range(count):
+        i = random.randrange(patterns_count * 2)  # half the urls match nothing
+        urls.append(
+            random.choice(
+                [
+                    f"https://site{i}.com/page",
+                    f"https://www.site{i}.org/articles/title",
+                    f"https://blog.site{i}.net/entry",
+                    f"https://docs.site{i}.io/posts/1",
+                ]
+            )
+        )
+    return urls
+
+
+def fnmatch_loop(patterns, url):
+    for pattern, handler in patterns.items():
+        if fnmatch.fnmatch(url, pattern):
+            return handler
+    return None
+
+
+def timed(func, urls):
+    start = time.perf_counter()
+    results = [func(url) for url in urls]
+    return time.perf_counter() - start, results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--patterns", type=int, default=1000)
+    arg_parser.add_argument("--urls", type=int, default=10000)
+    args = arg_parser.parse_args()
+
+    random.seed(0)
+    patterns = make_patterns(args.patterns)
+    urls = make_urls(args.urls, args.patterns)
+
+    start = time.perf_counter()
+    compiled = ScrapingPatterns(patterns)
+    compile_time = time.perf_counter() - start
+
+    loop_time, expected = timed(lambda url: fnmatch_loop(patterns, url), urls)
+    compiled_time, results = timed(compiled.match, urls)
+    assert results == expected, "compiled patterns don't match like fnmatch"
+
+    print(f"{args.patterns} patterns, {args.urls} urls")
+    print(f"fnmatch loop: {loop_time * 1e6 / len(urls):8.1f}us / url")
+    print(
+        f"    compiled: {compiled_time * 1e6 / len(urls):8.1f}us / url "
+        f"(compiled in {compile_time * 1000:.1f}ms)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Compares the `pathlib` traversals archivy used to list the data dir with
+`archivy.data.walk`, on a synthetic tree of markdown files.
+
+    python benchmarks/walk.py [--files 100000] [--dir path/to/tree]
+
+The tree is created in a temporary directory unless `--dir` is given. For each
+traversal, the wall time and the number of `stat`, `lstat` and `scandir` calls
+made through the `os` module are reported. Calls made by `os.DirEntry` itself
+can't be counted this way, but they only happen on file systems that don't
+report file types in directory listings. When `strace` is installed, each
+traversal is also run under `strace -c` to count the actual system calls.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from archivy.data import FILE_GLOB, walk
+
+FILES_PER_DIR = 100
+SYSCALLS = "stat,lstat,newfstatat,statx,fstat,openat,getdents64"
+
+
+def build_tree(root, count):
+    """Creates `count` dataobj files, `FILES_PER_DIR` per dir, two levels deep."""
+    for i in range(count):
+        dirname = root / f"dir{i // FILES_PER_DIR // 10}" / f"sub{i // FILES_PER_DIR}"
+        if i % FILES_PER_DIR == 0:
+            dirname.mkdir(parents=True, exist_ok=True)
+        (dirname / f"{i + 1}-note-{i}.md").write_text("---\ntitle: note\n---\n")
+
+
+# the traversals of `archivy.data` before `walk`
+def rglob_traversals(root):
+    ids = {
+        path.name.split("-", 1)[0]: path.relative_to(root)
+        for path in root.rglob(FILE_GLOB)
+    }
+    dirs = [str(path.relative_to(root)) for path in root.rglob("*") if path.is_dir()]
+    md_files = {
+        path.relative_to(root).as_posix(): path.stat().st_mtime_ns
+        for path in root.rglob("*.md")
+    }
+    return len(ids), len(dirs), len(md_files)
+
+
+def walk_traversals(root):
+    ids = {
+        entry.relpath.rsplit("/", 1)[-1].split("-", 1)[0]: entry.relpath
+        for entry in walk(root, FILE_GLOB)
+    }
+    dirs = [entry.relpath for entry in walk(root, files=False, dirs=True)]
+    md_files = {
+        entry.relpath: entry.mtime_ns for entry in walk(root, "*.md", stat=True)
+    }
+    return len(ids), len(dirs), len(md_files)
+
+
+TRAVERSALS = {"rglob": rglob_traversals, "walk": walk_traversals}
+
+
+def count_os_calls(func, root):
+    counts = dict.fromkeys(["stat", "lstat", "scandir"], 0)
+    originals = {name: getattr(os, name) for name in counts}
+
+    def counting(name):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return originals[name](*args, **kwargs)
+
+        return wrapper
+
+    for name in counts:
+        setattr(os, name, counting(name))
+    try:
+        start = time.perf_counter()
+        result = func(root)
+        elapsed = time.perf_counter() - start
+    finally:
+        for name, original in originals.items():
+            setattr(os, name, original)
+    return result, elapsed, counts
+
+
+def strace_total(name, root):
+    """Runs a traversal under `strace -c` and returns its number of file system calls."""
+    with tempfile.NamedTemporaryFile("r") as output:
+        subprocess.run(
+            ["strace", "-c", "-f", "-e", f"trace={SYSCALLS}", "-o", output.name]
+            + [sys.executable, __file__, "--run", name, "--dir", str(root)],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        lines = output.read().splitlines()
+    total = next(line for line in lines if line.strip().endswith("total"))
+    return int(total.split()[2])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--files", type=int, default=100_000)
+    arg_parser.add_argument("--dir", type=Path, help="existing tree to traverse")
+    arg_parser.add_argument("--run", choices=TRAVERSALS, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run:
+        TRAVERSALS[args.run](args.dir)
+        return
+
+    root = args.dir
+    if root is None:
+        root = Path(tempfile.mkdtemp())
+        print(f"Creating {args.files} files in {root}...")
+        build_tree(root, args.files)
+    try:
+        # warm up the dentry and inode caches
+        walk_traversals(root)
+        for name, func in TRAVERSALS.items():
+            result, elapsed, counts = count_os_calls(func, root)
+            calls = ", ".join(f"{count} {call}" for call, count in counts.items())
+            print(f"{name:>6}: {elapsed:.2f}s, {calls}")
+            if shutil.which("strace"):
+                print(f"{'':>6}  {strace_total(name, root)} syscalls ({SYSCALLS})")
+        assert TRAVERSALS["rglob"](root) == TRAVERSALS["walk"](root)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import shutil
 import tempfile
 from pathlib import Path
@@ -5,8 +6,9 @@ from pathlib import Path
 import click
 import pytest
 import responses
+from elasticsearch.serializer import JSONSerializer
 
-from archivy import app, cli
+from archivy import app, cli, helpers
 from archivy.click_web import create_click_web_app, _flask_app
 from archivy.helpers import get_db, load_hooks
 from archivy.models import DataObj, User
@@ -34,8 +36,8 @@ def test_app():
     _app.config["TESTING"] = True
     _app.config["WTF_CSRF_ENABLED"] = False
     _app.config["SCRAPING_CONF"]["save_images"] = False
-    # This setups a TinyDB instance, using the `app_dir` temporary
-    # directory defined above
+    # This setups the internal store and a TinyDB instance, using the
+    # `app_dir` temporary directory defined above
     # Required so that `flask.current_app` can be called in data.py and
     # models.py
     # See https://flask.palletsprojects.com/en/1.1.x/appcontext/ for more
@@ -221,3 +223,80 @@ def ctx(click_cli):
 @pytest.fixture()
 def cli_runner():
     yield click.testing.CliRunner()
+
+
+class FakeElasticsearch:
+    """Stand-in for the elasticsearch client that records the requests it gets."""
+
+    instances = []
+
+    def __init__(self, url, **options):
+        self.options = options
+        self.calls = []
+        self.documents = {}
+        # ids of the documents that bulk requests fail to index
+        self.rejected = set()
+        self.settings = {}
+        self.cluster = self
+        self.indices = self
+        self.transport = self
+        self.serializer = JSONSerializer()
+        FakeElasticsearch.instances.append(self)
+
+    def health(self):
+        self.calls.append("health")
+        return {"status": "green"}
+
+    def index(self, index, id, body):
+        self.calls.append("index")
+        self.documents[str(id)] = body
+
+    def delete(self, index, id):
+        self.calls.append("delete")
+        self.documents.pop(str(id), None)
+
+    def bulk(self, body, **kwargs):
+        self.calls.append("bulk")
+        lines = [json.loads(line) for line in body.strip().split("\n")]
+        items = []
+        while lines:
+            action = lines.pop(0)
+            op_type, meta = next(iter(action.items()))
+            doc_id = str(meta["_id"])
+            if op_type == "delete":
+                self.documents.pop(doc_id, None)
+            elif doc_id in self.rejected:
+                lines.pop(0)
+                items.append(
+                    {op_type: {"_id": doc_id, "status": 400, "error": "rejected"}}
+                )
+                continue
+            else:
+                self.documents[doc_id] = lines.pop(0)
+            items.append({op_type: {"_id": doc_id, "status": 200}})
+        errors = any("error" in next(iter(item.values())) for item in items)
+        return {"errors": errors, "items": items}
+
+    def get_settings(self, index, name):
+        return {index: {"settings": self.settings}} if self.settings else {}
+
+    def put_settings(self, index, body):
+        self.calls.append(("put_settings", body))
+
+    def refresh(self, index):
+        self.calls.append("refresh")
+
+
+@pytest.fixture
+def fake_elasticsearch(test_app, monkeypatch):
+    """
+    Enables the elasticsearch engine, with the client replaced by a
+    `FakeElasticsearch`. Created clients are stored in `FakeElasticsearch.instances`.
+    """
+    monkeypatch.setattr(helpers, "Elasticsearch", FakeElasticsearch)
+    monkeypatch.setattr(FakeElasticsearch, "instances", [])
+    monkeypatch.setattr(helpers, "_es_clients", {})
+    monkeypatch.setattr(helpers, "_es_health_checks", {})
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "enabled", 1)
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "engine", "elasticsearch")
+    yield FakeElasticsearch
@@ -58,6 +58,17 @@ def test_get_dataobj(test_app, client: FlaskClient, note_fixture):
     assert response.status_code == 200
 
 
+def test_get_raw_dataobj_conditionally(test_app, client: FlaskClient, note_fixture):
+    response = client.get("/dataobj/1?raw=1")
+    assert response.status_code == 200
+    assert b"title: Test Note" in response.data
+
+    etag = response.headers["ETag"]
+    response = client.get("/dataobj/1?raw=1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert client.get("/dataobj/2?raw=1").status_code == 302
+
+
 def test_get_delete_dataobj_not_found(test_app, client: FlaskClient):
     response = client.post("/dataobj/delete/1")
     assert response.status_code == 302
@@ -388,6 +399,13 @@ def test_getting_all_tags(test_app, client, bookmark_fixture):
         assert f"#{tag}" in str(resp.data)
 
 
+def test_getting_all_tags_shows_unused_ones(test_app, client, bookmark_fixture):
+    client.put("/api/tags/add_to_index", json={"tag": "unused"})
+    resp = client.get("/tags")
+    assert "#unused (0)" in resp.get_data(as_text=True)
+    assert "#tag2 (1)" in resp.get_data(as_text=True)
+
+
 def test_getting_matches_for_specific_tag(test_app, client, bookmark_fixture):
     resp = client.get("/tags/tag2")
     assert resp.status_code == 200
@@ -1,13 +1,14 @@
 from base64 import b64encode
+import json
 from os import remove
 
 import responses
 from flask import Flask
 from flask.testing import FlaskClient
-from tinydb import Query
 from archivy.data import create_dir, get_items, create_dir, get_item
+from archivy import jobs
 from archivy.models import DataObj
-from archivy.helpers import get_db
+from archivy.tags import get_all_tags, get_tagged_ids
 
 
 def test_bookmark_not_found(test_app, client: FlaskClient):
@@ -23,6 +24,41 @@ def test_get_dataobj(test_app, client: FlaskClient, bookmark_fixture):
     assert response.json["content"].startswith("Lorem ipsum")
 
 
+def test_get_dataobj_conditionally(test_app, client: FlaskClient, note_fixture):
+    response = client.get("/api/dataobjs/1")
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    response = client.get("/api/dataobjs/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    response = client.get(
+        "/api/dataobjs/1", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+    # the ETag changes when the dataobj is updated
+    response = client.put(
+        "/api/dataobjs/1", json={"content": "Updated"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    response = client.get("/api/dataobjs/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["content"] == "Updated"
+
+    # updates based on an outdated version are rejected
+    response = client.put(
+        "/api/dataobjs/1", json={"content": "Conflict"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    response = client.put(
+        "/api/dataobjs/frontmatter/1", json={"title": "New"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    assert client.get("/api/dataobjs/1").json["content"] == "Updated"
+
+
 def test_create_bookmark(test_app, client: FlaskClient, mocked_responses):
     mocked_responses.add(responses.GET, "http://example.org", body="Example\n")
     response: Flask.response_class = client.post(
@@ -42,6 +78,72 @@ def test_create_bookmark(test_app, client: FlaskClient, mocked_responses):
     assert response.json["content"] == "Example"
 
 
+def test_create_duplicate_bookmark(
+    test_app, client: FlaskClient, mocked_responses, monkeypatch
+):
+    mocked_responses.add(responses.GET, "http://example.org/page", body="Example\n")
+    first = client.post(
+        "/api/bookmarks", json={"url": "http://example.org/page", "path": ""}
+    )
+    second = client.post(
+        "/api/bookmarks",
+        json={"url": "https://EXAMPLE.org/page/?utm_source=feed", "path": ""},
+    )
+    assert second.json["bookmark_id"] == first.json["bookmark_id"]
+    # the page wasn't downloaded again
+    assert len(mocked_responses.calls) == 1
+
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "duplicates", "refresh")
+    mocked_responses.replace(responses.GET, "http://example.org/page", body="Updated\n")
+    third = client.post(
+        "/api/bookmarks", json={"url": "http://example.org/page", "path": ""}
+    )
+    assert third.json["bookmark_id"] == first.json["bookmark_id"]
+    dataobj = client.get(f"/api/dataobjs/{first.json['bookmark_id']}").json
+    assert dataobj["content"] == "Updated"
+
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "duplicates", "create")
+    fourth = client.post(
+        "/api/bookmarks", json={"url": "http://example.org/page", "path": ""}
+    )
+    assert fourth.json["bookmark_id"] != first.json["bookmark_id"]
+
+    client.delete(f"/api/dataobjs/{first.json['bookmark_id']}")
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "duplicates", "existing")
+    fifth = client.post(
+        "/api/bookmarks", json={"url": "http://example.org/page/", "path": ""}
+    )
+    assert fifth.json["bookmark_id"] == fourth.json["bookmark_id"]
+
+
+def test_create_bookmark_in_background(
+    test_app, client: FlaskClient, mocked_responses, monkeypatch
+):
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "enabled", True)
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "workers", 0)
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "retry_delay", 0)
+    mocked_responses.add(responses.GET, "http://example.org", body="Example\n")
+
+    resp = client.post("/api/bookmarks", json={"url": "http://example.org", "path": ""})
+    assert resp.status_code == 202
+    job_url = resp.headers["Location"]
+    assert client.get(job_url).json["status"] == "queued"
+
+    # unreachable url
+    failing_job = client.post(
+        "/api/bookmarks", json={"url": "http://example.com", "path": ""}
+    ).json["job_id"]
+
+    jobs.run_pending()
+    job = client.get(job_url).json
+    assert job["status"] == "done"
+    assert get_item(job["result"]["dataobj_id"]).content == "Example"
+    job = client.get(f"/api/jobs/{failing_job}").json
+    assert job["status"] == "failed"
+    assert job["attempts"] == test_app.config["JOBS_CONF"]["max_attempts"]
+    assert client.get("/api/jobs/1000").status_code == 404
+
+
 def test_creating_bookmark_without_passing_path_saves_to_default_dir(
     test_app, client, mocked_responses
 ):
@@ -120,6 +222,49 @@ def test_get_dataobjs(test_app, client: FlaskClient, bookmark_fixture):
     assert bookmark["metadata"]["id"] == 1
 
 
+def test_get_dataobjs_paginated(test_app, client: FlaskClient):
+    create_dir("t")
+    for i in range(5):
+        DataObj(
+            type="bookmark" if i % 2 else "note",
+            title=f"Note {i}",
+            content=f"Content {i}",
+            tags=["odd"] if i % 2 else [],
+            path="t" if i >= 3 else "",
+        ).insert()
+
+    resp = client.get("/api/dataobjs?fields=id,title&limit=2")
+    assert resp.json == [{"id": 1, "title": "Note 0"}, {"id": 2, "title": "Note 1"}]
+    pages = [resp.json]
+    while "X-Next-Cursor" in resp.headers:
+        resp = client.get(
+            f"/api/dataobjs?fields=id&limit=2&cursor={resp.headers['X-Next-Cursor']}"
+        )
+        pages.append(resp.json)
+    assert pages[1:] == [[{"id": 3}, {"id": 4}], [{"id": 5}]]
+
+    resp = client.get("/api/dataobjs?path=t&fields=id,fullpath,content")
+    assert resp.json == [
+        {"id": 4, "fullpath": ".", "content": "Content 3"},
+        {"id": 5, "fullpath": ".", "content": "Content 4"},
+    ]
+    resp = client.get("/api/dataobjs?type=bookmark&tag=odd&fields=id")
+    assert sorted(dataobj["id"] for dataobj in resp.json) == [2, 4]
+
+    resp = client.get("/api/dataobjs?format=ndjson&fields=id&limit=3")
+    assert resp.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in resp.data.splitlines()] == [
+        {"id": 1},
+        {"id": 2},
+        {"id": 3},
+    ]
+    assert "X-Next-Cursor" in resp.headers
+
+    assert client.get("/api/dataobjs?limit=0").status_code == 400
+    assert client.get("/api/dataobjs?cursor=%FF").status_code == 400
+    assert client.get("/api/dataobjs?path=missing").status_code == 404
+
+
 def test_update_dataobj(test_app, client: FlaskClient, note_fixture):
     lorem = "Updated note content"
     resp = client.put("/api/dataobjs/1", json={"content": lorem})
@@ -176,6 +321,82 @@ def test_path_injection_fails(test_app, client: FlaskClient):
     assert resp.status_code == 400
 
 
+def test_create_dataobjs_bulk(test_app, client: FlaskClient):
+    resp = client.post(
+        "/api/dataobjs/bulk",
+        json=[
+            {"title": "First", "content": "#bulk# one", "tags": ["imported"]},
+            {"type": "note", "title": "Missing content"},
+            {
+                "type": "bookmark",
+                "url": "https://example.com",
+                "title": "Imported bookmark",
+                "content": "saved content",
+                "path": "",
+            },
+        ],
+    )
+    assert resp.status_code == 200
+    first, invalid, bookmark = resp.json
+    assert "error" in invalid
+    assert get_item(first["dataobj_id"])["title"] == "First"
+    assert get_item(bookmark["dataobj_id"]).content == "saved content"
+    assert get_tagged_ids("bulk") == [first["dataobj_id"]]
+
+    ndjson = "\n".join(
+        json.dumps({"title": f"Line {i}", "content": ""}) for i in range(3)
+    )
+    resp = client.post(
+        "/api/dataobjs/bulk", data=ndjson, content_type="application/x-ndjson"
+    )
+    ids = [result["dataobj_id"] for result in resp.json]
+    assert ids == list(range(ids[0], ids[0] + 3))
+
+    resp = client.post("/api/dataobjs/bulk", json={"title": "not a list"})
+    assert resp.status_code == 400
+
+
+def test_create_bookmarks_bulk_without_content(
+    test_app, client: FlaskClient, mocked_responses, monkeypatch
+):
+    mocked_responses.add(responses.GET, "http://example.org/bulk", body="Example\n")
+    existing = client.post(
+        "/api/bookmarks", json={"url": "http://example.org/bulk", "path": ""}
+    ).json["bookmark_id"]
+
+    bookmark = {"type": "bookmark", "url": "https://example.org/bulk/", "path": ""}
+    resp = client.post("/api/dataobjs/bulk", json=[bookmark])
+    assert resp.json == [{"dataobj_id": existing}]
+    assert len(mocked_responses.calls) == 1
+
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "enabled", True)
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "workers", 0)
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "duplicates", "create")
+    bookmark["url"] = "http://example.org/bulk"
+    resp = client.post("/api/dataobjs/bulk", json=[bookmark])
+    job_id = resp.json[0]["job_id"]
+    assert len(mocked_responses.calls) == 1
+    jobs.run_pending()
+    job = client.get(f"/api/jobs/{job_id}").json
+    assert job["status"] == "done"
+    assert get_item(job["result"]["dataobj_id"]).content == "Example"
+
+
+def test_get_dataobj_links(test_app, client: FlaskClient, note_fixture):
+    linking = DataObj(
+        type="note", title="Linking", content=f"[[Test Note|{note_fixture.id}]]"
+    )
+    linking.insert()
+
+    resp = client.get(f"/api/dataobjs/{note_fixture.id}/links")
+    assert resp.status_code == 200
+    assert resp.json == {"backlinks": [linking.id], "outlinks": []}
+    resp = client.get(f"/api/dataobjs/{linking.id}/neighbourhood?hops=1")
+    assert resp.json["nodes"] == [note_fixture.id, linking.id]
+    assert resp.json["edges"] == [[linking.id, note_fixture.id]]
+    assert client.get("/api/dataobjs/1000/links").status_code == 404
+
+
 def test_search_using_ripgrep(test_app, client: FlaskClient, note_fixture):
     test_app.config["SEARCH_CONF"]["engine"] = "ripgrep"
     test_app.config["SEARCH_CONF"]["enabled"] = 1
@@ -188,6 +409,33 @@ def test_search_using_ripgrep(test_app, client: FlaskClient, note_fixture):
     test_app.config["SEARCH_CONF"]["enabled"] = 0
 
 
+def test_search_with_limit_and_offset(test_app, client: FlaskClient):
+    test_app.config["SEARCH_CONF"]["engine"] = "builtin"
+    test_app.config["SEARCH_CONF"]["enabled"] = 1
+    for i in range(3):
+        DataObj(type="note", title=f"Note {i}", content="paging " * (3 - i)).insert()
+
+    resp = client.get("/api/search?query=paging")
+    assert [hit["title"] for hit in resp.json] == ["Note 0", "Note 1", "Note 2"]
+    resp = client.get("/api/search?query=paging&limit=1&offset=1")
+    assert [hit["title"] for hit in resp.json] == ["Note 1"]
+    test_app.config["SEARCH_CONF"]["enabled"] = 0
+
+
+def test_search_params_validation(test_app, client: FlaskClient, monkeypatch):
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "engine", "builtin")
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "enabled", 1)
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "default_limit", 2)
+    for i in range(3):
+        DataObj(type="note", title=f"Note {i}", content="capped").insert()
+
+    assert len(client.get("/api/search?query=capped").json) == 2
+    assert len(client.get("/api/search?query=capped&limit=3").json) == 3
+    for params in ("limit=-1", "offset=-2", "limit=abc", "max_count=-1"):
+        resp = client.get(f"/api/search?query=capped&{params}")
+        assert resp.status_code == 400
+
+
 def test_searching_on_disabled(test_app, client):
     test_app.config["SEARCH_CONF"]["enabled"] = 0
     resp = client.get("/api/search?query=shouldn't-work")
@@ -245,9 +493,7 @@ def test_uploading_image_with_same_name_doesnt_collide(test_app, client):
 def test_add_tag_to_index(test_app, client):
     resp = client.put("/api/tags/add_to_index", json={"tag": "new-tag"})
     assert resp.status_code == 200
-    db = get_db()
-    tag_list = db.search(Query().name == "tag_list")[0]["val"]
-    assert "new-tag" in tag_list
+    assert "new-tag" in get_all_tags()
 
 
 def test_adding_invalid_tag_name_fails(test_app, client):
@@ -256,3 +502,24 @@ def test_adding_invalid_tag_name_fails(test_app, client):
         resp = client.put("/api/tags/add_to_index", json={"tag": tag})
         assert b"Must provide valid tag name" in resp.data
         assert resp.status_code == 401
+
+
+def test_get_folder_listing(test_app, client: FlaskClient, note_fixture):
+    create_dir("t/nested")
+    DataObj(type="note", title="Nested note", path="t").insert()
+
+    resp = client.get("/api/folders")
+    assert resp.status_code == 200
+    assert resp.json["path"] == ""
+    assert resp.json["files"] == [{"id": note_fixture.id, "title": "Test Note"}]
+    assert resp.json["dirs"] == [{"name": "t", "path": "t", "n_dirs": 1, "n_files": 1}]
+
+    resp = client.get("/api/folders?path=t")
+    assert resp.json["files"][0]["title"] == "Nested note"
+    assert resp.json["dirs"][0]["path"] == "t/nested"
+
+
+def test_get_folder_listing_of_invalid_dir_fails(test_app, client: FlaskClient):
+    for path in ["inexistent", "../"]:
+        resp = client.get(f"/api/folders?path={path}")
+        assert resp.status_code == 404
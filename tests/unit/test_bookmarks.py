@@ -0,0 +1,23 @@
+from archivy.bookmarks import normalize_url, find_bookmark, get_url_index
+from archivy.data import delete_item
+
+
+def test_normalize_url():
+    assert (
+        normalize_url("HTTP://Example.COM:80/page/?utm_source=x&q=1&fbclid=y#part")
+        == "https://example.com/page?q=1"
+    )
+    assert normalize_url("https://example.com/") == normalize_url("http://example.com")
+    assert normalize_url("https://example.com:8080/a") == "https://example.com:8080/a"
+    assert normalize_url("https://example.com/a?b=1") != normalize_url(
+        "https://example.com/a?b=2"
+    )
+
+
+def test_url_index_is_maintained(test_app, bookmark_fixture, note_fixture):
+    assert find_bookmark("http://example.com") == bookmark_fixture.id
+    assert find_bookmark("https://example.org") is None
+    assert get_url_index(force=True) == {"https://example.com": [bookmark_fixture.id]}
+
+    delete_item(bookmark_fixture.id)
+    assert find_bookmark("https://example.com/") is None
@@ -2,12 +2,11 @@ import os
 from pathlib import Path
 from tempfile import mkdtemp
 
-from tinydb import Query
-
 from archivy.cli import cli
-from archivy.helpers import get_db
+from archivy.helpers import get_store
 from archivy.models import DataObj
-from archivy.data import get_items, create_dir, get_data_dir
+from archivy import builtin_search, data
+from archivy.data import get_items, create_dir, get_data_dir, get_by_id
 
 
 def test_initialization(test_app, cli_runner, click_cli):
@@ -28,9 +27,7 @@ def test_initialization(test_app, cli_runner, click_cli):
         assert "Config successfully created" in res.output
 
         # verify user was created
-        assert len(
-            get_db().search(Query().type == "user" and Query().username == "username")
-        )
+        assert get_store().find_user("username")
 
         # verify dataobj creation works
         assert DataObj(type="note", title="Test note").insert()
@@ -135,25 +132,19 @@ def test_initialization_custom_host(test_app, cli_runner, click_cli):
 
 
 def test_create_admin(test_app, cli_runner, click_cli):
-    db = get_db()
-    nb_users = len(db.search(Query().type == "user"))
+    store = get_store()
+    nb_users = len(store.get_users())
     cli_runner.invoke(
         click_cli, ["create-admin", "__username__"], input="password\npassword"
     )
 
-    # need to reconnect to db because it has been modified by different processes
-    # so the connection needs to be updated for new changes
-    db = get_db(force_reconnect=True)
-    assert nb_users + 1 == len(db.search(Query().type == "user"))
-    assert len(db.search(Query().type == "user" and Query().username == "__username__"))
+    assert nb_users + 1 == len(store.get_users())
+    assert store.find_user("__username__")["is_admin"]
 
 
 def test_create_admin_small_password_fails(test_app, cli_runner, click_cli):
     cli_runner.invoke(click_cli, ["create-admin", "__username__"], input="short\nshort")
-    db = get_db()
-    assert not len(
-        db.search(Query().type == "user" and Query().username == "__username__")
-    )
+    assert not get_store().find_user("__username__")
 
 
 def test_format_multiple_md_file(test_app, cli_runner, click_cli):
@@ -254,3 +245,60 @@ def test_create_plugin_dir(test_app, cli_runner, click_cli):
         ]
         for file in files:
             assert (plugin_dir / file).exists()
+
+
+def test_bulk_index(test_app, cli_runner, click_cli, fake_elasticsearch, monkeypatch):
+    for i in range(5):
+        DataObj(type="note", title=f"Note {i}").insert()
+    es = fake_elasticsearch.instances[0]
+    es.documents = {}
+
+    res = cli_runner.invoke(click_cli, ["index", "--batch-size", "2"])
+    assert "Indexed 5 notes." in res.output
+    assert sorted(es.documents) == ["1", "2", "3", "4", "5"]
+    assert es.calls.count("bulk") == 3
+    # refreshes are disabled while indexing
+    assert ("put_settings", {"index": {"refresh_interval": "-1"}}) in es.calls
+    assert es.calls[-1] == "refresh"
+
+    # only reindex changed notes
+    data.update_item_frontmatter(2, {"title": "Changed"})
+    es.documents = {}
+    res = cli_runner.invoke(click_cli, ["index", "--changed-only"])
+    assert "Indexed 1 notes." in res.output
+    assert list(es.documents) == ["2"]
+    assert es.documents["2"]["title"] == "Changed"
+
+    # notes deleted outside archivy are removed from the index
+    get_by_id(3).unlink()
+    res = cli_runner.invoke(click_cli, ["index", "--changed-only"])
+    assert "Indexed 0 notes." in res.output
+    assert "delete" in es.calls
+
+    # each engine has its own manifest
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "engine", "builtin")
+    res = cli_runner.invoke(click_cli, ["index", "--changed-only"])
+    assert "Indexed 4 notes." in res.output
+    assert builtin_search.index_exists()
+
+
+def test_bulk_index_retries_failed_notes(
+    test_app, cli_runner, click_cli, fake_elasticsearch
+):
+    for i in range(3):
+        DataObj(type="note", title=f"Note {i}").insert()
+    es = fake_elasticsearch.instances[0]
+    es.documents = {}
+    es.rejected = {"2"}
+
+    res = cli_runner.invoke(click_cli, ["index"])
+    assert "Indexed 2 notes." in res.output
+    assert "Failed to index 1 notes." in res.output
+    assert sorted(es.documents) == ["1", "3"]
+
+    # the failed note wasn't recorded as indexed, so it is retried
+    es.rejected = set()
+    es.documents = {}
+    res = cli_runner.invoke(click_cli, ["index", "--changed-only"])
+    assert "Indexed 1 notes." in res.output
+    assert list(es.documents) == ["2"]
@@ -0,0 +1,201 @@
+import shutil
+import threading
+from types import SimpleNamespace
+
+from archivy import data
+from archivy.data import create_dir, get_by_id, get_data_dir
+from archivy.models import DataObj
+
+
+def test_id_index_follows_moves_and_renames(test_app, note_fixture):
+    create_dir("moved")
+    data.move_item(note_fixture.id, "moved")
+    assert get_by_id(note_fixture.id).parent.name == "moved"
+
+    data.rename_folder("moved", "renamed")
+    assert get_by_id(note_fixture.id).parent.name == "renamed"
+
+    data.delete_dir("renamed")
+    assert get_by_id(note_fixture.id) is None
+
+
+def test_id_index_is_rebuilt_after_external_changes(test_app, note_fixture):
+    file = get_by_id(note_fixture.id)
+    (get_data_dir() / "external").mkdir()
+    # move the file behind archivy's back
+    shutil.move(str(file), str(get_data_dir() / "external" / file.name))
+    assert get_by_id(note_fixture.id) == get_data_dir() / "external" / file.name
+
+    # index lost, eg. after a restart
+    note = DataObj(type="note", title="Other note")
+    note.insert()
+    data._id_indexes.clear()
+    assert get_by_id(note.id).name == f"{note.id}-Other_note.md"
+    assert get_by_id(12345) is None
+
+
+def test_catalog_only_parses_changed_files(test_app, note_fixture, monkeypatch):
+    create_dir("nested")
+    DataObj(type="note", title="Nested", tags=["nested-tag"], path="nested").insert()
+    catalog = data.get_catalog()
+    assert len(catalog.query()) == 2
+    assert catalog.query_dirs() == ["nested"]
+
+    parsed = []
+    load_frontmatter = data.load_frontmatter
+    monkeypatch.setattr(
+        data,
+        "load_frontmatter",
+        lambda path, **kwargs: parsed.append(path) or load_frontmatter(path, **kwargs),
+    )
+    data.get_items(structured=False)
+    assert parsed == []
+
+    data.update_item_frontmatter(note_fixture.id, {"title": "Changed title"})
+    items = data.get_items(structured=False)
+    assert len(parsed) == 1
+    assert "Changed title" in [item["title"] for item in items]
+
+
+def test_querying_catalog(test_app, note_fixture, bookmark_fixture):
+    create_dir("nested")
+    DataObj(type="note", title="Nested", tags=["nested-tag"], path="nested").insert()
+    catalog = data.get_catalog()
+    assert len(catalog.query(type="note")) == 2
+    assert len(catalog.query(type="bookmark")) == 1
+    assert [m["title"] for _, m in catalog.query(tag="nested-tag")] == ["Nested"]
+    assert [m["title"] for _, m in catalog.query(path="nested")] == ["Nested"]
+
+
+def test_dir_listing_uses_catalog_max_age(test_app, note_fixture, monkeypatch):
+    monkeypatch.setitem(test_app.config, "CATALOG_MAX_AGE", 3600)
+    assert [f["id"] for f in data.get_dir_listing()["files"]] == [note_fixture.id]
+    (get_data_dir() / "1000-external.md").write_text(
+        "---\nid: 1000\ntitle: External\n---\n"
+    )
+    # the catalog is reused until it's older than CATALOG_MAX_AGE
+    assert len(data.get_dir_listing()["files"]) == 1
+    monkeypatch.setitem(test_app.config, "CATALOG_MAX_AGE", 0)
+    assert len(data.get_dir_listing()["files"]) == 2
+
+
+def test_get_recent_items(test_app):
+    for i in range(8):
+        DataObj(type="note", title=f"Note {i}").insert()
+    # give each note a distinct modification date
+    for i, (relpath, _) in enumerate(data.get_catalog().query()):
+        dataobj_id = relpath.split("-", 1)[0]
+        data.update_item_frontmatter(dataobj_id, {"title": f"Note {i}"})
+        post = data.get_item(dataobj_id)
+        with open(post["fullpath"]) as f:
+            md = f.read()
+        with open(post["fullpath"], "w") as f:
+            f.write(md.replace(post["modified_at"], f"01/0{i + 1}/21 10:00"))
+
+    recent = data.get_recent_items(limit=5)
+    assert [post["title"] for post in recent] == [f"Note {i}" for i in range(7, 2, -1)]
+
+
+def test_catalog_snapshot(test_app, note_fixture, monkeypatch):
+    create_dir("nested")
+    nested = DataObj(type="note", title="Nested", path="nested")
+    nested.insert()
+    # yaml dates are restored as dates
+    (get_data_dir() / "dated.md").write_text(
+        "---\ntitle: Dated\nday: 2021-05-04\nat: 2021-05-04 10:00:00+02:00\n---\n"
+    )
+    catalog = data.get_catalog(max_age=0)
+    catalog.save_snapshot()
+
+    # after a restart, the catalog is loaded from the snapshot
+    restarted = data.Catalog(catalog.data_dir, catalog.snapshot_path)
+    assert restarted.load_snapshot()
+    assert restarted.files == catalog.files
+    assert restarted.query_dirs() == ["nested"]
+
+    parsed = []
+    load_frontmatter = data.load_frontmatter
+    monkeypatch.setattr(
+        data,
+        "load_frontmatter",
+        lambda path, **kwargs: parsed.append(path) or load_frontmatter(path, **kwargs),
+    )
+    # only files that changed since the snapshot are parsed when reconciling
+    data.update_item_frontmatter(note_fixture.id, {"title": "Changed title"})
+    get_by_id(nested.id).unlink()
+    restarted.scan()
+    assert len(parsed) == 1
+    assert sorted(metadata["title"] for _, metadata in restarted.query()) == [
+        "Changed title",
+        "Dated",
+    ]
+
+    # snapshots of another data dir are ignored
+    assert not data.Catalog("/elsewhere", catalog.snapshot_path).load_snapshot()
+    # and corrupt ones too
+    for content in ("{not json", '{"version": 2, "data_dir": 1, "files": []}'):
+        catalog.snapshot_path.write_text(content)
+        assert not data.Catalog(catalog.data_dir, catalog.snapshot_path).load_snapshot()
+
+
+def test_catalog_snapshot_is_served_on_startup(test_app, note_fixture, monkeypatch):
+    data.get_catalog().save_snapshot()
+    data._catalogs.clear()
+    started, scans = [], []
+    fake_threading = SimpleNamespace(
+        Lock=threading.Lock,
+        Thread=lambda target, daemon: SimpleNamespace(
+            start=lambda: started.append(target)
+        ),
+    )
+    monkeypatch.setattr(data, "threading", fake_threading)
+    monkeypatch.setattr(data.Catalog, "scan", lambda self: scans.append(self))
+
+    catalog = data.get_catalog()
+    assert data.get_catalog() is catalog
+    # reconciled by a single background scan, and not rescanned on each call
+    assert len(started) == 1
+    assert scans == []
+    assert len(catalog.query()) == 1
+
+
+def test_walk(test_app, note_fixture):
+    create_dir("b/nested")
+    create_dir("a")
+    nested = DataObj(type="note", title="Nested", path="b/nested")
+    nested.insert()
+    (get_data_dir() / "a" / "notes.txt").write_text("not a dataobj")
+
+    entries = list(data.walk(dirs=True))
+    assert [entry.relpath for entry in entries] == [
+        f"{note_fixture.id}-Test_Note.md",
+        "a",
+        "b",
+        "a/notes.txt",
+        "b/nested",
+        f"b/nested/{nested.id}-Nested.md",
+    ]
+    assert [entry.is_dir for entry in entries] == [0, 1, 1, 0, 1, 0]
+    assert entries[0].mtime_ns is None
+
+    md_files = list(data.walk(pattern="*.md", stat=True))
+    assert [entry.relpath for entry in md_files] == [
+        f"{note_fixture.id}-Test_Note.md",
+        f"b/nested/{nested.id}-Nested.md",
+    ]
+    assert md_files[1].size == get_by_id(nested.id).stat().st_size
+    assert [entry.relpath for entry in data.walk(get_data_dir() / "b")] == [
+        f"nested/{nested.id}-Nested.md"
+    ]
+    assert list(data.walk(get_data_dir() / "missing")) == []
+
+
+def test_walk_doesnt_follow_symlinks(test_app, note_fixture):
+    (get_data_dir() / "loop").symlink_to(get_data_dir(), target_is_directory=True)
+    assert [entry.relpath for entry in data.walk(pattern="*.md")] == [
+        f"{note_fixture.id}-Test_Note.md"
+    ]
+    assert len(data.get_catalog().query()) == 1
+    assert data.rebuild_id_index() == {
+        str(note_fixture.id): get_by_id(note_fixture.id).relative_to(get_data_dir())
+    }
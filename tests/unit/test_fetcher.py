@@ -0,0 +1,88 @@
+import time
+from pathlib import Path
+
+import pytest
+from responses import GET
+
+from archivy.fetcher import (
+    CACHE_DIRNAME,
+    fetch,
+    FetchError,
+    prune_cache,
+    _load_cached,
+)
+
+
+def test_fetch_revalidates_cached_pages(test_app, mocked_responses, monkeypatch):
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "http_cache", True)
+    requests_headers = []
+
+    def page(request):
+        requests_headers.append(request.headers)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return (304, {}, "")
+        return (200, {"ETag": '"v1"', "Content-Type": "text/html"}, "<p>page</p>")
+
+    mocked_responses.add_callback(GET, "https://example.com/page", page)
+
+    first = fetch("https://example.com/page")
+    second = fetch("https://example.com/page")
+    assert not first.from_cache
+    assert second.from_cache
+    assert first.text == second.text == "<p>page</p>"
+    assert "If-None-Match" not in requests_headers[0]
+    assert requests_headers[1]["If-None-Match"] == '"v1"'
+
+
+def test_fetch_enforces_size_cap(test_app, mocked_responses, monkeypatch):
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "max_page_size", 10)
+    mocked_responses.add(GET, "https://example.com/big", body="x" * 100)
+    with pytest.raises(FetchError):
+        fetch("https://example.com/big")
+    with pytest.raises(FetchError):
+        fetch("https://example.com/unreachable")
+
+
+def test_cache_is_pruned(test_app, mocked_responses, monkeypatch):
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "http_cache", True)
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "http_cache_max_size", 700)
+
+    def page(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return (304, {}, "")
+        return (200, {"ETag": '"v1"'}, "x" * 200)
+
+    for i in range(3):
+        mocked_responses.add_callback(GET, f"https://example.com/{i}", page)
+    cache_dir = Path(test_app.config["INTERNAL_DIR"]) / CACHE_DIRNAME
+
+    fetch("https://example.com/0")
+    fetch("https://example.com/1")
+    # make 0 the most recently used page
+    time.sleep(0.01)
+    assert fetch("https://example.com/0").from_cache
+    fetch("https://example.com/2")
+    assert len(list(cache_dir.glob("*.body"))) == 2
+    assert _load_cached("https://example.com/1") == (None, None)
+    assert _load_cached("https://example.com/0")[1] == b"x" * 200
+
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "http_cache_max_age", 0)
+    assert _load_cached("https://example.com/2") == (None, None)
+    prune_cache()
+    assert not list(cache_dir.iterdir())
+
+
+def test_fetch_respects_deadline(test_app, mocked_responses):
+    timeouts = []
+
+    def page(request):
+        timeouts.append(request.req_kwargs["timeout"])
+        return (200, {}, "page")
+
+    mocked_responses.add_callback(GET, "https://example.com/page", page)
+    with pytest.raises(FetchError):
+        fetch("https://example.com/page", deadline=time.monotonic() - 1)
+    assert not timeouts
+
+    fetch("https://example.com/page", deadline=time.monotonic() + 2)
+    assert all(0 < timeout <= 2 for timeout in timeouts[0])
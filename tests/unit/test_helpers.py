@@ -0,0 +1,113 @@
+import fnmatch
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+from archivy import helpers
+from archivy.helpers import ScrapingPatterns
+
+
+def _allocate_in_child(app, queue):
+    with app.app_context():
+        queue.put([helpers.allocate_ids()[0] for _ in range(200)])
+
+
+def test_ids_are_unique_across_processes(test_app, monkeypatch):
+    monkeypatch.setattr(helpers, "ID_BLOCK_SIZE", 7)
+    # lease ids before forking to check children don't reuse them
+    parent_ids = helpers.allocate_ids(3)
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    workers = [
+        ctx.Process(target=_allocate_in_child, args=(test_app, queue)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    ids = parent_ids + helpers.allocate_ids(4)
+    for _ in workers:
+        ids += queue.get(timeout=60)
+    for worker in workers:
+        worker.join()
+
+    assert len(ids) == len(set(ids)) == 3 + 4 + 4 * 200
+
+
+def test_unused_ids_are_released(test_app):
+    first = helpers.allocate_ids()[0]
+    assert helpers.get_max_id() == first
+    helpers.release_unused_ids()
+    assert helpers.get_store().get("max_id") == first
+    assert helpers.allocate_ids(2) == [first + 1, first + 2]
+
+
+def test_ids_are_locked_with_msvcrt_without_fcntl(test_app, monkeypatch):
+    calls = []
+    fake_msvcrt = SimpleNamespace(
+        LK_LOCK="lock",
+        LK_UNLCK="unlock",
+        locking=lambda fd, mode, nbytes: calls.append(mode),
+    )
+    monkeypatch.setattr(helpers, "fcntl", None)
+    monkeypatch.setattr(helpers, "msvcrt", fake_msvcrt)
+    monkeypatch.setattr(helpers, "_id_leases", {})
+
+    helpers.allocate_ids()
+    assert calls == ["lock", "unlock"]
+
+    # without any way to lock the ids, don't hand them out unlocked
+    monkeypatch.setattr(helpers, "msvcrt", None)
+    monkeypatch.setattr(helpers, "_id_leases", {})
+    with pytest.raises(RuntimeError):
+        helpers.allocate_ids()
+
+
+def test_scraping_patterns_match_first_pattern():
+    patterns = ScrapingPatterns(
+        {
+            "*wikipedia*": "generic",
+            "https://en.wikipedia.org/wiki/*": "specific",
+            "https://example.com/": "exact",
+            "https://example.com/*": "path",
+            "https://www.[nl][ya]times.com*": "times",
+            "*[]x]y.org*": "set",
+        }
+    )
+    urls = [
+        "https://en.wikipedia.org/wiki/Python",
+        "https://example.com/",
+        "https://example.com/page",
+        "https://www.latimes.com/news",
+        "https://example.org/",
+        "https://xy.org/",
+        "https://]y.org/",
+    ]
+    for url in urls:
+        expected = next(
+            (
+                handler
+                for pattern, handler in patterns.items()
+                if fnmatch.fnmatchcase(url, pattern)
+            ),
+            None,
+        )
+        assert patterns.match(url) == expected
+    assert patterns.match("https://en.wikipedia.org/wiki/Python") == "generic"
+    assert patterns.match("https://example.com/page") == "path"
+
+
+def test_scraping_patterns_with_groups(monkeypatch):
+    # on python <= 3.10, fnmatch.translate adds groups for patterns with several *
+    translate = fnmatch.translate
+    monkeypatch.setattr(fnmatch, "translate", lambda pattern: f"(){translate(pattern)}")
+    patterns = ScrapingPatterns(
+        {
+            "https://example.com/*/a/*": "first",
+            "https://example.com/*/b/*": "second",
+            "https://example.com/*": "path",
+        }
+    )
+    assert patterns.match("https://example.com/x/a/y") == "first"
+    assert patterns.match("https://example.com/x/b/y") == "second"
+    assert patterns.match("https://example.com/x") == "path"
@@ -0,0 +1,36 @@
+import time
+from contextlib import closing
+
+from archivy import jobs
+
+
+def test_jobs_resume_after_restart(test_app, monkeypatch):
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "echo", lambda payload: payload)
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "workers", 0)
+    queued = jobs.enqueue("echo", {"value": 1})
+    interrupted = jobs.enqueue("echo", {"value": 2})
+    with closing(jobs.connect()) as conn:
+        # left running by a process that was killed
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = 1 WHERE id = ?",
+            (jobs.RUNNING, interrupted),
+        )
+    jobs.stop_workers()
+
+    # restart
+    monkeypatch.setitem(test_app.config["JOBS_CONF"], "workers", 1)
+    jobs.resume_jobs()
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if all(
+                jobs.get_job(job_id)["status"] == jobs.DONE
+                for job_id in (queued, interrupted)
+            ):
+                break
+            time.sleep(0.1)
+        assert jobs.get_job(queued)["result"] == {"value": 1}
+        assert jobs.get_job(interrupted)["result"] == {"value": 2}
+        assert jobs.get_job(interrupted)["attempts"] == 2
+    finally:
+        jobs.stop_workers(timeout=30)
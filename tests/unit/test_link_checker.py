@@ -0,0 +1,94 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from archivy import link_checker
+from archivy.data import delete_item
+from archivy.models import DataObj
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def respond(self, send_body):
+        StubHandler.requests.append((self.command, self.path, time.monotonic()))
+        if self.path == "/redirect":
+            self.send_response(301)
+            self.send_header("Location", "/ok")
+        elif self.path == "/no-head" and self.command == "HEAD":
+            self.send_response(405)
+        elif self.path in ("/ok", "/no-head") or self.path.startswith("/page"):
+            self.send_response(200)
+        else:
+            self.send_response(404)
+        self.send_header("Content-Length", "2" if send_body else "0")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(b"ok")
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        self.respond(True)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    StubHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def add_bookmark(url):
+    return DataObj(type="bookmark", title="Bookmark", url=url).insert()
+
+
+def test_check_links(test_app, stub_server, monkeypatch):
+    monkeypatch.setitem(test_app.config["LINK_CHECK_CONF"], "host_delay", 0)
+    ok = add_bookmark(f"{stub_server}/ok")
+    redirect = add_bookmark(f"{stub_server}/redirect")
+    no_head = add_bookmark(f"{stub_server}/no-head")
+    gone = add_bookmark(f"{stub_server}/gone")
+    unreachable = add_bookmark("http://127.0.0.1:1/down")
+
+    assert link_checker.check_links() == 5
+    assert link_checker.get_link_check(ok)["status"] == 200
+    assert link_checker.get_link_check(redirect)["redirect"] == f"{stub_server}/ok"
+    assert link_checker.get_link_check(no_head)["status"] == 200
+    broken = {check["dataobj_id"]: check for check in link_checker.get_broken_links()}
+    assert set(broken) == {gone, unreachable}
+    assert broken[gone]["status"] == 404
+    assert broken[unreachable]["error"]
+
+    # recently checked links are skipped, deleted bookmarks are forgotten
+    delete_item(gone)
+    assert link_checker.check_links(max_age=60) == 0
+    assert link_checker.get_link_check(gone) is None
+
+
+def test_requests_to_a_host_are_spaced_out(test_app, stub_server, monkeypatch):
+    monkeypatch.setitem(test_app.config["LINK_CHECK_CONF"], "host_delay", 0.2)
+    for i in range(4):
+        add_bookmark(f"{stub_server}/page{i}")
+
+    link_checker.check_links()
+    times = sorted(request[2] for request in StubHandler.requests)
+    assert len(times) == 4
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+
+
+def test_check_links_command(test_app, stub_server, cli_runner, click_cli):
+    add_bookmark(f"{stub_server}/gone")
+    res = cli_runner.invoke(click_cli, ["check-links"])
+    assert "Checked 1 bookmarks." in res.output
+    assert f"{stub_server}/gone (status 404)" in res.output
@@ -0,0 +1,27 @@
+from archivy import data
+from archivy.links import get_backlinks, get_neighbourhood, get_outlinks
+from archivy.models import DataObj
+
+
+def test_link_graph_is_maintained(test_app):
+    first = DataObj(type="note", title="First")
+    first.insert()
+    second = DataObj(type="note", title="Second", content=f"[[First|{first.id}]]")
+    second.insert()
+    third = DataObj(type="note", title="Third", content=f"[[Second|{second.id}]]")
+    third.insert()
+
+    assert get_outlinks(second.id) == [first.id]
+    assert get_backlinks(first.id) == [second.id]
+    assert get_neighbourhood(first.id, hops=1)["nodes"] == [first.id, second.id]
+    neighbourhood = get_neighbourhood(first.id, hops=2)
+    assert neighbourhood["nodes"] == [first.id, second.id, third.id]
+    assert sorted(neighbourhood["edges"]) == [
+        [second.id, first.id],
+        [third.id, second.id],
+    ]
+
+    data.update_item_md(second.id, "no links")
+    assert get_backlinks(first.id) == []
+    data.delete_item(third.id)
+    assert get_backlinks(second.id) == []
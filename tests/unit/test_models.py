@@ -1,4 +1,5 @@
 from pathlib import Path
+import time
 
 import frontmatter
 
@@ -74,3 +75,64 @@ def test_bookmark_included_images_are_saved(test_app, client, mocked_responses):
     images_dir = Path(test_app.config["USER_DIR"]) / "images"
     assert images_dir.exists()
     assert (images_dir / "image.png").exists()
+
+
+def test_bookmark_images_are_downloaded_concurrently(
+    test_app, mocked_responses, monkeypatch
+):
+    mocked_responses.add(
+        GET,
+        "https://example.com",
+        body="""<html><img src='/a/pic.png'><img src='/b/pic.png'>
+        <img src='/big.png'><img src='/a/pic.png'></html>""",
+    )
+
+    def slow_image(request):
+        time.sleep(0.2)
+        return (200, {}, b"first")
+
+    mocked_responses.add_callback(GET, "https://example.com/a/pic.png", slow_image)
+    mocked_responses.add(GET, "https://example.com/b/pic.png", body=b"second")
+    mocked_responses.add(GET, "https://example.com/big.png", body=b"x" * 100)
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "save_images", True)
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "max_image_size", 10)
+
+    bookmark = DataObj(type="bookmark", url="https://example.com")
+    bookmark.process_bookmark_url()
+    images_dir = Path(test_app.config["USER_DIR"]) / "images"
+    # filenames follow the order of the page, not of the downloads
+    assert (images_dir / "pic.png").read_bytes() == b"first"
+    assert (images_dir / "pic-1.png").read_bytes() == b"second"
+    assert bookmark.content.count("/images/pic.png") == 2
+    assert "https://example.com/big.png" in bookmark.content
+
+
+def test_bookmark_images_past_deadline_are_skipped(
+    test_app, mocked_responses, monkeypatch
+):
+    mocked_responses.add(
+        GET,
+        "https://example.com",
+        body="""<html><img src='/slow.png'><img src='/queued.png'></html>""",
+    )
+
+    def slow_image(request):
+        time.sleep(0.5)
+        return (200, {}, b"slow")
+
+    mocked_responses.add_callback(GET, "https://example.com/slow.png", slow_image)
+    mocked_responses.add(GET, "https://example.com/queued.png", body=b"queued")
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "save_images", True)
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "image_workers", 1)
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "images_timeout", 0.1)
+
+    bookmark = DataObj(type="bookmark", url="https://example.com")
+    bookmark.process_bookmark_url()
+    # both images keep their original url: one timed out, the other never started
+    assert "https://example.com/slow.png" in bookmark.content
+    assert "https://example.com/queued.png" in bookmark.content
+    images_dir = Path(test_app.config["USER_DIR"]) / "images"
+    assert not list(images_dir.glob("slow*")) + list(images_dir.glob("queued*"))
+    assert [call.request.url for call in mocked_responses.calls] == [
+        "https://example.com/"
+    ]
@@ -0,0 +1,83 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from archivy.parsing import (
+    CPULimitExceeded,
+    _discard_pool,
+    extract_content,
+    fill_image_placeholders,
+    get_pool,
+    html_to_markdown,
+    parse_page,
+    run_limited,
+)
+
+PAGE = """<html><head><title>Parsing</title></head><body><article>
+<p>Some long enough paragraph about <a href="/parsing">parsing</a> pages.</p>
+<img src="/pic.png"><img src="https://example.org/other.png">
+</article></body></html>"""
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml"])
+def test_html_to_markdown_backends(parser):
+    parsed = html_to_markdown(PAGE, "https://example.com", parser=parser)
+    assert parsed["title"] == "Parsing"
+    assert "[parsing](https://example.com/parsing)" in parsed["content"]
+    assert "https://example.com/pic.png" in parsed["content"]
+    assert parsed["images"] == []
+
+
+def test_html_to_markdown_leaves_placeholders_for_images():
+    parsed = html_to_markdown(PAGE, "https://example.com", save_images=True)
+    assert parsed["images"] == [
+        ("https://example.com/pic.png", "pic.png"),
+        ("https://example.org/other.png", "other.png"),
+    ]
+    assert "archivy-image-0-end" in parsed["content"]
+    assert "archivy-image-1-end" in parsed["content"]
+
+
+def test_fill_image_placeholders():
+    images = [(f"https://example.com/{i}.png", f"{i}.png") for i in range(12)]
+    soup = BeautifulSoup(
+        "".join(f'<img src="{url}">' for url, _ in images), "html.parser"
+    )
+    content, found = extract_content(soup, "https://example.com", save_images=True)
+    assert found == images
+    saved = {url: f"/images/{filename}" for url, filename in images[1:]}
+    content = fill_image_placeholders(content, found, saved)
+    assert "archivy-image" not in content
+    assert "https://example.com/0.png" in content
+    for i in range(1, 12):
+        assert f"(/images/{i}.png)" in content
+
+
+def test_parse_page_in_worker(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "parser_workers", 1)
+    parsed = parse_page(PAGE, "https://example.com")
+    assert parsed == html_to_markdown(PAGE, "https://example.com")
+
+
+def test_workers_dont_import_archivy(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "parser_workers", 1)
+    # start from fresh workers, that haven't run functions from other modules
+    _discard_pool(get_pool())
+    modules = get_pool().submit(
+        run_limited, 0, eval, "sorted(__import__('sys').modules)"
+    )
+    modules = modules.result(timeout=30)
+    assert "archivy_parser" in modules
+    assert not [name for name in modules if name.split(".")[0] in ("archivy", "flask")]
+
+
+def busy_loop():
+    while True:
+        pass
+
+
+def test_workers_cpu_limit(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config["SCRAPING_CONF"], "parser_workers", 1)
+    with pytest.raises(CPULimitExceeded):
+        get_pool().submit(run_limited, 1, busy_loop).result(timeout=30)
+    # the worker is still usable afterwards
+    assert get_pool().submit(run_limited, 1, sum, [1, 2]).result(timeout=30) == 3
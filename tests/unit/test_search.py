@@ -0,0 +1,95 @@
+from archivy import builtin_search, helpers, search
+from archivy.data import delete_item, get_data_dir
+from archivy.models import DataObj
+
+
+def test_elastic_client_is_reused(
+    test_app, note_fixture, fake_elasticsearch, monkeypatch
+):
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "es_timeout", 5)
+
+    search.add_to_index(note_fixture)
+    search.add_to_index(note_fixture)
+    search.remove_from_index(note_fixture.id)
+    es = helpers.get_elastic_client()
+    assert len(fake_elasticsearch.instances) == 1
+    assert es.options["timeout"] == 5
+    # a single health check, then one request per operation
+    assert es.calls == ["health", "index", "index", "delete"]
+
+    # health is checked again once the ttl expires
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "es_health_ttl", 0)
+    helpers.get_elastic_client()
+    assert es.calls[-1] == "health"
+
+
+def test_builtin_search(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "enabled", 1)
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "engine", "builtin")
+    often = DataObj(
+        type="note", title="Gardening", content="tomato tomato tomato\nsoil"
+    )
+    once = DataObj(type="note", title="Cooking", content="a tomato salad")
+    unrelated = DataObj(type="note", title="Travel", content="trains")
+    for dataobj in (often, once, unrelated):
+        dataobj.insert()
+
+    hits = search.search("tomato")
+    assert [hit["id"] for hit in hits] == [often.id, once.id]
+    assert hits[0]["title"] == "Gardening"
+    assert hits[0]["matches"] == ["tomato tomato tomato"]
+
+    assert [hit["id"] for hit in search.search("tomato salad", strict=True)] == [
+        once.id
+    ]
+
+    delete_item(once.id)
+    assert [hit["id"] for hit in search.search("tomato")] == [often.id]
+
+
+def test_build_builtin_index(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "enabled", 1)
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "engine", "builtin")
+    note = DataObj(type="note", title="Indexed", content="orchard trees")
+    note.insert()
+    # indexing single dataobjs doesn't make the index complete
+    assert not builtin_search.index_exists()
+
+    (get_data_dir() / "90000-broken.md").write_text("---\nid: [unclosed\n---\n")
+    (get_data_dir() / "90001-external.md").write_text(
+        "---\nid: 90001\ntitle: External\n---\norchard"
+    )
+    assert builtin_search.build_index() == 2
+    assert builtin_search.index_exists()
+    assert {hit["id"] for hit in search.search("orchard")} == {note.id, 90001}
+
+
+def test_builtin_search_default_limit(test_app, monkeypatch):
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "enabled", 1)
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "engine", "builtin")
+    monkeypatch.setitem(test_app.config["SEARCH_CONF"], "default_limit", 2)
+    for i in range(4):
+        DataObj(type="note", title=f"Note {i}", content="capped " * (4 - i)).insert()
+
+    assert len(search.search("capped")) == 2
+    assert [hit["title"] for hit in search.search("capped", limit=3, offset=2)] == [
+        "Note 2",
+        "Note 3",
+    ]
+
+
+def test_ripgrep_results_are_ranked_before_paging(test_app, monkeypatch):
+    # notes in path order, with 1, 3 and 2 matching lines
+    events = []
+    for dataobj_id, n_matches in ((1, 1), (2, 3), (3, 2)):
+        events.append(({"id": dataobj_id, "title": "", "matches": []}, "begin"))
+        events += [(f"match {i}", "match") for i in range(n_matches)]
+    monkeypatch.setattr(search, "which", lambda name: f"/usr/bin/{name}")
+    monkeypatch.setattr(
+        search, "stream_ripgrep", lambda rg_cmd: (event for event in events)
+    )
+
+    hits = search.query_ripgrep("match", limit=2)
+    assert [hit["id"] for hit in hits] == [2, 3]
+    hits = search.query_ripgrep("match", limit=2, offset=2)
+    assert [hit["id"] for hit in hits] == [1]
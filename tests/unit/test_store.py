@@ -0,0 +1,85 @@
+import multiprocessing
+
+import pytest
+from tinydb import TinyDB
+
+from archivy.store import SQLiteStore, TinyDBStore
+
+
+@pytest.mark.parametrize("store_cls", [SQLiteStore, TinyDBStore])
+def test_store(tmp_path, store_cls):
+    store = store_cls(tmp_path)
+    assert store.get("max_id", 0) == 0
+    store.set("max_id", 3)
+    store.set("tag_list", {"tag": [1, 2]})
+    assert store.get("max_id") == 3
+    assert store.get("tag_list") == {"tag": [1, 2]}
+    store.delete("max_id")
+    assert store.get("max_id") is None
+
+    user_id = store.add_user("user", "hash", is_admin=True)
+    assert store.add_user("user", "other hash") is None
+    store.update_user(user_id, hashed_password="new hash")
+    assert store.get_user(user_id) == store.find_user("user")
+    assert store.find_user("user") == {
+        "id": user_id,
+        "username": "user",
+        "hashed_password": "new hash",
+        "is_admin": True,
+    }
+    assert len(store.get_users()) == 1
+
+
+@pytest.mark.parametrize("store_cls", [SQLiteStore, TinyDBStore])
+def test_store_index(tmp_path, store_cls):
+    store = store_cls(tmp_path)
+    assert not store.index_exists("tags")
+    store.replace_index("tags", {"a": [2, 1], "b": [1], "unused": []})
+    assert store.index_exists("tags")
+    assert store.get_index("tags") == {"a": [1, 2], "b": [1], "unused": []}
+
+    store.update_index("tags", {1: {"b", "c"}, 3: {"a"}})
+    assert store.get_index_ids("tags", "a") == [2, 3]
+    assert store.get_index_keys("tags", 1) == ["b", "c"]
+    store.update_index("tags", {2: ()})
+    store.add_index_key("tags", "new")
+    store.remove_index_keys("tags", ["unused"])
+    assert store.get_index("tags") == {"a": [3], "b": [1], "c": [1], "new": []}
+
+
+def test_sqlite_store_migrates_db_json(tmp_path):
+    with TinyDB(str(tmp_path / "db.json")) as db:
+        db.insert({"name": "max_id", "val": 7})
+        db.insert({"name": "tag_list", "val": ["tag"]})
+        user_id = db.insert(
+            {"username": "user", "hashed_password": "hash", "type": "user"}
+        )
+        db.insert({"type": "metadata", "author": "plugin data"})
+
+    store = SQLiteStore(tmp_path)
+    assert store.get("max_id") == 7
+    assert store.get("tag_list") == ["tag"]
+    assert store.get_user(user_id)["username"] == "user"
+
+    # the migration only happens once
+    store.set("max_id", 8)
+    assert SQLiteStore(tmp_path).get("max_id") == 8
+
+
+def _index_in_child(internal_dir, first_id):
+    store = SQLiteStore(internal_dir)
+    for dataobj_id in range(first_id, first_id + 50):
+        store.update_index("tags", {dataobj_id: {"shared", f"tag-{dataobj_id}"}})
+
+
+def test_sqlite_store_index_is_shared_between_processes(tmp_path):
+    SQLiteStore(tmp_path).replace_index("tags", {})
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(target=_index_in_child, args=(tmp_path, i * 50)) for i in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert SQLiteStore(tmp_path).get_index_ids("tags", "shared") == list(range(200))
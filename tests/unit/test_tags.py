@@ -0,0 +1,32 @@
+from archivy import data
+from archivy.helpers import get_store
+from archivy.models import DataObj
+from archivy.tags import get_tag_counts, get_tagged_ids, get_tag_index
+
+
+def test_tag_index_is_maintained(test_app):
+    note = DataObj(
+        type="note", title="Tagged", tags=["meta"], content="text #embedded# text"
+    )
+    note.insert()
+    other = DataObj(type="note", title="Other", tags=["meta"], path="folder")
+    data.create_dir("folder")
+    other.insert()
+    assert get_tag_counts() == {"meta": 2, "embedded": 1}
+    assert get_tagged_ids("embedded") == [note.id]
+
+    data.update_item_md(note.id, "no more embedded tags")
+    assert get_tagged_ids("embedded") == []
+    data.delete_item(note.id)
+    assert get_tagged_ids("meta") == [other.id]
+    data.delete_dir("folder")
+    assert get_tagged_ids("meta") == []
+
+
+def test_legacy_tag_list_is_migrated(test_app, note_fixture):
+    get_store().set("tag_list", ["unused"])
+    tag_index = get_tag_index(force=True)
+    assert tag_index["unused"] == []
+    assert tag_index["testing"] == [note_fixture.id]
+    assert get_store().get("tag_list") is None
+    assert get_tag_counts()["unused"] == 0
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import frontmatter
+import pytest
+
+from archivy import data, watcher
+from archivy.links import get_backlinks
+from archivy.tags import get_tagged_ids
+
+
+def edit_externally(path, **changes):
+    post = frontmatter.load(path)
+    for key, value in changes.items():
+        if key == "content":
+            post.content = value
+        else:
+            post[key] = value
+    # make sure the mtime changes on filesystems with coarse timestamps
+    time.sleep(0.01)
+    path.write_text(frontmatter.dumps(post), encoding="utf-8")
+
+
+def test_change_queue_debounces_bursts():
+    queue = watcher.ChangeQueue(0.2)
+    results = []
+    consumer = threading.Thread(target=lambda: results.append(queue.wait_for_changes()))
+    consumer.start()
+    for i in range(5):
+        queue.add(f"note-{i}.md")
+        time.sleep(0.05)
+    queue.add("note-0.md")
+    consumer.join(timeout=5)
+    assert results == [{f"note-{i}.md" for i in range(5)}]
+
+
+def test_sync_files(test_app, note_fixture, bookmark_fixture):
+    note_path = data.get_by_id(note_fixture.id)
+    # files written by archivy are skipped
+    assert watcher.sync_files([note_path]) == 0
+
+    edit_externally(
+        note_path,
+        tags=["external"],
+        content=f"Edited in vim, see [[bookmark|{bookmark_fixture.id}]]",
+    )
+    new_path = data.get_data_dir() / "1000-external.md"
+    new_path.write_text("---\nid: 1000\ntitle: external\n---\n#synced#")
+    not_formatted = data.get_data_dir() / "not-formatted.md"
+    not_formatted.write_text("just text")
+
+    assert watcher.sync_files([note_path, new_path, not_formatted]) == 2
+    assert note_fixture.id in get_tagged_ids("external")
+    assert 1000 in get_tagged_ids("synced")
+    assert get_backlinks(bookmark_fixture.id) == [note_fixture.id]
+    assert data.get_by_id(1000) == new_path
+
+    # moved files are reindexed at their new path, deleted ones are forgotten
+    moved_path = data.get_data_dir() / "moved" / new_path.name
+    moved_path.parent.mkdir()
+    new_path.rename(moved_path)
+    bookmark_path = data.get_by_id(bookmark_fixture.id)
+    bookmark_path.unlink()
+    assert watcher.sync_files([new_path, moved_path, bookmark_path]) == 2
+    assert data.get_by_id(1000) == moved_path
+    assert get_backlinks(bookmark_fixture.id) == []
+    assert bookmark_fixture.id not in get_tagged_ids("testing")
+
+
+def test_sync_files_through_symlink(test_app, note_fixture, tmp_path):
+    alias = tmp_path / "alias"
+    alias.symlink_to(data.get_data_dir().resolve(), target_is_directory=True)
+    note_path = alias / data.get_by_id(note_fixture.id).name
+    # files written by archivy are recognized whatever path they're reported at
+    assert watcher.sync_files([note_path]) == 0
+
+    edit_externally(note_path, tags=["aliased"])
+    assert watcher.sync_files([note_path]) == 1
+    assert note_fixture.id in get_tagged_ids("aliased")
+    assert data.get_by_id(note_fixture.id) == data.get_data_dir() / note_path.name
+
+
+def test_watcher_picks_up_external_edits(test_app, note_fixture, monkeypatch):
+    pytest.importorskip("watchdog")
+    monkeypatch.setitem(test_app.config["WATCHER_CONF"], "debounce", 0.1)
+    assert watcher.start_watcher()
+    edit_externally(data.get_by_id(note_fixture.id), tags=["watched"])
+    for _ in range(50):
+        if note_fixture.id in get_tagged_ids("watched"):
+            break
+        time.sleep(0.1)
+    assert note_fixture.id in get_tagged_ids("watched")